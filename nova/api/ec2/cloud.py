@@ -885,19 +885,43 @@ class CloudController(object):
         return result
 
     def describe_instances(self, context, **kwargs):
-        # Optional DescribeInstances argument
+        # Optional DescribeInstances arguments
         instance_id = kwargs.get('instance_id', None)
+        max_results = kwargs.get('max_results', None)
+        next_token = kwargs.get('next_token', None)
         return self._format_describe_instances(context,
-                instance_id=instance_id)
+                instance_id=instance_id, max_results=max_results,
+                next_token=next_token)
 
     def describe_instances_v6(self, context, **kwargs):
-        # Optional DescribeInstancesV6 argument
+        # Optional DescribeInstancesV6 arguments
         instance_id = kwargs.get('instance_id', None)
+        max_results = kwargs.get('max_results', None)
+        next_token = kwargs.get('next_token', None)
         return self._format_describe_instances(context,
-                instance_id=instance_id, use_v6=True)
-
-    def _format_describe_instances(self, context, **kwargs):
-        return {'reservationSet': self._format_instances(context, **kwargs)}
+                instance_id=instance_id, use_v6=True,
+                max_results=max_results, next_token=next_token)
+
+    def _format_describe_instances(self, context, instance_id=None,
+                                   use_v6=False, max_results=None,
+                                   next_token=None):
+        # NOTE: next_token is the ec2 id of the last instance of the
+        # previous page; it is used as the marker for the DB query.
+        marker = None
+        if next_token:
+            marker = ec2utils.ec2_inst_id_to_uuid(context, next_token)
+        limit = None
+        if max_results:
+            limit = int(max_results)
+        instances = self._get_instances(context, instance_id=instance_id,
+                                        limit=limit, marker=marker)
+        result = {'reservationSet': self._format_reservations(context,
+                                                              instances,
+                                                              use_v6=use_v6)}
+        if limit and len(instances) == limit:
+            result['nextToken'] = ec2utils.id_to_ec2_inst_id(
+                    instances[-1]['uuid'])
+        return result
 
     def _format_run_instances(self, context, reservation_id):
         i = self._format_instances(context, reservation_id=reservation_id)
@@ -924,12 +948,14 @@ class CloudController(object):
         return {'instancesSet': instances_set}
 
     def _format_instance_bdm(self, context, instance_uuid, root_device_name,
-                             result):
+                             result, bdms=None):
         """Format InstanceBlockDeviceMappingResponseItemType"""
+        if bdms is None:
+            bdms = db.block_device_mapping_get_all_by_instance(context,
+                                                               instance_uuid)
         root_device_type = 'instance-store'
         mapping = []
-        for bdm in db.block_device_mapping_get_all_by_instance(context,
-                                                               instance_uuid):
+        for bdm in bdms:
             volume_id = bdm['volume_id']
             if (volume_id is None or bdm['no_device']):
                 continue
@@ -981,7 +1007,12 @@ class CloudController(object):
         #               that it will be making a variety of database calls
         #               rather than simply formatting a bunch of instances that
         #               were handed to it
-        reservations = {}
+        instances = self._get_instances(context, instance_id=instance_id,
+                                        search_opts=search_opts)
+        return self._format_reservations(context, instances, use_v6=use_v6)
+
+    def _get_instances(self, context, instance_id=None, limit=None,
+                       marker=None, search_opts=None):
         # NOTE(vish): instance_id is an optional list of ids to filter by
         if instance_id:
             instances = []
@@ -993,27 +1024,57 @@ class CloudController(object):
                 except exception.NotFound:
                     continue
                 instances.append(instance)
-        else:
-            try:
-                # always filter out deleted instances
-                search_opts['deleted'] = False
-                instances = self.compute_api.get_all(context,
-                                                     search_opts=search_opts,
-                                                     sort_dir='asc')
-            except exception.NotFound:
-                instances = []
+            return instances
+
+        if search_opts is None:
+            search_opts = {}
+        try:
+            # always filter out deleted instances
+            search_opts['deleted'] = False
+            return self.compute_api.get_all(context,
+                                            search_opts=search_opts,
+                                            sort_dir='asc',
+                                            limit=limit,
+                                            marker=marker)
+        except exception.MarkerNotFound:
+            raise
+        except exception.NotFound:
+            return []
+
+    def _format_reservations(self, context, instances, use_v6=False):
+        if not context.is_admin:
+            instances = [instance for instance in instances
+                         if instance['image_ref'] != str(FLAGS.vpn_image_id)]
+
+        # NOTE: the ec2 ids, image ids, block device mappings and zones of
+        # all the instances are looked up once here, rather than with a few
+        # queries for every instance.
+        instance_uuids = [instance['uuid'] for instance in instances]
+        ec2_ids = ec2utils.id_to_ec2_inst_ids(instance_uuids)
+        image_uuids = [instance['image_ref'] for instance in instances]
+        for instance in instances:
+            image_uuids.extend(filter(None, (instance['kernel_id'],
+                                             instance['ramdisk_id'])))
+        image_ids = ec2utils.glance_ids_to_ids(context, image_uuids)
+        bdms = dict((instance_uuid, []) for instance_uuid in instance_uuids)
+        for bdm in db.block_device_mapping_get_all_by_instances(
+                context, instance_uuids):
+            bdms[bdm['instance_uuid']].append(bdm)
+        zones = ec2utils.get_availability_zones_by_host(context)
+
+        reservations = {}
         for instance in instances:
-            if not context.is_admin:
-                if instance['image_ref'] == str(FLAGS.vpn_image_id):
-                    continue
             i = {}
             instance_uuid = instance['uuid']
-            ec2_id = ec2utils.id_to_ec2_inst_id(instance_uuid)
-            i['instanceId'] = ec2_id
+            i['instanceId'] = ec2_ids[instance_uuid]
             image_uuid = instance['image_ref']
-            i['imageId'] = ec2utils.glance_id_to_ec2_id(context, image_uuid)
-            self._format_kernel_id(context, instance, i, 'kernelId')
-            self._format_ramdisk_id(context, instance, i, 'ramdiskId')
+            i['imageId'] = ec2utils.image_ec2_id(image_ids.get(image_uuid))
+            if instance['kernel_id']:
+                i['kernelId'] = ec2utils.image_ec2_id(
+                        image_ids[instance['kernel_id']], 'aki')
+            if instance['ramdisk_id']:
+                i['ramdiskId'] = ec2utils.image_ec2_id(
+                        image_ids[instance['ramdisk_id']], 'ari')
             i['instanceState'] = _state_description(
                 instance['vm_state'], instance['shutdown_terminate'])
 
@@ -1047,10 +1108,9 @@ class CloudController(object):
             i['amiLaunchIndex'] = instance['launch_index']
             self._format_instance_root_device_name(instance, i)
             self._format_instance_bdm(context, instance['uuid'],
-                                      i['rootDeviceName'], i)
-            host = instance['host']
-            services = db.service_get_all_by_host(context.elevated(), host)
-            zone = ec2utils.get_availability_zone_by_host(services, host)
+                                      i['rootDeviceName'], i,
+                                      bdms=bdms[instance['uuid']])
+            zone = zones.get(instance['host'], 'unknown zone')
             i['placement'] = {'availabilityZone': zone}
             if instance['reservation_id'] not in reservations:
                 r = {}
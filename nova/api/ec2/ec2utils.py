@@ -63,6 +63,18 @@ def glance_id_to_id(context, glance_id):
         return db.s3_image_create(context, glance_id)['id']
 
 
+def glance_ids_to_ids(context, glance_ids):
+    """Convert glance ids to internal (db) ids, as {glance_id: id}."""
+    glance_ids = set(glance_id for glance_id in glance_ids
+                     if glance_id is not None)
+    ids = {}
+    for s3_image in db.s3_image_get_all_by_uuids(context, list(glance_ids)):
+        ids.setdefault(s3_image['uuid'], s3_image['id'])
+    for glance_id in glance_ids - set(ids):
+        ids[glance_id] = db.s3_image_create(context, glance_id)['id']
+    return ids
+
+
 def ec2_id_to_glance_id(context, ec2_id):
     image_id = ec2_id_to_id(ec2_id)
     return id_to_glance_id(context, image_id)
@@ -122,6 +134,14 @@ def get_availability_zone_by_host(services, host):
     return 'unknown zone'
 
 
+def get_availability_zones_by_host(context):
+    """Return {host: availability zone} of all the hosts with a service."""
+    zones = {}
+    for service in db.service_get_all(context.elevated(read_deleted='no')):
+        zones.setdefault(service['host'], service['availability_zone'])
+    return zones
+
+
 def id_to_ec2_id(instance_id, template='i-%08x'):
     """Convert an instance ID (int) to an ec2 ID (i-[base 16 number])"""
     return template % int(instance_id)
@@ -137,6 +157,17 @@ def id_to_ec2_inst_id(instance_id):
         return id_to_ec2_id(instance_id)
 
 
+def id_to_ec2_inst_ids(instance_ids):
+    """Get or create the ec2 instance IDs of instances, as {id: ec2 ID}."""
+    instance_uuids = [instance_id for instance_id in instance_ids
+                      if utils.is_uuid_like(instance_id)]
+    ctxt = context.get_admin_context()
+    int_ids = get_int_ids_from_instance_uuids(ctxt, instance_uuids)
+    return dict((instance_id,
+                 id_to_ec2_id(int_ids.get(instance_id, instance_id)))
+                for instance_id in instance_ids)
+
+
 def ec2_inst_id_to_uuid(context, ec2_id):
     """"Convert an instance id to  uuid."""
     int_id = ec2_id_to_id(ec2_id)
@@ -185,6 +216,16 @@ def get_int_id_from_instance_uuid(context, instance_uuid):
         return db.ec2_instance_create(context, instance_uuid)['id']
 
 
+def get_int_ids_from_instance_uuids(context, instance_uuids):
+    """Get or create the ec2 instance ids of instances, as {uuid: id}."""
+    instance_uuids = set(instance_uuids)
+    int_ids = db.get_ec2_instance_ids_by_uuids(context, list(instance_uuids))
+    for instance_uuid in instance_uuids - set(int_ids):
+        int_ids[instance_uuid] = db.ec2_instance_create(context,
+                                                        instance_uuid)['id']
+    return int_ids
+
+
 def get_int_id_from_volume_uuid(context, volume_uuid):
     if volume_uuid is None:
         return
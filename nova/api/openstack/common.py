@@ -188,6 +188,14 @@ def limited(items, request, max_limit=FLAGS.osapi_max_limit):
     return items[offset:range_end]
 
 
+def get_limit_and_marker(request, max_limit=FLAGS.osapi_max_limit):
+    """Return (limit, marker) from request, capping limit at max_limit."""
+    params = get_pagination_params(request)
+    limit = min(max_limit, params.get('limit', max_limit))
+    marker = params.get('marker')
+    return limit, marker
+
+
 def limited_by_marker(items, request, max_limit=FLAGS.osapi_max_limit):
     """Return a slice of items according to the requested marker and limit."""
     params = get_pagination_params(request)
@@ -213,6 +213,25 @@ class HostController(object):
     def reboot(self, req, id):
         return self._host_power_action(req, host=id, action="reboot")
 
+    @check_host
+    def prefetch_images(self, req, id, body):
+        """Has a host fetch images into its image cache."""
+        context = req.environ['nova.context']
+        authorize(context)
+        try:
+            image_ids = body['prefetch_images']['image_ids']
+        except (TypeError, KeyError):
+            explanation = _("Missing 'image_ids' in request body")
+            raise webob.exc.HTTPBadRequest(explanation=explanation)
+        if (not isinstance(image_ids, list) or
+            not all(isinstance(image_id, basestring)
+                    for image_id in image_ids)):
+            explanation = _("'image_ids' must be a list of image ids")
+            raise webob.exc.HTTPBadRequest(explanation=explanation)
+
+        self.api.prefetch_images(context, host=id, image_ids=image_ids)
+        return webob.Response(status_int=202)
+
     @wsgi.serializers(xml=HostShowTemplate)
     def show(self, req, id):
         """Shows the physical/usage resource given by hosts.
@@ -301,5 +320,5 @@ class Hosts(extensions.ExtensionDescriptor):
                 HostController(),
                 collection_actions={'update': 'PUT'},
                 member_actions={"startup": "GET", "shutdown": "GET",
-                        "reboot": "GET"})]
+                        "reboot": "GET", "prefetch_images": "POST"})]
         return resources
@@ -455,10 +455,16 @@ class Controller(wsgi.Controller):
             else:
                 search_opts['user_id'] = context.user_id
 
-        instance_list = self.compute_api.get_all(context,
-                                                 search_opts=search_opts)
+        limit, marker = common.get_limit_and_marker(req)
+        try:
+            limited_list = self.compute_api.get_all(context,
+                                                    search_opts=search_opts,
+                                                    limit=limit,
+                                                    marker=marker)
+        except exception.MarkerNotFound:
+            msg = _('marker [%s] not found') % marker
+            raise exc.HTTPBadRequest(explanation=msg)
 
-        limited_list = self._limit_items(instance_list, req)
         if is_detail:
             self._add_instance_faults(context, limited_list)
             response = self._view_builder.detail(req, limited_list)
@@ -955,9 +961,6 @@ class Controller(wsgi.Controller):
         self.compute_api.set_admin_password(context, server, password)
         return webob.Response(status_int=202)
 
-    def _limit_items(self, items, req):
-        return common.limited_by_marker(items, req)
-
     def _validate_metadata(self, metadata):
         """Ensure that we can work with the metadata given."""
         try:
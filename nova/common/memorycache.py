@@ -18,47 +18,131 @@
 
 """Super simple fake memcache client."""
 
+from nova import flags
+from nova.openstack.common import cfg
 from nova.openstack.common import timeutils
 
 
+memorycache_opts = [
+    cfg.IntOpt('memorycache_max_entries',
+               default=10000,
+               help='Maximum number of entries of each in process cache used '
+                    'in place of memcached; the least recently used entries '
+                    'are evicted beyond it. 0 for no limit'),
+    ]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(memorycache_opts)
+
+# NOTE: indexes of the fields of an entry, which is a link of a circular
+# doubly linked list ordered from the least to the most recently used.
+_PREV, _NEXT, _KEY, _TIMEOUT, _VALUE = range(5)
+
+
 class Client(object):
-    """Replicates a tiny subset of memcached client interface."""
+    """Replicates a tiny subset of memcached client interface.
+
+    Every operation is O(1): an entry expires when it is next looked up,
+    and the least recently used entries are evicted once the cache holds
+    memorycache_max_entries of them.
+
+    """
 
     def __init__(self, *args, **kwargs):
         """Ignores the passed in args."""
+        self.flush_all()
+
+    def flush_all(self):
+        """Deletes all the values and resets the stats."""
         self.cache = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, 0, None]
+        self.stats = {'get_hits': 0,
+                      'get_misses': 0,
+                      'expirations': 0,
+                      'evictions': 0}
 
-    def get(self, key):
-        """Retrieves the value for a key or None.
+    def _unlink(self, entry):
+        entry[_PREV][_NEXT] = entry[_NEXT]
+        entry[_NEXT][_PREV] = entry[_PREV]
+
+    def _link_last(self, entry):
+        last = self._root[_PREV]
+        entry[_PREV] = last
+        entry[_NEXT] = self._root
+        last[_NEXT] = self._root[_PREV] = entry
 
-        this expunges expired keys during each get"""
+    def _lookup(self, key):
+        """Returns the unexpired entry of key, now most recently used."""
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+
+        self._unlink(entry)
+        timeout = entry[_TIMEOUT]
+        if timeout and timeutils.utcnow_ts() >= timeout:
+            del self.cache[key]
+            self.stats['expirations'] += 1
+            return None
 
-        for k in self.cache.keys():
-            (timeout, _value) = self.cache[k]
-            if timeout and timeutils.utcnow_ts() >= timeout:
-                del self.cache[k]
+        self._link_last(entry)
+        return entry
 
-        return self.cache.get(key, (0, None))[1]
+    def get(self, key):
+        """Retrieves the value for a key or None."""
+        entry = self._lookup(key)
+        if entry is None:
+            self.stats['get_misses'] += 1
+            return None
+        self.stats['get_hits'] += 1
+        return entry[_VALUE]
 
     def set(self, key, value, time=0, min_compress_len=0):
         """Sets the value for a key."""
         timeout = 0
         if time != 0:
             timeout = timeutils.utcnow_ts() + time
-        self.cache[key] = (timeout, value)
+
+        entry = self.cache.pop(key, None)
+        if entry is not None:
+            self._unlink(entry)
+        elif FLAGS.memorycache_max_entries > 0:
+            while len(self.cache) >= FLAGS.memorycache_max_entries:
+                oldest = self._root[_NEXT]
+                self._unlink(oldest)
+                del self.cache[oldest[_KEY]]
+                self.stats['evictions'] += 1
+
+        entry = [None, None, key, timeout, value]
+        self._link_last(entry)
+        self.cache[key] = entry
         return True
 
     def add(self, key, value, time=0, min_compress_len=0):
         """Sets the value for a key if it doesn't exist."""
-        if not self.get(key) is None:
+        if self._lookup(key) is not None:
             return False
         return self.set(key, value, time, min_compress_len)
 
     def incr(self, key, delta=1):
         """Increments the value for a key."""
-        value = self.get(key)
-        if value is None:
+        entry = self._lookup(key)
+        if entry is None:
             return None
-        new_value = int(value) + delta
-        self.cache[key] = (self.cache[key][0], str(new_value))
+        new_value = int(entry[_VALUE]) + delta
+        entry[_VALUE] = str(new_value)
         return new_value
+
+    def delete(self, key, time=0):
+        """Deletes the value for a key."""
+        entry = self.cache.pop(key, None)
+        if entry is not None:
+            self._unlink(entry)
+        return 1
+
+    def get_stats(self):
+        """Returns [(server, stats)] like memcached clients do, with the
+        hits, misses, expirations, evictions and number of entries."""
+        stats = dict(self.stats)
+        stats['curr_items'] = len(self.cache)
+        return [('memorycache', stats)]
@@ -995,7 +995,7 @@ class API(base.Base):
         return inst
 
     def get_all(self, context, search_opts=None, sort_key='created_at',
-                sort_dir='desc'):
+                sort_dir='desc', limit=None, marker=None):
         """Get all instances filtered by one of the given parameters.
 
         If there is no filter and the context is an admin, it will retrieve
@@ -1007,6 +1007,10 @@ class API(base.Base):
         The results will be returned sorted in the order specified by the
         'sort_dir' parameter using the key specified in the 'sort_key'
         parameter.
+
+        At most 'limit' instances are returned, starting after the instance
+        whose uuid is 'marker'.  exception.MarkerNotFound is raised if the
+        marker instance does not exist.
         """
 
         #TODO(bcwaldon): determine the best argument for target here
@@ -1073,7 +1077,9 @@ class API(base.Base):
                         return []
 
         inst_models = self._get_instances_by_filters(context, filters,
-                                                     sort_key, sort_dir)
+                                                     sort_key, sort_dir,
+                                                     limit=limit,
+                                                     marker=marker)
 
         # Convert the models to dictionaries
         instances = []
@@ -1085,7 +1091,8 @@ class API(base.Base):
 
         return instances
 
-    def _get_instances_by_filters(self, context, filters, sort_key, sort_dir):
+    def _get_instances_by_filters(self, context, filters, sort_key, sort_dir,
+                                  limit=None, marker=None):
         if 'ip6' in filters or 'ip' in filters:
             res = self.network_api.get_instance_uuids_by_ip_filter(context,
                                                                    filters)
@@ -1095,7 +1102,8 @@ class API(base.Base):
             filters['uuid'] = uuids
 
         return self.db.instance_get_all_by_filters(context, filters, sort_key,
-                                                   sort_dir)
+                                                   sort_dir, limit=limit,
+                                                   marker=marker)
 
     @wrap_check_policy
     @check_instance_state(vm_state=[vm_states.ACTIVE, vm_states.STOPPED])
@@ -1675,6 +1683,12 @@ class HostAPI(base.Base):
         return self.compute_rpcapi.host_maintenance_mode(context,
                 host_param=host, mode=mode, host=host)
 
+    def prefetch_images(self, context, host, image_ids):
+        """Has the host fetch images into its image cache ahead of
+        spawning instances from them."""
+        self.compute_rpcapi.prefetch_images(context, image_ids=image_ids,
+                host=host)
+
 
 class AggregateAPI(base.Base):
     """Sub-set of the Compute Manager API for managing host aggregates."""
@@ -136,6 +136,10 @@ compute_opts = [
                default=60,
                help="Number of seconds between instance info_cache self "
                         "healing updates"),
+    cfg.IntOpt("heal_instance_info_cache_batch_size",
+               default=10,
+               help="Number of instances whose info_cache is updated on "
+                    "each self healing update"),
     cfg.ListOpt('additional_compute_capabilities',
                default=[],
                help='a list of additional capabilities for this compute '
@@ -228,7 +232,7 @@ def _get_additional_capabilities():
 class ComputeManager(manager.SchedulerDependentManager):
     """Manages the running instances from creation to destruction."""
 
-    RPC_API_VERSION = '1.0'
+    RPC_API_VERSION = '1.1'
 
     def __init__(self, compute_driver=None, *args, **kwargs):
         """Load configuration options and connect to the hypervisor."""
@@ -280,36 +284,45 @@ class ComputeManager(manager.SchedulerDependentManager):
         self.driver.init_host(host=self.host)
         context = nova.context.get_admin_context()
         instances = self.db.instance_get_all_by_host(context, self.host)
-        for instance in instances:
-            db_state = instance['power_state']
-            drv_state = self._get_power_state(context, instance)
 
-            expect_running = (db_state == power_state.RUNNING and
-                              drv_state != db_state)
+        self.driver.filter_defer_apply_on()
+        try:
+            for instance in instances:
+                self._init_instance(context, instance)
+        finally:
+            self.driver.filter_defer_apply_off()
 
-            LOG.debug(_('Current state is %(drv_state)s, state in DB is '
-                        '%(db_state)s.'), locals(), instance=instance)
+    def _init_instance(self, context, instance):
+        """Initialize this instance during service init."""
+        db_state = instance['power_state']
+        drv_state = self._get_power_state(context, instance)
 
-            net_info = compute_utils.get_nw_info_for_instance(instance)
-            if ((expect_running and FLAGS.resume_guests_state_on_host_boot) or
-                FLAGS.start_guests_on_host_boot):
-                LOG.info(_('Rebooting instance after nova-compute restart.'),
-                         locals(), instance=instance)
-                try:
-                    self.driver.resume_state_on_host_boot(context, instance,
-                                self._legacy_nw_info(net_info))
-                except NotImplementedError:
-                    LOG.warning(_('Hypervisor driver does not support '
-                                  'resume guests'), instance=instance)
+        expect_running = (db_state == power_state.RUNNING and
+                          drv_state != db_state)
 
-            elif drv_state == power_state.RUNNING:
-                # VMWareAPI drivers will raise an exception
-                try:
-                    self.driver.ensure_filtering_rules_for_instance(instance,
-                                                self._legacy_nw_info(net_info))
-                except NotImplementedError:
-                    LOG.warning(_('Hypervisor driver does not support '
-                                  'firewall rules'), instance=instance)
+        LOG.debug(_('Current state is %(drv_state)s, state in DB is '
+                    '%(db_state)s.'), locals(), instance=instance)
+
+        net_info = compute_utils.get_nw_info_for_instance(instance)
+        if ((expect_running and FLAGS.resume_guests_state_on_host_boot) or
+            FLAGS.start_guests_on_host_boot):
+            LOG.info(_('Rebooting instance after nova-compute restart.'),
+                     locals(), instance=instance)
+            try:
+                self.driver.resume_state_on_host_boot(context, instance,
+                            self._legacy_nw_info(net_info))
+            except NotImplementedError:
+                LOG.warning(_('Hypervisor driver does not support '
+                              'resume guests'), instance=instance)
+
+        elif drv_state == power_state.RUNNING:
+            # VMWareAPI drivers will raise an exception
+            try:
+                self.driver.ensure_filtering_rules_for_instance(instance,
+                                            self._legacy_nw_info(net_info))
+            except NotImplementedError:
+                LOG.warning(_('Hypervisor driver does not support '
+                              'firewall rules'), instance=instance)
 
     def _get_power_state(self, context, instance):
         """Retrieve the power state for the given instance."""
@@ -1587,6 +1600,15 @@ class ComputeManager(manager.SchedulerDependentManager):
         guest VMs evacuation."""
         return self.driver.host_maintenance_mode(host, mode)
 
+    @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
+    def prefetch_images(self, context, image_ids):
+        """Fetch images into the local image cache ahead of spawns."""
+        try:
+            self.driver.prefetch_images(context, image_ids)
+        except NotImplementedError:
+            LOG.warn(_('Prefetching images is not supported by the compute '
+                       'driver'))
+
     @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
     def set_host_enabled(self, context, host=None, enabled=None):
         """Sets the specified host's ability to accept new instances."""
@@ -2236,12 +2258,12 @@ class ComputeManager(manager.SchedulerDependentManager):
     @manager.periodic_task
     def _heal_instance_info_cache(self, context):
         """Called periodically.  On every call, try to update the
-        info_cache's network information for another instance by
-        calling to the network manager.
+        info_cache's network information for another batch of instances
+        by calling to the network manager.
 
         This is implemented by keeping a cache of uuids of instances
-        that live on this host.  On each call, we pop one off of a
-        list, pull the DB record, and try the call to the network API.
+        that live on this host.  On each call, we pop a batch off of a
+        list, pull the DB records, and try the call to the network API.
         If anything errors, we don't care.  It's possible the instance
         has been deleted, etc.
         """
@@ -2253,17 +2275,25 @@ class ComputeManager(manager.SchedulerDependentManager):
             return
         self._last_info_cache_heal = curr_time
 
+        batch_size = max(FLAGS.heal_instance_info_cache_batch_size, 1)
         instance_uuids = getattr(self, '_instance_uuids_to_heal', None)
-        instance = None
+        instances = []
 
-        while not instance or instance['host'] != self.host:
+        while len(instances) < batch_size:
             if instance_uuids:
-                try:
-                    instance = self.db.instance_get_by_uuid(context,
-                        instance_uuids.pop(0))
-                except exception.InstanceNotFound:
-                    # Instance is gone.  Try to grab another.
-                    continue
+                count = batch_size - len(instances)
+                uuids = instance_uuids[:count]
+                del instance_uuids[:count]
+                # Skip instances that are gone or have moved.  NOTE: the
+                # 'deleted' filter would skip soft deleted instances too.
+                instances.extend(instance for instance in
+                        self.db.instance_get_all_by_filters(context,
+                                {'uuid': uuids}, 'created_at', 'desc')
+                        if not instance['deleted'] and
+                           instance['host'] == self.host)
+            elif instances:
+                # Heal what we have, the next call pulls from the DB.
+                break
             else:
                 # No more in our copy of uuids.  Pull from the DB.
                 db_instances = self.db.instance_get_all_by_host(
@@ -2271,17 +2301,18 @@ class ComputeManager(manager.SchedulerDependentManager):
                 if not db_instances:
                     # None.. just return.
                     return
-                instance = db_instances.pop(0)
-                instance_uuids = [inst['uuid'] for inst in db_instances]
+                instances = db_instances[:batch_size]
+                instance_uuids = [inst['uuid']
+                                  for inst in db_instances[batch_size:]]
                 self._instance_uuids_to_heal = instance_uuids
 
-        # We have an instance now and it's ours
+        # We have instances now and they're ours
         try:
             # Call to network API to get instance info.. this will
-            # force an update to the instance's info_cache
-            self.network_api.get_instance_nw_info(context, instance)
-            LOG.debug(_('Updated the info_cache for instance'),
-                    instance=instance)
+            # force an update to the instances' info_cache
+            self.network_api.get_instances_nw_info(context, instances)
+            LOG.debug(_('Updated the info_cache for %d instances'),
+                      len(instances))
         except Exception:
             # We don't care about any failures
             pass
@@ -2396,139 +2427,185 @@ class ComputeManager(manager.SchedulerDependentManager):
     def _sync_power_states(self, context):
         """Align power states between the database and the hypervisor.
 
-        The hypervisor is authoritative for the power_state data, but we don't
-        want to do an expensive call to the virt driver's list_instances_detail
-        method. Instead, we do a less-expensive call to get the number of
-        virtual machines known by the hypervisor and if the number matches the
-        number of virtual machines known by the database, we proceed in a lazy
-        loop, one database record at a time, checking if the hypervisor has the
-        same power state as is in the database. We call eventlet.sleep(0) after
-        each loop to allow the periodic task eventlet to do other work.
+        The hypervisor is authoritative for the power_state data.  We get the
+        power state of all virtual machines with a single call to the virt
+        driver's get_power_states method, falling back to one get_info call
+        per instance for drivers that don't support it.  Only the instances
+        whose power state differs from the database are read again, in one
+        database call, before the database is updated.  We call
+        eventlet.sleep(0) after each instance to allow the periodic task
+        eventlet to do other work.
 
         If the instance is not found on the hypervisor, but is in the database,
         then a stop() API will be called on the instance.
         """
+        start_time = time.time()
         db_instances = self.db.instance_get_all_by_host(context, self.host)
 
-        num_vm_instances = self.driver.get_num_instances()
+        try:
+            vm_power_states = self.driver.get_power_states()
+            num_vm_instances = len(vm_power_states)
+        except NotImplementedError:
+            vm_power_states = None
+            num_vm_instances = self.driver.get_num_instances()
         num_db_instances = len(db_instances)
 
         if num_vm_instances != num_db_instances:
             LOG.warn(_("Found %(num_db_instances)s in the database and "
                        "%(num_vm_instances)s on the hypervisor.") % locals())
 
+        synced_instances = []
+        changed_power_states = {}
         for db_instance in db_instances:
-            # Allow other periodic tasks to do some work...
-            greenthread.sleep(0)
-            db_power_state = db_instance['power_state']
             if db_instance['task_state'] is not None:
                 LOG.info(_("During sync_power_state the instance has a "
                            "pending task. Skip."), instance=db_instance)
                 continue
             # No pending tasks. Now try to figure out the real vm_power_state.
-            try:
-                vm_instance = self.driver.get_info(db_instance)
-                vm_power_state = vm_instance['state']
-            except exception.InstanceNotFound:
-                vm_power_state = power_state.NOSTATE
-            # Note(maoy): the above get_info call might take a long time,
-            # for example, because of a broken libvirt driver.
-            # We re-query the DB to get the latest instance info to minimize
-            # (not eliminate) race condition.
-            u = self.db.instance_get_by_uuid(context,
-                                             db_instance['uuid'])
-            db_power_state = u["power_state"]
-            vm_state = u['vm_state']
-            if self.host != u['host']:
-                # on the sending end of nova-compute _sync_power_state
-                # may have yielded to the greenthread performing a live
-                # migration; this in turn has changed the resident-host
-                # for the VM; However, the instance is still active, it
-                # is just in the process of migrating to another host.
-                # This implies that the compute source must relinquish
-                # control to the compute destination.
-                LOG.info(_("During the sync_power process the "
-                           "instance has moved from "
-                           "host %(src)s to host %(dst)s") %
-                           {'src': self.host,
-                            'dst': u['host']},
+            if vm_power_states is not None:
+                vm_power_state = vm_power_states.get(db_instance['name'],
+                                                     power_state.NOSTATE)
+            else:
+                # Allow other periodic tasks to do some work...
+                greenthread.sleep(0)
+                try:
+                    vm_instance = self.driver.get_info(db_instance)
+                    vm_power_state = vm_instance['state']
+                except exception.InstanceNotFound:
+                    vm_power_state = power_state.NOSTATE
+            synced_instances.append((db_instance, vm_power_state))
+            if vm_power_state != db_instance['power_state']:
+                changed_power_states[db_instance['uuid']] = vm_power_state
+
+        # Note(maoy): the above driver calls might take a long time,
+        # for example, because of a broken libvirt driver.
+        # We re-query the DB to get the latest instance info to minimize
+        # (not eliminate) race condition, for the instances we are about
+        # to update.
+        if changed_power_states:
+            # NOTE: the 'deleted' filter would also drop soft deleted
+            # instances, whose power state is synced too.
+            latest_instances = self.db.instance_get_all_by_filters(context,
+                    {'uuid': changed_power_states.keys()},
+                    'created_at', 'desc')
+            latest_instances = dict((instance['uuid'], instance)
+                                    for instance in latest_instances
+                                    if not instance['deleted'])
+
+        for db_instance, vm_power_state in synced_instances:
+            if db_instance['uuid'] in changed_power_states:
+                db_instance = latest_instances.get(db_instance['uuid'])
+                if db_instance is None:
+                    # Deleted since we listed the instances on this host
+                    continue
+            # Allow other periodic tasks to do some work...
+            greenthread.sleep(0)
+            self._sync_instance_power_state(context, db_instance,
+                                            vm_power_state)
+
+        LOG.debug(_("Synced power states of %(num_db_instances)d instances "
+                    "in %(elapsed).3f seconds, %(changed)d had changed"),
+                  {'num_db_instances': num_db_instances,
+                   'elapsed': time.time() - start_time,
+                   'changed': len(changed_power_states)})
+
+    def _sync_instance_power_state(self, context, db_instance,
+                                   vm_power_state):
+        """Align the power state and vm_state of a single instance with the
+        power state found on the hypervisor.
+        """
+        db_power_state = db_instance['power_state']
+        vm_state = db_instance['vm_state']
+        if self.host != db_instance['host']:
+            # on the sending end of nova-compute _sync_power_state
+            # may have yielded to the greenthread performing a live
+            # migration; this in turn has changed the resident-host
+            # for the VM; However, the instance is still active, it
+            # is just in the process of migrating to another host.
+            # This implies that the compute source must relinquish
+            # control to the compute destination.
+            LOG.info(_("During the sync_power process the "
+                       "instance has moved from "
+                       "host %(src)s to host %(dst)s") %
+                       {'src': self.host,
+                        'dst': db_instance['host']},
+                     instance=db_instance)
+            return
+        elif db_instance['task_state'] is not None:
+            # on the receiving end of nova-compute, it could happen
+            # that the DB instance already report the new resident
+            # but the actual VM has not showed up on the hypervisor
+            # yet. In this case, let's allow the loop to continue
+            # and run the state sync in a later round
+            LOG.info(_("During sync_power_state the instance has a "
+                       "pending task. Skip."), instance=db_instance)
+            return
+        if vm_power_state != db_power_state:
+            # power_state is always updated from hypervisor to db
+            self._instance_update(context,
+                                  db_instance['uuid'],
+                                  power_state=vm_power_state)
+            db_power_state = vm_power_state
+        # Note(maoy): Now resolve the discrepancy between vm_state and
+        # vm_power_state. We go through all possible vm_states.
+        if vm_state in (vm_states.BUILDING,
+                        vm_states.RESCUED,
+                        vm_states.RESIZED,
+                        vm_states.SUSPENDED,
+                        vm_states.PAUSED,
+                        vm_states.ERROR):
+            # TODO(maoy): we ignore these vm_state for now.
+            pass
+        elif vm_state == vm_states.ACTIVE:
+            # The only rational power state should be RUNNING
+            if vm_power_state in (power_state.NOSTATE,
+                                   power_state.SHUTDOWN,
+                                   power_state.CRASHED):
+                LOG.warn(_("Instance shutdown by itself. Calling "
+                           "the stop API."), instance=db_instance)
+                try:
+                    # Note(maoy): here we call the API instead of
+                    # brutally updating the vm_state in the database
+                    # to allow all the hooks and checks to be performed.
+                    self.compute_api.stop(context, db_instance)
+                except Exception:
+                    # Note(maoy): there is no need to propergate the error
+                    # because the same power_state will be retrieved next
+                    # time and retried.
+                    # For example, there might be another task scheduled.
+                    LOG.exception(_("error during stop() in "
+                                    "sync_power_state."))
+            elif vm_power_state in (power_state.PAUSED,
+                                    power_state.SUSPENDED):
+                LOG.warn(_("Instance is paused or suspended "
+                           "unexpectedly. Calling "
+                           "the stop API."), instance=db_instance)
+                try:
+                    self.compute_api.stop(context, db_instance)
+                except Exception:
+                    LOG.exception(_("error during stop() in "
+                                    "sync_power_state."))
+        elif vm_state == vm_states.STOPPED:
+            if vm_power_state not in (power_state.NOSTATE,
+                                      power_state.SHUTDOWN,
+                                      power_state.CRASHED):
+                LOG.warn(_("Instance is not stopped. Calling "
+                           "the stop API."), instance=db_instance)
+                try:
+                    # Note(maoy): this assumes that the stop API is
+                    # idempotent.
+                    self.compute_api.stop(context, db_instance)
+                except Exception:
+                    LOG.exception(_("error during stop() in "
+                                    "sync_power_state."))
+        elif vm_state in (vm_states.SOFT_DELETED,
+                          vm_states.DELETED):
+            if vm_power_state not in (power_state.NOSTATE,
+                                      power_state.SHUTDOWN):
+                # Note(maoy): this should be taken care of periodically in
+                # _cleanup_running_deleted_instances().
+                LOG.warn(_("Instance is not (soft-)deleted."),
                          instance=db_instance)
-                continue
-            elif u['task_state'] is not None:
-                # on the receiving end of nova-compute, it could happen
-                # that the DB instance already report the new resident
-                # but the actual VM has not showed up on the hypervisor
-                # yet. In this case, let's allow the loop to continue
-                # and run the state sync in a later round
-                LOG.info(_("During sync_power_state the instance has a "
-                           "pending task. Skip."), instance=db_instance)
-                continue
-            if vm_power_state != db_power_state:
-                # power_state is always updated from hypervisor to db
-                self._instance_update(context,
-                                      db_instance['uuid'],
-                                      power_state=vm_power_state)
-                db_power_state = vm_power_state
-            # Note(maoy): Now resolve the discrepancy between vm_state and
-            # vm_power_state. We go through all possible vm_states.
-            if vm_state in (vm_states.BUILDING,
-                            vm_states.RESCUED,
-                            vm_states.RESIZED,
-                            vm_states.SUSPENDED,
-                            vm_states.PAUSED,
-                            vm_states.ERROR):
-                # TODO(maoy): we ignore these vm_state for now.
-                pass
-            elif vm_state == vm_states.ACTIVE:
-                # The only rational power state should be RUNNING
-                if vm_power_state in (power_state.NOSTATE,
-                                       power_state.SHUTDOWN,
-                                       power_state.CRASHED):
-                    LOG.warn(_("Instance shutdown by itself. Calling "
-                               "the stop API."), instance=db_instance)
-                    try:
-                        # Note(maoy): here we call the API instead of
-                        # brutally updating the vm_state in the database
-                        # to allow all the hooks and checks to be performed.
-                        self.compute_api.stop(context, db_instance)
-                    except Exception:
-                        # Note(maoy): there is no need to propergate the error
-                        # because the same power_state will be retrieved next
-                        # time and retried.
-                        # For example, there might be another task scheduled.
-                        LOG.exception(_("error during stop() in "
-                                        "sync_power_state."))
-                elif vm_power_state in (power_state.PAUSED,
-                                        power_state.SUSPENDED):
-                    LOG.warn(_("Instance is paused or suspended "
-                               "unexpectedly. Calling "
-                               "the stop API."), instance=db_instance)
-                    try:
-                        self.compute_api.stop(context, db_instance)
-                    except Exception:
-                        LOG.exception(_("error during stop() in "
-                                        "sync_power_state."))
-            elif vm_state == vm_states.STOPPED:
-                if vm_power_state not in (power_state.NOSTATE,
-                                          power_state.SHUTDOWN,
-                                          power_state.CRASHED):
-                    LOG.warn(_("Instance is not stopped. Calling "
-                               "the stop API."), instance=db_instance)
-                    try:
-                        # Note(maoy): this assumes that the stop API is
-                        # idempotent.
-                        self.compute_api.stop(context, db_instance)
-                    except Exception:
-                        LOG.exception(_("error during stop() in "
-                                        "sync_power_state."))
-            elif vm_state in (vm_states.SOFT_DELETED,
-                              vm_states.DELETED):
-                if vm_power_state not in (power_state.NOSTATE,
-                                          power_state.SHUTDOWN):
-                    # Note(maoy): this should be taken care of periodically in
-                    # _cleanup_running_deleted_instances().
-                    LOG.warn(_("Instance is not (soft-)deleted."),
-                             instance=db_instance)
 
     @manager.periodic_task
     def _reclaim_queued_deletes(self, context):
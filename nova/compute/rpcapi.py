@@ -54,13 +54,18 @@ class ComputeAPI(nova.openstack.common.rpc.proxy.RpcProxy):
     API version history:
 
         1.0 - Initial version.
+        1.1 - Adds prefetch_images()
     '''
 
-    RPC_API_VERSION = '1.0'
+    # NOTE: messages are sent as BASE_RPC_API_VERSION unless they need a
+    # later version, so that compute nodes that are still older keep
+    # working with what they support.
+    BASE_RPC_API_VERSION = '1.0'
+    RPC_API_VERSION = '1.1'
 
     def __init__(self):
         super(ComputeAPI, self).__init__(topic=FLAGS.compute_topic,
-                                         default_version=self.RPC_API_VERSION)
+                default_version=self.BASE_RPC_API_VERSION)
 
     def add_aggregate_host(self, ctxt, aggregate_id, host_param, host):
         '''Add aggregate host.
@@ -308,6 +313,12 @@ class ComputeAPI(nova.openstack.common.rpc.proxy.RpcProxy):
                 instance_uuid=instance['uuid'], new_pass=new_pass),
                 topic=_compute_topic(self.topic, ctxt, None, instance))
 
+    def prefetch_images(self, ctxt, image_ids, host):
+        self.cast(ctxt, self.make_msg('prefetch_images',
+                image_ids=image_ids),
+                topic=_compute_topic(self.topic, ctxt, host, None),
+                version='1.1')
+
     def set_host_enabled(self, ctxt, enabled, host):
         topic = _compute_topic(self.topic, ctxt, host, None)
         return self.call(ctxt, self.make_msg('set_host_enabled',
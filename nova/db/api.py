@@ -65,6 +65,10 @@ db_opts = [
     cfg.StrOpt('snapshot_name_template',
                default='snapshot-%s',
                help='Template string to be used to generate snapshot names'),
+    cfg.IntOpt('fixed_ip_allocation_spread',
+               default=8,
+               help='Number of free fixed ips to pick from at random for '
+                    'each address allocated from a network pool'),
     ]
 
 FLAGS = flags.FLAGS
@@ -346,6 +350,11 @@ def floating_ip_get_by_fixed_ip_id(context, fixed_ip_id):
     return IMPL.floating_ip_get_by_fixed_ip_id(context, fixed_ip_id)
 
 
+def floating_ip_get_by_fixed_ip_ids(context, fixed_ip_ids):
+    """Get the floating ips associated with any of the fixed ip ids."""
+    return IMPL.floating_ip_get_by_fixed_ip_ids(context, fixed_ip_ids)
+
+
 def floating_ip_update(context, address, values):
     """Update a floating ip by address or raise if it doesn't exist."""
     return IMPL.floating_ip_update(context, address, values)
@@ -440,7 +449,8 @@ def fixed_ip_create(context, values):
 
 
 def fixed_ip_bulk_create(context, ips):
-    """Create a lot of fixed ips from the values dictionary."""
+    """Create a lot of fixed ips from the values dictionaries, which must
+    all hold the same keys."""
     return IMPL.fixed_ip_bulk_create(context, ips)
 
 
@@ -484,6 +494,11 @@ def fixed_ips_by_virtual_interface(context, vif_id):
     return IMPL.fixed_ips_by_virtual_interface(context, vif_id)
 
 
+def fixed_ips_by_virtual_interfaces(context, vif_ids):
+    """Get the fixed ips of any of the virtual interfaces."""
+    return IMPL.fixed_ips_by_virtual_interfaces(context, vif_ids)
+
+
 def fixed_ip_get_network(context, address):
     """Get a network for a fixed ip by address."""
     return IMPL.fixed_ip_get_network(context, address)
@@ -521,6 +536,11 @@ def virtual_interface_get_by_instance(context, instance_id):
     return IMPL.virtual_interface_get_by_instance(context, instance_id)
 
 
+def virtual_interface_get_by_instances(context, instance_ids):
+    """Gets all virtual_interfaces for any of the instances."""
+    return IMPL.virtual_interface_get_by_instances(context, instance_ids)
+
+
 def virtual_interface_get_by_instance_and_network(context, instance_id,
                                                            network_id):
     """Gets all virtual interfaces for instance."""
@@ -579,10 +599,11 @@ def instance_get_all(context, columns_to_join=None):
 
 
 def instance_get_all_by_filters(context, filters, sort_key='created_at',
-                                sort_dir='desc'):
+                                sort_dir='desc', limit=None, marker=None):
     """Get all instances that match all filters."""
     return IMPL.instance_get_all_by_filters(context, filters, sort_key,
-                                            sort_dir)
+                                            sort_dir, limit=limit,
+                                            marker=marker)
 
 
 def instance_get_active_by_window(context, begin, end=None, project_id=None):
@@ -611,6 +632,12 @@ def instance_get_all_by_host(context, host):
     return IMPL.instance_get_all_by_host(context, host)
 
 
+def instance_get_all_by_host_or_resizing(context, host):
+    """Get all instances belonging to a host or being resized, without
+    loading their relationships."""
+    return IMPL.instance_get_all_by_host_or_resizing(context, host)
+
+
 def instance_get_all_by_host_and_not_type(context, host, type_id=None):
     """Get all instances belonging to a host with a different type_id."""
     return IMPL.instance_get_all_by_host_and_not_type(context, host, type_id)
@@ -885,6 +912,11 @@ def iscsi_target_count_by_host(context, host):
     return IMPL.iscsi_target_count_by_host(context, host)
 
 
+def iscsi_target_get_nums_by_host(context, host):
+    """Get {volume_id: target num} of the targets allocated on a host."""
+    return IMPL.iscsi_target_get_nums_by_host(context, host)
+
+
 def iscsi_target_create_safe(context, values):
     """Create an iscsi_target from the values dictionary.
 
@@ -1236,6 +1268,12 @@ def block_device_mapping_get_all_by_instance(context, instance_uuid):
                                                          instance_uuid)
 
 
+def block_device_mapping_get_all_by_instances(context, instance_uuids):
+    """Get all block device mapping belonging to any of the instances"""
+    return IMPL.block_device_mapping_get_all_by_instances(context,
+                                                          instance_uuids)
+
+
 def block_device_mapping_destroy(context, bdm_id):
     """Destroy the block device mapping."""
     return IMPL.block_device_mapping_destroy(context, bdm_id)
@@ -1756,6 +1794,11 @@ def s3_image_get_by_uuid(context, image_uuid):
     return IMPL.s3_image_get_by_uuid(context, image_uuid)
 
 
+def s3_image_get_all_by_uuids(context, image_uuids):
+    """Find the local s3 images represented by any of the provided uuids"""
+    return IMPL.s3_image_get_all_by_uuids(context, image_uuids)
+
+
 def s3_image_create(context, image_uuid):
     """Create local s3 image represented by provided uuid"""
     return IMPL.s3_image_create(context, image_uuid)
@@ -1940,6 +1983,11 @@ def get_ec2_instance_id_by_uuid(context, instance_id):
     return IMPL.get_ec2_instance_id_by_uuid(context, instance_id)
 
 
+def get_ec2_instance_ids_by_uuids(context, instance_uuids):
+    """Get {uuid: ec2 id} of the instances from instance_id_mappings table"""
+    return IMPL.get_ec2_instance_ids_by_uuids(context, instance_uuids)
+
+
 def get_instance_uuid_by_ec2_id(context, instance_id):
     """Get uuid through ec2 id from instance_id_mappings table"""
     return IMPL.get_instance_uuid_by_ec2_id(context, instance_id)
@@ -22,11 +22,14 @@
 import copy
 import datetime
 import functools
+import random
 import re
 import warnings
 
 from nova import block_device
+from nova.common import sqlalchemyutils
 from nova.compute import aggregate_states
+from nova.compute import task_states
 from nova.compute import vm_states
 from nova import db
 from nova.db.sqlalchemy import models
@@ -41,8 +44,8 @@ from sqlalchemy.exc import IntegrityError
 from sqlalchemy import or_
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
-from sqlalchemy.sql.expression import asc
 from sqlalchemy.sql.expression import desc
+from sqlalchemy.sql.expression import exists
 from sqlalchemy.sql.expression import literal_column
 from sqlalchemy.sql.expression import or_
 from sqlalchemy.sql import func
@@ -262,6 +265,118 @@ def exact_filter(query, model, filters, legal_keys):
     return query
 
 
+_REGEXP_META_CHARS = '.^$*+?{}[]|()'
+
+
+def _regexp_to_like(pattern):
+    """Translates a simple regexp into an SQL LIKE pattern.
+
+    The regexp is assumed to be applied with re.match(), so it is
+    implicitly anchored at the start.  Only literal text (with optional
+    backslash escapes), a leading '^' or '.*' and a trailing '$' or '.*'
+    are understood.
+
+    Returns a (like_pattern, exact) tuple where exact is True if the
+    regexp only matches the literal text itself, or None if the regexp
+    can't be translated.
+    """
+    tokens = []
+    chars = iter(pattern)
+    for c in chars:
+        if c == '\\':
+            c = next(chars, None)
+            if c is None or c.isalnum():
+                # \d, \w and friends are character classes, not literals
+                return None
+            tokens.append((False, c))
+        else:
+            tokens.append((c in _REGEXP_META_CHARS, c))
+
+    leading_wildcard = False
+    if tokens[:1] == [(True, '^')]:
+        tokens = tokens[1:]
+    elif tokens[:2] == [(True, '.'), (True, '*')]:
+        tokens = tokens[2:]
+        leading_wildcard = True
+
+    anchored = False
+    if tokens[-1:] == [(True, '$')]:
+        tokens = tokens[:-1]
+        anchored = True
+    elif tokens[-2:] == [(True, '.'), (True, '*')]:
+        tokens = tokens[:-2]
+
+    if not tokens or any(meta for meta, _c in tokens):
+        return None
+
+    literal = ''.join(c for _meta, c in tokens)
+    if anchored and not leading_wildcard:
+        return literal, True
+
+    like_pattern = literal.replace('\\', '\\\\').replace('%', '\\%').\
+            replace('_', '\\_')
+    if leading_wildcard:
+        like_pattern = '%' + like_pattern
+    if not anchored:
+        like_pattern = like_pattern + '%'
+    return like_pattern, False
+
+
+def regexp_filter(query, model, filters):
+    """Applies SQL equivalents of regexp filters to a query.
+
+    Returns the updated query.  Unlike exact_filter(), the filters
+    argument is not modified: the SQL criteria only narrow down the rows
+    that get loaded, as LIKE and '=' may be case insensitive depending on
+    the database.  The caller must still match the regexps in python.
+    Filters that don't name a column of the model, or whose regexp is
+    too complex to translate, are skipped.
+
+    :param query: query to apply filters to
+    :param model: model object the query applies to
+    :param filters: dictionary of filter names to regexps
+    """
+    columns = model.__table__.columns
+    for key, value in filters.iteritems():
+        if key not in columns or not isinstance(value, basestring):
+            continue
+        translated = _regexp_to_like(value)
+        if translated is None:
+            continue
+        like_pattern, exact = translated
+        column_attr = getattr(model, key)
+        if exact:
+            query = query.filter(column_attr == like_pattern)
+        else:
+            query = query.filter(column_attr.like(like_pattern,
+                                                  escape='\\'))
+    return query
+
+
+def _instance_metadata_filter(query, metadata):
+    """Applies exact key/value metadata filters to an instance query.
+
+    metadata is either a dict of key/value pairs, or a list of single
+    pair dicts, all of which must be present on the instance.
+    """
+    if isinstance(metadata, dict):
+        pairs = metadata.items()
+    elif isinstance(metadata, list):
+        pairs = [node.items()[0] for node in metadata
+                 if isinstance(node, dict) and len(node) == 1]
+    else:
+        return query
+
+    for key, value in pairs:
+        query = query.filter(exists().where(and_(
+                models.InstanceMetadata.instance_uuid ==
+                        models.Instance.uuid,
+                models.InstanceMetadata.deleted == False,
+                models.InstanceMetadata.key == key,
+                models.InstanceMetadata.value == value)))
+    return query
+
+
 ###################
 
 
@@ -885,6 +1000,15 @@ def floating_ip_get_by_fixed_ip_id(context, fixed_ip_id, session=None):
                    all()
 
 
+@require_context
+def floating_ip_get_by_fixed_ip_ids(context, fixed_ip_ids):
+    if not fixed_ip_ids:
+        return []
+    return model_query(context, models.FloatingIp).\
+                   filter(models.FloatingIp.fixed_ip_id.in_(fixed_ip_ids)).\
+                   all()
+
+
 @require_context
 def floating_ip_update(context, address, values):
     session = get_session()
@@ -1004,33 +1128,48 @@ def fixed_ip_associate(context, address, instance_id, network_id=None,
 
 @require_admin_context
 def fixed_ip_associate_pool(context, network_id, instance_id=None, host=None):
+    values = {'network_id': network_id}
+    if instance_id:
+        values['instance_id'] = instance_id
+    if host:
+        values['host'] = host
     session = get_session()
     with session.begin():
         network_or_none = or_(models.FixedIp.network_id == network_id,
                               models.FixedIp.network_id == None)
-        fixed_ip_ref = model_query(context, models.FixedIp, session=session,
-                                   read_deleted="no").\
-                               filter(network_or_none).\
-                               filter_by(reserved=False).\
-                               filter_by(instance_id=None).\
-                               filter_by(host=None).\
-                               with_lockmode('update').\
-                               first()
-        # NOTE(vish): if with_lockmode isn't supported, as in sqlite,
-        #             then this has concurrency issues
-        if not fixed_ip_ref:
-            raise exception.NoMoreFixedIps()
-
-        if fixed_ip_ref['network_id'] is None:
-            fixed_ip_ref['network'] = network_id
-
-        if instance_id:
-            fixed_ip_ref['instance_id'] = instance_id
-
-        if host:
-            fixed_ip_ref['host'] = host
-        session.add(fixed_ip_ref)
-    return fixed_ip_ref['address']
+        tried = set()
+        while True:
+            # NOTE: a free ip is picked at random among a window of
+            #       candidates and claimed with a conditional update,
+            #       instead of locking the first free row, so concurrent
+            #       allocations on a network rarely contend for one row
+            query = model_query(context, models.FixedIp.id,
+                                models.FixedIp.address, session=session,
+                                read_deleted="no").\
+                            filter(network_or_none).\
+                            filter_by(reserved=False).\
+                            filter_by(instance_id=None).\
+                            filter_by(host=None)
+            if tried:
+                query = query.filter(~models.FixedIp.id.in_(tried))
+            candidates = query.limit(FLAGS.fixed_ip_allocation_spread).all()
+            if not candidates:
+                raise exception.NoMoreFixedIps()
+            random.shuffle(candidates)
+
+            for fixed_ip_id, address in candidates:
+                tried.add(fixed_ip_id)
+                values['updated_at'] = timeutils.utcnow()
+                # NOTE: the row is left alone if it was claimed since the
+                #       candidates were read
+                claimed = model_query(context, models.FixedIp,
+                                      session=session, read_deleted="no").\
+                                  filter_by(id=fixed_ip_id).\
+                                  filter_by(instance_id=None).\
+                                  filter_by(host=None).\
+                                  update(values, synchronize_session=False)
+                if claimed:
+                    return address
 
 
 @require_context
@@ -1043,12 +1182,16 @@ def fixed_ip_create(context, values):
 
 @require_context
 def fixed_ip_bulk_create(context, ips):
+    if not ips:
+        return
     session = get_session()
     with session.begin():
-        for ip in ips:
-            model = models.FixedIp()
-            model.update(ip)
-            session.add(model)
+        # NOTE: a single executemany insert instead of one orm object per
+        #       address, as networks can hold tens of thousands of them
+        now = timeutils.utcnow()
+        session.execute(models.FixedIp.__table__.insert(),
+                        [dict(ip, created_at=now, deleted=False)
+                         for ip in ips])
 
 
 @require_context
@@ -1173,6 +1316,15 @@ def fixed_ips_by_virtual_interface(context, vif_id):
     return result
 
 
+@require_context
+def fixed_ips_by_virtual_interfaces(context, vif_ids):
+    if not vif_ids:
+        return []
+    return model_query(context, models.FixedIp, read_deleted="no").\
+                 filter(models.FixedIp.virtual_interface_id.in_(vif_ids)).\
+                 all()
+
+
 @require_admin_context
 def fixed_ip_get_network(context, address):
     fixed_ip_ref = fixed_ip_get_by_address(context, address)
@@ -1264,6 +1416,21 @@ def virtual_interface_get_by_instance(context, instance_id):
     return vif_refs
 
 
+@require_context
+def virtual_interface_get_by_instances(context, instance_ids):
+    """Gets all virtual interfaces for any of the instances.
+
+    :param instance_ids: = ids of the instances to retrieve vifs for
+    """
+    if not instance_ids:
+        return []
+    vif_refs = _virtual_interface_query(context).\
+                       filter(models.VirtualInterface.instance_id.in_(
+                               instance_ids)).\
+                       all()
+    return vif_refs
+
+
 @require_context
 def virtual_interface_get_by_instance_and_network(context, instance_id,
                                                            network_id):
@@ -1477,10 +1644,15 @@ def instance_get_all(context, columns_to_join=None):
 
 
 @require_context
-def instance_get_all_by_filters(context, filters, sort_key, sort_dir):
+def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
+                                limit=None, marker=None):
     """Return instances that match all filters.  Deleted instances
     will be returned by default, unless there's a filter that says
-    otherwise"""
+    otherwise.
+
+    Results are sorted by sort_key (with the instance id as a tie-breaker)
+    and paginated in SQL: at most 'limit' instances are returned, starting
+    after the instance whose uuid is 'marker'."""
 
     def _regexp_filter_by_metadata(instance, meta):
         inst_metadata = [{node['key']: node['value']}
@@ -1504,15 +1676,29 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir):
             return True
         return False
 
-    sort_fn = {'desc': desc, 'asc': asc}
+    def _regexp_filter(instances):
+        # Now filter on everything else for regexp matching..
+        # For filters not in the list, we'll attempt to use the filter_name
+        # as a column name in Instance..
+        for filter_name in filters.iterkeys():
+            filter_re = re.compile(str(filters[filter_name]))
+            if filter_name == 'metadata':
+                filter_l = lambda instance: _regexp_filter_by_metadata(
+                        instance, filters[filter_name])
+            else:
+                filter_l = lambda instance: _regexp_filter_by_column(
+                        instance, filter_name, filter_re)
+            instances = filter(filter_l, instances)
+            if not instances:
+                break
+        return instances
 
     session = get_session()
     query_prefix = session.query(models.Instance).\
             options(joinedload('info_cache')).\
             options(joinedload('security_groups')).\
             options(joinedload('metadata')).\
-            options(joinedload('instance_type')).\
-            order_by(sort_fn[sort_dir](getattr(models.Instance, sort_key)))
+            options(joinedload('instance_type'))
 
     # Make a copy of the filters dictionary to use going forward, as we'll
     # be modifying it and we shouldn't affect the caller's use of it.
@@ -1551,31 +1737,46 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir):
     query_prefix = exact_filter(query_prefix, models.Instance,
                                 filters, exact_match_filter_names)
 
-    instances = query_prefix.all()
-    if not instances:
-        return []
+    # Narrow down the rows to load with SQL equivalents of the remaining
+    # filters where possible; they are still matched in python below.
+    query_prefix = regexp_filter(query_prefix, models.Instance, filters)
+    if 'metadata' in filters:
+        query_prefix = _instance_metadata_filter(query_prefix,
+                                                 filters['metadata'])
 
-    # Now filter on everything else for regexp matching..
-    # For filters not in the list, we'll attempt to use the filter_name
-    # as a column name in Instance..
-    regexp_filter_funcs = {}
-
-    for filter_name in filters.iterkeys():
-        filter_func = regexp_filter_funcs.get(filter_name, None)
-        filter_re = re.compile(str(filters[filter_name]))
-        if filter_func:
-            filter_l = lambda instance: filter_func(instance, filter_re)
-        elif filter_name == 'metadata':
-            filter_l = lambda instance: _regexp_filter_by_metadata(instance,
-                    filters[filter_name])
-        else:
-            filter_l = lambda instance: _regexp_filter_by_column(instance,
-                    filter_name, filter_re)
-        instances = filter(filter_l, instances)
-        if not instances:
+    if marker is not None:
+        try:
+            marker = instance_get_by_uuid(context, marker, session=session)
+        except exception.InstanceNotFound:
+            raise exception.MarkerNotFound(marker=marker)
+
+    sort_keys = [sort_key, 'id']
+
+    if not filters:
+        # Everything was handled in SQL, so LIMIT can be applied directly
+        query = sqlalchemyutils.paginate_query(query_prefix, models.Instance,
+                                               limit, sort_keys,
+                                               marker=marker,
+                                               sort_dir=sort_dir)
+        return query.all()
+
+    # NOTE: The remaining filters are applied in python, so a page of
+    # 'limit' rows may shrink after filtering.  Keep walking the result
+    # set in pages (using the last row seen as the next marker) until
+    # enough instances have matched or the rows run out.
+    instances = []
+    while True:
+        query = sqlalchemyutils.paginate_query(query_prefix, models.Instance,
+                                               limit, sort_keys,
+                                               marker=marker,
+                                               sort_dir=sort_dir)
+        page = query.all()
+        instances.extend(_regexp_filter(page))
+        if limit is None or len(page) < limit or len(instances) >= limit:
             break
+        marker = page[-1]
 
-    return instances
+    return instances[:limit]
 
 
 @require_context
@@ -1629,6 +1830,19 @@ def instance_get_all_by_host(context, host):
     return _instance_get_all_query(context).filter_by(host=host).all()
 
 
+@require_admin_context
+def instance_get_all_by_host_or_resizing(context, host):
+    resize_states = [task_states.RESIZE_PREP,
+                     task_states.RESIZE_MIGRATING,
+                     task_states.RESIZE_MIGRATED,
+                     task_states.RESIZE_FINISH]
+    return model_query(context, models.Instance).\
+                   filter(or_(models.Instance.host == host,
+                              models.Instance.task_state.in_(resize_states),
+                              models.Instance.vm_state == vm_states.RESIZED)).\
+                   all()
+
+
 @require_admin_context
 def instance_get_all_by_host_and_not_type(context, host, type_id=None):
     return _instance_get_all_query(context).filter_by(host=host).\
@@ -2290,6 +2504,16 @@ def iscsi_target_count_by_host(context, host):
                    count()
 
 
+@require_admin_context
+def iscsi_target_get_nums_by_host(context, host):
+    result = model_query(context, models.IscsiTarget.volume_id,
+                         models.IscsiTarget.target_num, read_deleted="yes").\
+                     filter(models.IscsiTarget.host == host).\
+                     filter(models.IscsiTarget.volume_id != None).\
+                     all()
+    return dict(result)
+
+
 @require_admin_context
 def iscsi_target_create_safe(context, values):
     iscsi_target_ref = models.IscsiTarget()
@@ -3326,6 +3550,16 @@ def block_device_mapping_get_all_by_instance(context, instance_uuid):
                  all()
 
 
+@require_context
+def block_device_mapping_get_all_by_instances(context, instance_uuids):
+    if not instance_uuids:
+        return []
+    return _block_device_mapping_get_query(context).\
+                 filter(models.BlockDeviceMapping.instance_uuid.in_(
+                         instance_uuids)).\
+                 all()
+
+
 @require_context
 def block_device_mapping_destroy(context, bdm_id):
     session = get_session()
@@ -4683,6 +4917,16 @@ def s3_image_get_by_uuid(context, image_uuid):
     return result
 
 
+def s3_image_get_all_by_uuids(context, image_uuids):
+    """Find the local s3 images represented by any of the provided uuids"""
+    if not image_uuids:
+        return []
+    return model_query(context, models.S3Image, read_deleted="yes").\
+                 filter(models.S3Image.uuid.in_(image_uuids)).\
+                 order_by(models.S3Image.id).\
+                 all()
+
+
 def s3_image_create(context, image_uuid):
     """Create local s3 image represented by provided uuid"""
     try:
@@ -5196,6 +5440,19 @@ def get_ec2_instance_id_by_uuid(context, instance_id, session=None):
     return result['id']
 
 
+@require_context
+def get_ec2_instance_ids_by_uuids(context, instance_uuids):
+    if not instance_uuids:
+        return {}
+    result = _ec2_instance_get_query(context).\
+                    filter(models.InstanceIdMapping.uuid.in_(
+                            instance_uuids)).\
+                    order_by(desc(models.InstanceIdMapping.id)).\
+                    all()
+    # NOTE: the lowest id of a uuid mapped more than once goes in last.
+    return dict((mapping['uuid'], mapping['id']) for mapping in result)
+
+
 @require_context
 def get_instance_uuid_by_ec2_id(context, instance_id, session=None):
     result = _ec2_instance_get_query(context,
@@ -297,6 +297,10 @@ class InvalidParameterValue(Invalid):
     message = _("%(err)s")
 
 
+class InvalidSortKey(Invalid):
+    message = _("Sort key supplied was not valid.")
+
+
 class InvalidAggregateAction(Invalid):
     message = _("Cannot perform action '%(action)s' on aggregate "
                 "%(aggregate_id)s. Reason: %(reason)s.")
@@ -437,6 +441,10 @@ class VirtDriverNotFound(NotFound):
     message = _("Could not find driver for connection_type %(name)s")
 
 
+class MarkerNotFound(NotFound):
+    message = _("Marker %(marker)s could not be found.")
+
+
 class VolumeNotFound(NotFound):
     message = _("Volume %(volume_id)s could not be found.")
 
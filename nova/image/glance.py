@@ -20,6 +20,7 @@
 from __future__ import absolute_import
 
 import copy
+import itertools
 import random
 import sys
 import time
@@ -30,14 +31,122 @@ from glance.common import exception as glance_exception
 
 from nova import exception
 from nova import flags
+from nova.openstack.common import cfg
 from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
 from nova import utils
 
 
+glance_opts = [
+    cfg.IntOpt('glance_client_cache_size',
+               default=100,
+               help='Number of glance clients kept for reuse, one for each '
+                    'glance server and set of credentials'),
+    cfg.IntOpt('glance_image_cache_ttl',
+               default=60,
+               help='Number of seconds the metadata of an active image is '
+                    'cached for show(), 0 to disable the cache'),
+    cfg.IntOpt('glance_image_cache_size',
+               default=1000,
+               help='Maximum number of image metadata entries cached'),
+    cfg.IntOpt('glance_image_cache_stats_interval',
+               default=600,
+               help='Number of seconds between the debug logs of the hit '
+                    'ratio of the image metadata cache, 0 to disable them'),
+    ]
+
 LOG = logging.getLogger(__name__)
 FLAGS = flags.FLAGS
+FLAGS.register_opts(glance_opts)
+
+
+class _LRUCache(object):
+    """A dict of expiring entries bounded to the most recently used ones."""
+
+    def __init__(self):
+        self.entries = {}
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._counter = itertools.count()
+
+    def get(self, keys):
+        """Returns the value of the first of keys in the cache, or None."""
+        now = time.time()
+        for key in keys:
+            entry = self.entries.get(key)
+            if entry is None:
+                continue
+            if entry[1] and entry[1] <= now:
+                del self.entries[key]
+                continue
+            entry[0] = self._counter.next()
+            self.stats['hits'] += 1
+            return entry[2]
+        self.stats['misses'] += 1
+        return None
+
+    def set(self, key, value, max_size, ttl=0):
+        if max_size <= 0:
+            return
+        if key not in self.entries and len(self.entries) >= max_size:
+            self._evict(max_size - 1)
+        expires = ttl and time.time() + ttl or 0
+        self.entries[key] = [self._counter.next(), expires, value]
+
+    def delete_if(self, func):
+        """Removes the entries for whose key func returns True."""
+        for key in [key for key in self.entries if func(key)]:
+            del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+        for key in self.stats:
+            self.stats[key] = 0
+
+    def _evict(self, max_size):
+        now = time.time()
+        self.delete_if(lambda key: 0 < self.entries[key][1] <= now)
+        while len(self.entries) > max_size:
+            key = min(self.entries, key=lambda key: self.entries[key][0])
+            del self.entries[key]
+            self.stats['evictions'] += 1
+
+
+# NOTE: glance clients are kept by server and credentials, so the many
+# calls made to glance for one request, like the show() of every image of
+# an EC2 DescribeInstances, don't each build a client of their own.
+_GLANCE_CLIENTS = _LRUCache()
+
+# NOTE: keyed by (image_id, scope) where scope is None for public images,
+# which any context can see, and (project_id, is_admin) for the others, so
+# a private image is only ever served from the cache to contexts of the
+# project and admin-ness it was fetched with.
+_IMAGE_META_CACHE = _LRUCache()
+_image_meta_cache_reported_at = 0
+
+
+def get_image_meta_cache_stats():
+    """Returns the hits, misses, evictions, size and hit ratio of the
+    image metadata cache."""
+    stats = dict(_IMAGE_META_CACHE.stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['size'] = len(_IMAGE_META_CACHE.entries)
+    stats['hit_ratio'] = lookups and float(stats['hits']) / lookups or 0.0
+    return stats
+
+
+def _report_image_meta_cache_stats():
+    """Logs the image metadata cache stats, at most once every
+    glance_image_cache_stats_interval seconds."""
+    global _image_meta_cache_reported_at
+    interval = FLAGS.glance_image_cache_stats_interval
+    now = time.time()
+    if not interval or now < _image_meta_cache_reported_at + interval:
+        return
+    _image_meta_cache_reported_at = now
+    LOG.debug(_('Image metadata cache: %(hits)d hits, %(misses)d misses, '
+                '%(evictions)d evictions, %(size)d entries, hit ratio '
+                '%(hit_ratio).2f'), get_image_meta_cache_stats())
 
 
 def _parse_image_ref(image_href):
@@ -56,6 +165,16 @@ def _parse_image_ref(image_href):
 
 
 def _create_glance_client(context, host, port):
+    key = (host, port, context.user_id, context.project_id,
+           getattr(context, 'auth_token', None))
+    client = _GLANCE_CLIENTS.get([key])
+    if client is None:
+        client = _new_glance_client(context, host, port)
+        _GLANCE_CLIENTS.set(key, client, FLAGS.glance_client_cache_size)
+    return client
+
+
+def _new_glance_client(context, host, port):
     params = {}
     if FLAGS.auth_strategy == 'keystone':
         params['creds'] = {
@@ -185,43 +304,74 @@ class GlanceImageService(object):
 
     def _fetch_images(self, fetch_func, **kwargs):
         """Paginate through results from glance server"""
-        try:
-            images = fetch_func(**kwargs)
-        except Exception:
-            _reraise_translated_exception()
+        while True:
+            try:
+                images = fetch_func(**kwargs)
+            except Exception:
+                _reraise_translated_exception()
 
-        if not images:
-            # break out of recursive loop to end pagination
-            return
+            if not images:
+                # break out of the loop to end pagination
+                return
 
-        for image in images:
-            yield image
+            for image in images:
+                yield image
 
-        try:
-            # attempt to advance the marker in order to fetch next page
-            kwargs['marker'] = images[-1]['id']
-        except KeyError:
-            raise exception.ImagePaginationFailed()
+            try:
+                # attempt to advance the marker in order to fetch next page
+                kwargs['marker'] = images[-1]['id']
+            except KeyError:
+                raise exception.ImagePaginationFailed()
 
-        try:
-            kwargs['limit'] = kwargs['limit'] - len(images)
-            # break if we have reached a provided limit
-            if kwargs['limit'] <= 0:
-                return
-        except KeyError:
-            # ignore missing limit, just proceed without it
-            pass
+            try:
+                kwargs['limit'] = kwargs['limit'] - len(images)
+                # break if we have reached a provided limit
+                if kwargs['limit'] <= 0:
+                    return
+            except KeyError:
+                # ignore missing limit, just proceed without it
+                pass
+
+    def _image_meta_cache_keys(self, context, image_id):
+        # NOTE: only the service of the default glance servers caches; the
+        # ids of a service made for an image href are those of another
+        # glance server.
+        if self._client is not None or not FLAGS.glance_image_cache_ttl:
+            return None
+        image_id = str(image_id)
+        return [(image_id, None),
+                (image_id, (context.project_id, context.is_admin))]
+
+    def _cache_image_meta(self, context, image_id, image_meta):
+        keys = self._image_meta_cache_keys(context, image_id)
+        # NOTE: only active images are cached, as the status of the others
+        # is about to change.
+        if keys is None or image_meta.get('status') != 'active':
+            return
+        key = keys[0] if image_meta.get('is_public') else keys[1]
+        _IMAGE_META_CACHE.set(key, image_meta, FLAGS.glance_image_cache_size,
+                              FLAGS.glance_image_cache_ttl)
 
-        for image in self._fetch_images(fetch_func, **kwargs):
-            yield image
+    @staticmethod
+    def _uncache_image_meta(image_id):
+        image_id = str(image_id)
+        _IMAGE_META_CACHE.delete_if(lambda key: key[0] == image_id)
 
     def show(self, context, image_id):
         """Returns a dict with image data for the given opaque image id."""
-        try:
-            image_meta = self._call_retry(context, 'get_image_meta',
-                                          image_id)
-        except Exception:
-            _reraise_translated_image_exception(image_id)
+        image_meta = None
+        keys = self._image_meta_cache_keys(context, image_id)
+        if keys is not None:
+            image_meta = _IMAGE_META_CACHE.get(keys)
+
+        if image_meta is None:
+            try:
+                image_meta = self._call_retry(context, 'get_image_meta',
+                                              image_id)
+            except Exception:
+                _reraise_translated_image_exception(image_id)
+            self._cache_image_meta(context, image_id, image_meta)
+        _report_image_meta_cache_stats()
 
         if not self._is_image_available(context, image_meta):
             raise exception.ImageNotFound(image_id=image_id)
@@ -272,11 +422,16 @@ class GlanceImageService(object):
         self.show(context, image_id)
         image_meta = self._translate_to_glance(image_meta)
         client = self._get_client(context)
+        self._uncache_image_meta(image_id)
         try:
             image_meta = client.update_image(image_id, image_meta, data,
                                              features)
         except Exception:
             _reraise_translated_image_exception(image_id)
+        finally:
+            # NOTE: a show() racing with the update may have cached the
+            # old metadata again while it was in flight.
+            self._uncache_image_meta(image_id)
 
         base_image_meta = self._translate_from_glance(image_meta)
         return base_image_meta
@@ -307,6 +462,7 @@ class GlanceImageService(object):
                 and (context.project_id != properties['owner_id'])):
                 raise exception.NotAuthorized(_("Not the image owner"))
 
+        self._uncache_image_meta(image_id)
         try:
             result = self._get_client(context).delete_image(image_id)
         except glance_exception.NotFound:
@@ -20,13 +20,14 @@
 
 import base64
 import binascii
+import collections
+import itertools
 import os
-import shutil
 import tarfile
-import tempfile
 
 import boto.s3.connection
 import eventlet
+from eventlet.green import subprocess
 from lxml import etree
 
 from nova.api.ec2 import ec2utils
@@ -36,15 +37,15 @@ from nova import flags
 from nova.image import glance
 from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
-from nova import utils
 
 
 LOG = logging.getLogger(__name__)
 
 s3_opts = [
-    cfg.StrOpt('image_decryption_dir',
-               default='/tmp',
-               help='parent dir for tempdir used for image decryption'),
+    cfg.IntOpt('s3_image_download_concurrency',
+               default=4,
+               help='number of parts of an image bundle downloaded at once '
+                    'when registering it'),
     cfg.StrOpt('s3_access_key',
                default='notchecked',
                help='access key to use for s3 server for images'),
@@ -165,11 +166,29 @@ class S3ImageService(object):
                                                host=FLAGS.s3_host)
 
     @staticmethod
-    def _download_file(bucket, filename, local_dir):
-        key = bucket.get_key(filename)
-        local_filename = os.path.join(local_dir, os.path.basename(filename))
-        key.get_contents_to_filename(local_filename)
-        return local_filename
+    def _download_part(bucket, filename):
+        return bucket.get_key(filename).get_contents_as_string()
+
+    def _download_parts(self, bucket, filenames):
+        """Yields the contents of the parts of an image bundle in order,
+        downloading up to s3_image_download_concurrency of them ahead."""
+        filenames = iter(filenames)
+        pending = collections.deque()
+
+        def _download_next(count):
+            for filename in itertools.islice(filenames, count):
+                pending.append(eventlet.spawn(self._download_part, bucket,
+                                              filename))
+
+        _download_next(FLAGS.s3_image_download_concurrency)
+        try:
+            while pending:
+                part = pending.popleft().wait()
+                _download_next(1)
+                yield part
+        finally:
+            for thread in pending:
+                thread.kill()
 
     def _s3_parse_manifest(self, context, metadata, manifest):
         manifest = etree.fromstring(manifest)
@@ -260,8 +279,6 @@ class S3ImageService(object):
     def _s3_create(self, context, metadata):
         """Gets a manifest from s3 and makes an image."""
 
-        image_path = tempfile.mkdtemp(dir=FLAGS.image_decryption_dir)
-
         image_location = metadata['properties']['image_location']
         bucket_name = image_location.split('/')[0]
         manifest_path = image_location[len(bucket_name) + 1:]
@@ -274,10 +291,10 @@ class S3ImageService(object):
                                                               manifest)
 
         def delayed_create():
-            """This handles the fetching and decrypting of the part files."""
+            """This streams the part files through decryption and untar
+            into the image."""
             context.update_store()
-            log_vars = {'image_location': image_location,
-                        'image_path': image_path}
+            log_vars = {'image_location': image_location}
 
             def _update_image_state(context, image_uuid, image_state):
                 metadata = {'properties': {'image_state': image_state}}
@@ -285,35 +302,18 @@ class S3ImageService(object):
                 self.service.update(context, image_uuid, metadata, None,
                                     headers)
 
-            def _update_image_data(context, image_uuid, image_data):
-                metadata = {}
+            def _update_image_progress(context, image_uuid, percent):
+                metadata = {'properties': {'image_progress': '%d%%' %
+                                                             percent}}
                 headers = {'x-glance-registry-purge-props': False}
-                self.service.update(context, image_uuid, metadata, image_data,
+                self.service.update(context, image_uuid, metadata, None,
                                     headers)
 
-            _update_image_state(context, image_uuid, 'downloading')
-
-            try:
-                parts = []
-                elements = manifest.find('image').getiterator('filename')
-                for fn_element in elements:
-                    part = self._download_file(bucket,
-                                               fn_element.text,
-                                               image_path)
-                    parts.append(part)
-
-                # NOTE(vish): this may be suboptimal, should we use cat?
-                enc_filename = os.path.join(image_path, 'image.encrypted')
-                with open(enc_filename, 'w') as combined:
-                    for filename in parts:
-                        with open(filename) as part:
-                            shutil.copyfileobj(part, combined)
-
-            except Exception:
-                LOG.exception(_("Failed to download %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                _update_image_state(context, image_uuid, 'failed_download')
-                return
+            def _update_image_data(context, image_uuid, image_data, size):
+                metadata = {'size': size}
+                headers = {'x-glance-registry-purge-props': False}
+                self.service.update(context, image_uuid, metadata, image_data,
+                                    headers)
 
             _update_image_state(context, image_uuid, 'decrypting')
 
@@ -323,33 +323,67 @@ class S3ImageService(object):
                 hex_iv = manifest.find('image/ec2_encrypted_iv').text
                 encrypted_iv = binascii.a2b_hex(hex_iv)
 
-                dec_filename = os.path.join(image_path, 'image.tar.gz')
-                self._decrypt_image(context, enc_filename, encrypted_key,
-                                    encrypted_iv, dec_filename)
+                key, iv = self._decrypt_image_key(context, encrypted_key,
+                                                  encrypted_iv)
             except Exception:
-                LOG.exception(_("Failed to decrypt %(image_location)s "
-                                "to %(image_path)s"), log_vars)
+                LOG.exception(_("Failed to decrypt %(image_location)s"),
+                              log_vars)
                 _update_image_state(context, image_uuid, 'failed_decrypt')
                 return
 
-            _update_image_state(context, image_uuid, 'untarring')
+            _update_image_state(context, image_uuid, 'downloading')
 
+            # NOTE: the parts are downloaded ahead into a bounded queue and
+            # piped through openssl, whose output is read by tarfile in
+            # stream mode and uploaded as it is read; nothing touches the
+            # local disk.
+            filenames = [fn_element.text for fn_element in
+                         manifest.find('image').getiterator('filename')]
+            parts = self._download_parts(bucket, filenames)
+            decrypter, feeder = self._decrypt_image(parts, key, iv)
+
+            failure = None
+            stage = 'failed_untar'
             try:
-                unz_filename = self._untarzip_image(image_path, dec_filename)
+                tar_file = tarfile.open(fileobj=decrypter.stdout, mode='r|gz')
+                member = self._image_member(tar_file)
+
+                stage = 'failed_upload'
+                _update_image_state(context, image_uuid, 'uploading')
+                image_data = ImageDataReader(
+                        tar_file.extractfile(member), member.size,
+                        lambda percent: _update_image_progress(
+                                context, image_uuid, percent))
+                _update_image_data(context, image_uuid, image_data,
+                                   member.size)
+
+                # Let openssl write out what's left of the tarball.
+                while decrypter.stdout.read(65536):
+                    pass
             except Exception:
-                LOG.exception(_("Failed to untar %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                _update_image_state(context, image_uuid, 'failed_untar')
-                return
+                LOG.exception(_("Failed to register %(image_location)s"),
+                              log_vars)
+                failure = stage
+                if decrypter.poll() is None:
+                    decrypter.kill()
 
-            _update_image_state(context, image_uuid, 'uploading')
+            # Report the earliest stage of the pipeline that failed.
             try:
-                with open(unz_filename) as image_file:
-                    _update_image_data(context, image_uuid, image_file)
+                feeder.wait()
             except Exception:
-                LOG.exception(_("Failed to upload %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                _update_image_state(context, image_uuid, 'failed_upload')
+                LOG.exception(_("Failed to download %(image_location)s"),
+                              log_vars)
+                failure = 'failed_download'
+            else:
+                err = decrypter.stderr.read()
+                if decrypter.wait() != 0 and failure is None:
+                    log_vars['err'] = err
+                    LOG.error(_("Failed to decrypt %(image_location)s: "
+                                "%(err)s"), log_vars)
+                    failure = 'failed_decrypt'
+
+            if failure:
+                _update_image_state(context, image_uuid, failure)
                 return
 
             metadata = {'status': 'active',
@@ -357,14 +391,13 @@ class S3ImageService(object):
             headers = {'x-glance-registry-purge-props': False}
             self.service.update(context, image_uuid, metadata, None, headers)
 
-            shutil.rmtree(image_path)
-
         eventlet.spawn_n(delayed_create)
 
         return image
 
-    def _decrypt_image(self, context, encrypted_filename, encrypted_key,
-                       encrypted_iv, decrypted_filename):
+    def _decrypt_image_key(self, context, encrypted_key, encrypted_iv):
+        """Returns the key and initialization vector of an image bundle,
+        decrypted with the project's private key."""
         elevated = context.elevated()
         try:
             key = self.cert_rpcapi.decrypt_text(elevated,
@@ -380,35 +413,78 @@ class S3ImageService(object):
         except Exception, exc:
             raise exception.NovaException(_('Failed to decrypt initialization '
                                     'vector: %s') % exc)
-
-        try:
-            utils.execute('openssl', 'enc',
-                          '-d', '-aes-128-cbc',
-                          '-in', '%s' % (encrypted_filename,),
-                          '-K', '%s' % (key,),
-                          '-iv', '%s' % (iv,),
-                          '-out', '%s' % (decrypted_filename,))
-        except exception.ProcessExecutionError, exc:
-            raise exception.NovaException(_('Failed to decrypt image file '
-                                    '%(image_file)s: %(err)s') %
-                                    {'image_file': encrypted_filename,
-                                     'err': exc.stdout})
+        return key, iv
 
     @staticmethod
-    def _test_for_malicious_tarball(path, filename):
-        """Raises exception if extracting tarball would escape extract path"""
-        tar_file = tarfile.open(filename, 'r|gz')
-        for n in tar_file.getnames():
-            if not os.path.abspath(os.path.join(path, n)).startswith(path):
-                tar_file.close()
-                raise exception.NovaException(_('Unsafe filenames in image'))
-        tar_file.close()
+    def _decrypt_image(parts, key, iv):
+        """Starts decrypting the parts of an image bundle with openssl.
+
+        Returns the openssl process, whose stdout is the decrypted image,
+        and the greenthread writing the parts to its stdin; waiting for the
+        greenthread raises any error downloading them.
+
+        """
+        decrypter = subprocess.Popen(['openssl', 'enc',
+                                      '-d', '-aes-128-cbc',
+                                      '-K', '%s' % (key,),
+                                      '-iv', '%s' % (iv,)],
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE)
+
+        def _feed():
+            try:
+                for part in parts:
+                    try:
+                        decrypter.stdin.write(part)
+                    except IOError:
+                        # openssl exited, its status tells why.
+                        return
+            finally:
+                decrypter.stdin.close()
+
+        return decrypter, eventlet.spawn(_feed)
 
     @staticmethod
-    def _untarzip_image(path, filename):
-        S3ImageService._test_for_malicious_tarball(path, filename)
-        tar_file = tarfile.open(filename, 'r|gz')
-        tar_file.extractall(path)
-        image_file = tar_file.getnames()[0]
-        tar_file.close()
-        return os.path.join(path, image_file)
+    def _image_member(tar_file):
+        """Returns the first member of a bundle's tarball, the image file.
+
+        Raises an exception if extracting it would escape the extract path,
+        as bundles like that are malicious.
+
+        """
+        member = tar_file.next()
+        if member is None:
+            raise exception.NovaException(_('No image file in image bundle'))
+        name = os.path.normpath(member.name)
+        if os.path.isabs(name) or name.split(os.sep)[0] == os.pardir:
+            raise exception.NovaException(_('Unsafe filenames in image'))
+        if not member.isfile():
+            raise exception.NovaException(_('No image file in image bundle'))
+        return member
+
+
+class ImageDataReader(object):
+    """Reads an image's data from a file, reporting the progress.
+
+    It deliberately doesn't offer seek() or tell(), so the image is uploaded
+    as it is read rather than measured first.
+
+    """
+
+    def __init__(self, image_file, size, progress):
+        self.image_file = image_file
+        self.size = size
+        self.progress = progress
+        self.bytes_read = 0
+        self.reported = 0
+
+    def read(self, size=-1):
+        data = self.image_file.read(size)
+        self.bytes_read += len(data)
+        # Report every 10 percent.
+        percent = self.bytes_read * 100 / max(self.size, 1) / 10 * 10
+        if percent > self.reported:
+            self.reported = percent
+            self.progress(percent)
+        return data
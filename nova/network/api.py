@@ -266,17 +266,45 @@ class API(base.Base):
 
     def _get_instance_nw_info(self, context, instance):
         """Returns all network info related to an instance."""
-        args = {'instance_id': instance['id'],
-                'instance_uuid': instance['uuid'],
-                'rxtx_factor': instance['instance_type']['rxtx_factor'],
-                'host': instance['host'],
-                'project_id': instance['project_id']}
+        args = self._get_instance_nw_info_args(instance)
         nw_info = rpc.call(context, FLAGS.network_topic,
                            {'method': 'get_instance_nw_info',
                             'args': args})
 
         return network_model.NetworkInfo.hydrate(nw_info)
 
+    def _get_instance_nw_info_args(self, instance):
+        return {'instance_id': instance['id'],
+                'instance_uuid': instance['uuid'],
+                'rxtx_factor': instance['instance_type']['rxtx_factor'],
+                'host': instance['host'],
+                'project_id': instance['project_id']}
+
+    def get_instances_nw_info(self, context, instances):
+        """Returns all network info related to many instances with a
+        single call to the network manager, as a dict of instance uuid to
+        network info.  The info_cache of the instances is updated.
+        """
+        args = {'instances': [self._get_instance_nw_info_args(instance)
+                              for instance in instances]}
+        nw_infos = rpc.call(context, FLAGS.network_topic,
+                            {'method': 'get_instances_nw_info',
+                             'args': args})
+
+        result = {}
+        for instance in instances:
+            nw_info = network_model.NetworkInfo.hydrate(
+                    nw_infos[instance['uuid']])
+            try:
+                cache = {'network_info': nw_info.json()}
+                self.db.instance_info_cache_update(context, instance['uuid'],
+                                                   cache)
+            except Exception:
+                LOG.exception(_('Failed storing info cache'),
+                              instance=instance)
+            result[instance['uuid']] = nw_info
+        return result
+
     def validate_networks(self, context, requested_networks):
         """validate the networks passed at the time of creating
         the server
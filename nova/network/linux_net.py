@@ -20,6 +20,7 @@
 """Implements vlans, bridges, and iptables rules using linux utilities."""
 
 import calendar
+import hashlib
 import inspect
 import netaddr
 import os
@@ -80,6 +81,11 @@ linux_net_opts = [
                 default=False,
                 help='Use single default gateway. Only first nic of vm will '
                      'get default gateway from dhcp server'),
+    cfg.BoolOpt('iptables_incremental_apply',
+                default=False,
+                help='Only restore the iptables chains owned by this service '
+                     'that changed since the last apply, instead of saving '
+                     'and restoring whole tables every time'),
     ]
 
 FLAGS = flags.FLAGS
@@ -176,11 +182,14 @@ class IptablesTable(object):
         self.rules = filter(lambda r: r.chain != name, self.rules)
 
         if wrap:
-            jump_snippet = '-j %s-%s' % (binary_name, name)
+            jump_snippet = '-j %s-%s ' % (binary_name, name)
         else:
-            jump_snippet = '-j %s' % (name,)
+            jump_snippet = '-j %s ' % (name,)
 
-        self.rules = filter(lambda r: jump_snippet not in r.rule, self.rules)
+        # NOTE: the trailing space keeps jumps to chains whose name starts
+        # with this one, e.g. inst-12 when removing inst-1
+        self.rules = filter(lambda r: jump_snippet not in r.rule + ' ',
+                            self.rules)
 
     def add_rule(self, chain, rule, wrap=True, top=False):
         """Add a rule to the table.
@@ -224,10 +233,8 @@ class IptablesTable(object):
 
     def empty_chain(self, chain, wrap=True):
         """Remove all rules from a chain."""
-        chained_rules = [rule for rule in self.rules
-                              if rule.chain == chain and rule.wrap == wrap]
-        for rule in chained_rules:
-            self.rules.remove(rule)
+        self.rules = [rule for rule in self.rules
+                      if rule.chain != chain or rule.wrap != wrap]
 
 
 class IptablesManager(object):
@@ -263,6 +270,11 @@ class IptablesManager(object):
                      'nat': IptablesTable()}
         self.ipv6 = {'filter': IptablesTable()}
 
+        self.iptables_apply_deferred = False
+        self._apply_requests = 0
+        self._applied_request = 0
+        self._applied_tables = {}
+
         # Add a nova-filter-top chain. It's intended to be shared
         # among the various nova components. It sits at the very top
         # of FORWARD and OUTPUT.
@@ -312,7 +324,20 @@ class IptablesManager(object):
         self.ipv4['nat'].add_chain('float-snat')
         self.ipv4['nat'].add_rule('snat', '-j $float-snat')
 
-    @utils.synchronized('iptables', external=True)
+    def defer_apply_on(self):
+        """Stop applying rules until defer_apply_off() is called.
+
+        Useful when many rules are about to be changed in a row, so that
+        they all end up in a single apply.
+
+        """
+        self.iptables_apply_deferred = True
+
+    def defer_apply_off(self):
+        """Apply the rules changed since defer_apply_on() was called."""
+        self.iptables_apply_deferred = False
+        self.apply()
+
     def apply(self):
         """Apply the current in-memory set of iptables rules.
 
@@ -320,25 +345,127 @@ class IptablesManager(object):
         same component of Nova, and replace them with our current set of
         rules. This happens atomically, thanks to iptables-restore.
 
+        Callers that come in while an apply is in progress are served by
+        the next one, which picks up all of their changes at once.
+
         """
+        if self.iptables_apply_deferred:
+            LOG.debug(_("IPTablesManager.apply deferred"))
+            return
+        self._apply_requests += 1
+        self._apply(self._apply_requests)
+
+    @utils.synchronized('iptables', external=True)
+    def _apply(self, request):
+        if request <= self._applied_request:
+            LOG.debug(_("IPTablesManager.apply already done by a concurrent "
+                        "call"))
+            return
+        # NOTE: the in-memory tables are read from now on, so every change
+        # made before the latest apply() call goes out with this one.
+        request = self._apply_requests
+
         s = [('iptables', self.ipv4)]
         if FLAGS.use_ipv6:
             s += [('ip6tables', self.ipv6)]
 
         for cmd, tables in s:
             for table in tables:
-                current_table, _err = self.execute('%s-save' % (cmd,),
-                                                   '-t', '%s' % (table,),
-                                                   run_as_root=True,
-                                                   attempts=5)
-                current_lines = current_table.split('\n')
-                new_filter = self._modify_rules(current_lines,
-                                                tables[table])
-                self.execute('%s-restore' % (cmd,), run_as_root=True,
-                             process_input='\n'.join(new_filter),
-                             attempts=5)
+                if FLAGS.iptables_incremental_apply:
+                    self._apply_table_changes(cmd, table, tables[table])
+                else:
+                    self._apply_table(cmd, table, tables[table])
+        self._applied_request = request
         LOG.debug(_("IPTablesManager.apply completed with success"))
 
+    def _apply_table(self, cmd, table_name, table):
+        """Save, rewrite and restore a whole table."""
+        current_table, _err = self.execute('%s-save' % (cmd,),
+                                           '-t', '%s' % (table_name,),
+                                           run_as_root=True,
+                                           attempts=5)
+        current_lines = current_table.split('\n')
+        new_filter = self._modify_rules(current_lines, table)
+        self.execute('%s-restore' % (cmd,), run_as_root=True,
+                     process_input='\n'.join(new_filter),
+                     attempts=5)
+
+    def _apply_table_changes(self, cmd, table_name, table):
+        """Restore only the wrapped chains of a table that changed.
+
+        The hashes of what was last applied are kept for each table. As
+        long as the rules outside of our wrapped chains stay the same, the
+        changed, new and removed wrapped chains are rewritten with
+        iptables-restore --noflush and the rest of the table is left alone.
+        Anything else falls back to _apply_table().
+
+        """
+        shared_hash, chains = self._table_state(table)
+        chain_hashes = dict((name, self._hash_lines(rules))
+                            for name, rules in chains.iteritems())
+
+        # NOTE: what was applied is forgotten until this apply succeeds,
+        # a failed restore leaves the table in an unknown state.
+        key = (cmd, table_name)
+        applied = self._applied_tables.pop(key, None)
+        if applied is None or applied[0] != shared_hash:
+            self._apply_table(cmd, table_name, table)
+            self._applied_tables[key] = (shared_hash, chain_hashes)
+            return
+
+        applied_hashes = applied[1]
+        changed = [name for name, chain_hash in chain_hashes.iteritems()
+                   if applied_hashes.get(name) != chain_hash]
+        removed = [name for name in applied_hashes if name not in chains]
+        if not changed and not removed:
+            self._applied_tables[key] = applied
+            return
+
+        # NOTE: with --noflush, declaring a chain creates it or flushes it.
+        # Removed chains are flushed before being deleted, once the chains
+        # jumping to them have been rewritten.
+        lines = ['*%s' % (table_name,)]
+        lines += [':%s - [0:0]' % (name,) for name in changed + removed]
+        for name in changed:
+            lines += chains[name]
+        lines += ['-X %s' % (name,) for name in removed]
+        lines += ['COMMIT', '']
+        self.execute('%s-restore' % (cmd,), '--noflush', run_as_root=True,
+                     process_input='\n'.join(lines),
+                     attempts=5)
+        self._applied_tables[key] = (shared_hash, chain_hashes)
+
+    def _table_state(self, table):
+        """Returns a hash of the parts of a table shared with other
+        components, and the rules of each of our wrapped chains."""
+        chains = dict(('%s-%s' % (binary_name, name), [])
+                      for name in table.chains)
+        shared = sorted(table.unwrapped_chains)
+        for rule in table.rules:
+            if rule.wrap:
+                chains.setdefault('%s-%s' % (binary_name, rule.chain),
+                                  []).append(str(rule))
+            else:
+                shared.append('%s %s' % (rule.top, rule))
+
+        # NOTE: iptables-restore keeps the last of duplicate rules, and
+        # so does _modify_rules()
+        for name, rules in chains.iteritems():
+            if len(set(rules)) != len(rules):
+                seen = set()
+                unique = []
+                for rule in reversed(rules):
+                    if rule not in seen:
+                        seen.add(rule)
+                        unique.append(rule)
+                unique.reverse()
+                chains[name] = unique
+        return self._hash_lines(shared), chains
+
+    @staticmethod
+    def _hash_lines(lines):
+        return hashlib.md5('\n'.join(lines)).hexdigest()
+
     def _modify_rules(self, current_lines, table, binary=None):
         unwrapped_chains = table.unwrapped_chains
         chains = table.chains
@@ -358,16 +485,15 @@ class IptablesManager(object):
                 if not rule.startswith(':'):
                     break
 
-        our_rules = []
-        for rule in rules:
-            rule_str = str(rule)
-            if rule.top:
-                # rule.top == True means we want this rule to be at the top.
-                # Further down, we weed out duplicates from the bottom of the
-                # list, so here we remove the dupes ahead of time.
-                new_filter = filter(lambda s: s.strip() != rule_str.strip(),
-                                    new_filter)
-            our_rules += [rule_str]
+        our_rules = [str(rule) for rule in rules]
+
+        # rule.top == True means we want this rule to be at the top.
+        # Further down, we weed out duplicates from the bottom of the
+        # list, so here we remove the dupes ahead of time.
+        top_rules = set(str(rule).strip() for rule in rules if rule.top)
+        if top_rules:
+            new_filter = [line for line in new_filter
+                          if line.strip() not in top_rules]
 
         new_filter[rules_index:rules_index] = our_rules
 
@@ -136,6 +136,10 @@ network_opts = [
     cfg.IntOpt('fixed_ip_disassociate_timeout',
                default=600,
                help='Seconds after which a deallocated ip is disassociated'),
+    cfg.IntOpt('fixed_ip_create_batch_size',
+               default=1024,
+               help='Number of fixed ips created per db call when a network '
+                    'is created'),
     cfg.IntOpt('create_unique_mac_address_attempts',
                default=5,
                help='Number of attempts to create unique mac address'),
@@ -273,6 +277,63 @@ def check_policy(context, action):
     nova.policy.enforce(context, _action, target)
 
 
+class _BulkIpam(object):
+    """Answers the ipam lookups of build_network_info_model() for the
+    virtual interfaces of many instances.
+
+    Their fixed ips and floating ips are loaded with one query each up
+    front, and the subnets of each network are only looked up once.
+    Anything else is passed on to the ipam lib.
+    """
+
+    def __init__(self, db, ipam, context, vifs, networks):
+        self.ipam = ipam
+        self.vifs = dict((vif['uuid'], vif) for vif in vifs)
+        self.networks = dict((network['uuid'], network)
+                             for network in networks)
+        self.subnets = {}
+
+        fixed_ips = db.fixed_ips_by_virtual_interfaces(context,
+                [vif['id'] for vif in vifs])
+        self.fixed_addresses = {}
+        fixed_addresses_by_id = {}
+        for fixed_ip in fixed_ips:
+            self.fixed_addresses.setdefault(fixed_ip['virtual_interface_id'],
+                                            []).append(fixed_ip['address'])
+            fixed_addresses_by_id[fixed_ip['id']] = fixed_ip['address']
+
+        floating_ips = db.floating_ip_get_by_fixed_ip_ids(context,
+                fixed_addresses_by_id.keys())
+        self.floating_ips = {}
+        for floating_ip in floating_ips:
+            fixed_address = fixed_addresses_by_id[floating_ip['fixed_ip_id']]
+            self.floating_ips.setdefault(fixed_address,
+                                         []).append(floating_ip)
+
+    def __getattr__(self, name):
+        return getattr(self.ipam, name)
+
+    def get_subnets_by_net_id(self, context, tenant_id, net_id, vif_id=None):
+        if net_id not in self.subnets:
+            self.subnets[net_id] = self.ipam.get_subnets_by_net_id(context,
+                    tenant_id, net_id, vif_id)
+        return self.subnets[net_id]
+
+    def get_v4_ips_by_interface(self, context, net_id, vif_id, project_id):
+        return self.fixed_addresses.get(self.vifs[vif_id]['id'], [])
+
+    def get_v6_ips_by_interface(self, context, net_id, vif_id, project_id):
+        network = self.networks[net_id]
+        if network['cidr_v6']:
+            return [ipv6.to_global(network['cidr_v6'],
+                                   self.vifs[vif_id]['address'],
+                                   project_id)]
+        return []
+
+    def get_floating_ips_by_fixed_address(self, context, fixed_address):
+        return self.floating_ips.get(fixed_address, [])
+
+
 class FloatingIP(object):
     """Mixin class for adding floating IP functionality to a manager."""
     def init_host_floating_ips(self):
@@ -1016,10 +1077,52 @@ class NetworkManager(manager.SchedulerDependentManager):
                                                          rxtx_factor, host)
         return nw_info
 
+    @wrap_check_policy
+    def get_instances_nw_info(self, context, instances, **kwargs):
+        """Creates network info lists for many instances at once.
+
+        Same as get_instance_nw_info(), but the virtual interfaces, fixed
+        ips and floating ips of all the instances are each loaded with a
+        single query, and each network only once.
+
+        :param instances: list of dicts holding the instance_id,
+                          instance_uuid, rxtx_factor and host arguments of
+                          get_instance_nw_info() for each instance
+        :returns: dict of instance uuid to network info list
+        """
+        instance_ids = [instance['instance_id'] for instance in instances]
+        vifs = self.db.virtual_interface_get_by_instances(context,
+                                                          instance_ids)
+        vifs_by_instance = {}
+        networks_by_id = {}
+        for vif in vifs:
+            vifs_by_instance.setdefault(vif['instance_id'], []).append(vif)
+            network_id = vif.get('network_id')
+            if network_id is not None and network_id not in networks_by_id:
+                networks_by_id[network_id] = self._get_network_by_id(
+                        context, network_id)
+
+        ipam = _BulkIpam(self.db, self.ipam, context, vifs,
+                         networks_by_id.values())
+        nw_infos = {}
+        for instance in instances:
+            instance_vifs = vifs_by_instance.get(instance['instance_id'], [])
+            networks = {}
+            for vif in instance_vifs:
+                if vif.get('network_id') is not None:
+                    networks[vif['uuid']] = networks_by_id[vif['network_id']]
+            nw_infos[instance['instance_uuid']] = \
+                    self.build_network_info_model(context, instance_vifs,
+                            networks, instance['rxtx_factor'],
+                            instance['host'], ipam=ipam)
+        return nw_infos
+
     def build_network_info_model(self, context, vifs, networks,
-                                 rxtx_factor, instance_host):
+                                 rxtx_factor, instance_host, ipam=None):
         """Builds a NetworkInfo object containing all network information
         for an instance"""
+        if ipam is None:
+            ipam = self.ipam
         nw_info = network_model.NetworkInfo()
         for vif in vifs:
             vif_dict = {'id': vif['uuid'],
@@ -1034,7 +1137,7 @@ class NetworkManager(manager.SchedulerDependentManager):
             # get network dict for vif from args and build the subnets
             network = networks[vif['uuid']]
             subnets = self._get_subnets_from_network(context, network, vif,
-                                                             instance_host)
+                                                     instance_host, ipam=ipam)
 
             # if rxtx_cap data are not set everywhere, set to none
             try:
@@ -1043,14 +1146,14 @@ class NetworkManager(manager.SchedulerDependentManager):
                 rxtx_cap = None
 
             # get fixed_ips
-            v4_IPs = self.ipam.get_v4_ips_by_interface(context,
-                                                       network['uuid'],
-                                                       vif['uuid'],
-                                                       network['project_id'])
-            v6_IPs = self.ipam.get_v6_ips_by_interface(context,
-                                                     network['uuid'],
-                                                     vif['uuid'],
-                                                     network['project_id'])
+            v4_IPs = ipam.get_v4_ips_by_interface(context,
+                                                  network['uuid'],
+                                                  vif['uuid'],
+                                                  network['project_id'])
+            v6_IPs = ipam.get_v6_ips_by_interface(context,
+                                                  network['uuid'],
+                                                  vif['uuid'],
+                                                  network['project_id'])
 
             # create model FixedIPs from these fixed_ips
             network_IPs = [network_model.FixedIP(address=ip_address)
@@ -1061,7 +1164,7 @@ class NetworkManager(manager.SchedulerDependentManager):
             for fixed_ip in network_IPs:
                 if fixed_ip['version'] == 6:
                     continue
-                gfipbfa = self.ipam.get_floating_ips_by_fixed_address
+                gfipbfa = ipam.get_floating_ips_by_fixed_address
                 floating_ips = gfipbfa(context, fixed_ip['address'])
                 floating_ips = [network_model.IP(address=ip['address'],
                                                  type='floating')
@@ -1106,10 +1209,12 @@ class NetworkManager(manager.SchedulerDependentManager):
         return network_dict
 
     def _get_subnets_from_network(self, context, network,
-                                  vif, instance_host=None):
+                                  vif, instance_host=None, ipam=None):
         """Returns the 1 or 2 possible subnets for a nova network"""
+        if ipam is None:
+            ipam = self.ipam
         # get subnets
-        ipam_subnets = self.ipam.get_subnets_by_net_id(context,
+        ipam_subnets = ipam.get_subnets_by_net_id(context,
                            network['project_id'], network['uuid'], vif['uuid'])
 
         subnets = []
@@ -1138,7 +1243,7 @@ class NetworkManager(manager.SchedulerDependentManager):
             # get the routes for this subnet
             # NOTE(tr3buchet): default route comes from subnet gateway
             if subnet.get('id'):
-                routes = self.ipam.get_routes_by_ip_block(context,
+                routes = ipam.get_routes_by_ip_block(context,
                                          subnet['id'], network['project_id'])
                 for route in routes:
                     cidr = netaddr.IPNetwork('%s/%s' % (route['destination'],
@@ -1502,18 +1607,24 @@ class NetworkManager(manager.SchedulerDependentManager):
         if not fixed_cidr:
             fixed_cidr = netaddr.IPNetwork(network['cidr'])
         num_ips = len(fixed_cidr)
-        ips = []
-        for index in range(num_ips):
-            address = str(fixed_cidr[index])
-            if index < bottom_reserved or num_ips - index <= top_reserved:
-                reserved = True
-            else:
-                reserved = False
-
-            ips.append({'network_id': network_id,
-                        'address': address,
-                        'reserved': reserved})
-        self.db.fixed_ip_bulk_create(context, ips)
+        # NOTE: the ips are created in batches rather than building a dict
+        #       for every address of the network up front
+        addresses = enumerate(fixed_cidr)
+        while True:
+            ips = []
+            for index, address in itertools.islice(addresses,
+                                            FLAGS.fixed_ip_create_batch_size):
+                if index < bottom_reserved or num_ips - index <= top_reserved:
+                    reserved = True
+                else:
+                    reserved = False
+
+                ips.append({'network_id': network_id,
+                            'address': str(address),
+                            'reserved': reserved})
+            if not ips:
+                break
+            self.db.fixed_ip_bulk_create(context, ips)
 
     def _allocate_fixed_ips(self, context, instance_id, host, networks,
                             **kwargs):
@@ -582,6 +582,17 @@ class QuantumManager(manager.FloatingIP, manager.FlatManager):
 
         return nw_info
 
+    def get_instances_nw_info(self, context, instances, **kwargs):
+        """Fetches the network data of many instances, one at a time.
+
+        :param instances: list of dicts holding the arguments of
+                          get_instance_nw_info() for each instance
+        :returns: dict of instance uuid to network info list
+        """
+        return dict((instance['instance_uuid'],
+                     self.get_instance_nw_info(context, **instance))
+                    for instance in instances)
+
     def deallocate_for_instance(self, context, **kwargs):
         """Called when a VM is terminated.  Loop through each virtual
            interface in the Nova DB and remove the Quantum port and
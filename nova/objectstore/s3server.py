@@ -39,6 +39,7 @@ import datetime
 import hashlib
 import os
 import os.path
+import tempfile
 import urllib
 
 import routes
@@ -65,6 +66,11 @@ s3_opts = [
 FLAGS = flags.FLAGS
 FLAGS.register_opts(s3_opts)
 
+# Objects are read and written in chunks of this many bytes.
+CHUNK_SIZE = 65536
+# Prefix of the temporary files objects are uploaded to.
+UPLOAD_PREFIX = '.upload-'
+
 
 def get_wsgi_server():
     return wsgi.Server("S3 Objectstore",
@@ -96,8 +102,95 @@ class S3Application(wsgi.Router):
         if not os.path.exists(self.directory):
             os.makedirs(self.directory)
         self.bucket_depth = bucket_depth
+        self.object_names = {}
         super(S3Application, self).__init__(mapper)
 
+    def get_object_names(self, bucket_name, path):
+        """Return the sorted names of the objects in a bucket.
+
+        The bucket is walked once, then its names are kept up to date by
+        put and delete. They are read again if the bucket directory changes
+        under us, which only shows when bucket_depth is 0.
+
+        """
+        mtime = os.stat(path).st_mtime
+        cached = self.object_names.get(bucket_name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        object_names = []
+        for root, dirs, files in os.walk(path):
+            for file_name in files:
+                if not file_name.startswith(UPLOAD_PREFIX):
+                    object_names.append(os.path.join(root, file_name))
+        skip = len(path) + 1
+        for i in range(self.bucket_depth):
+            skip += 2 * (i + 1) + 1
+        object_names = [n[skip:] for n in object_names]
+        object_names.sort()
+        self.object_names[bucket_name] = (mtime, object_names)
+        return object_names
+
+    def object_added(self, bucket_name, object_name):
+        cached = self.object_names.get(bucket_name)
+        if cached is None:
+            return
+        object_names = cached[1]
+        i = bisect.bisect_left(object_names, object_name)
+        if i == len(object_names) or object_names[i] != object_name:
+            object_names.insert(i, object_name)
+        self._touch(bucket_name)
+
+    def object_removed(self, bucket_name, object_name):
+        cached = self.object_names.get(bucket_name)
+        if cached is None:
+            return
+        object_names = cached[1]
+        i = bisect.bisect_left(object_names, object_name)
+        if i < len(object_names) and object_names[i] == object_name:
+            del object_names[i]
+        self._touch(bucket_name)
+
+    def _touch(self, bucket_name):
+        """Take our own change of the bucket directory's mtime as seen."""
+        path = os.path.join(self.directory, bucket_name)
+        self.object_names[bucket_name] = (os.stat(path).st_mtime,
+                                          self.object_names[bucket_name][1])
+
+
+class FileIter(object):
+    """Iterates over an open file in chunks.
+
+    webob calls app_iter_range() to answer Range requests, which reads only
+    the requested bytes.
+
+    """
+
+    def __init__(self, object_file):
+        self.file = object_file
+
+    def __iter__(self):
+        return self.app_iter_range(0, None)
+
+    def app_iter_range(self, start, stop):
+        self.file.seek(start)
+        remaining = None
+        if stop is not None:
+            remaining = stop - start
+        while remaining is None or remaining > 0:
+            size = CHUNK_SIZE
+            if remaining is not None:
+                size = min(size, remaining)
+                remaining -= size
+            chunk = self.file.read(size)
+            if not chunk:
+                break
+            yield chunk
+        self.close()
+
+    def close(self):
+        self.file.close()
+
 
 class BaseRequestHandler(object):
     """Base class emulating Tornado's web framework pattern in WSGI.
@@ -227,7 +320,7 @@ class BucketHandler(BaseRequestHandler):
     def get(self, bucket_name):
         prefix = self.get_argument("prefix", u"")
         marker = self.get_argument("marker", u"")
-        max_keys = int(self.get_argument("max-keys", 50000))
+        max_keys = int(self.get_argument("max-keys", 1000))
         path = os.path.abspath(os.path.join(self.application.directory,
                                             bucket_name))
         terse = int(self.get_argument("terse", 0))
@@ -235,15 +328,7 @@ class BucketHandler(BaseRequestHandler):
             not os.path.isdir(path)):
             self.set_status(404)
             return
-        object_names = []
-        for root, dirs, files in os.walk(path):
-            for file_name in files:
-                object_names.append(os.path.join(root, file_name))
-        skip = len(path) + 1
-        for i in range(self.application.bucket_depth):
-            skip += 2 * (i + 1) + 1
-        object_names = [n[skip:] for n in object_names]
-        object_names.sort()
+        object_names = self.application.get_object_names(bucket_name, path)
         contents = []
 
         start_pos = 0
@@ -253,7 +338,7 @@ class BucketHandler(BaseRequestHandler):
             start_pos = bisect.bisect_left(object_names, prefix, start_pos)
 
         truncated = False
-        for object_name in object_names[start_pos:]:
+        for object_name in object_names[start_pos:start_pos + max_keys + 1]:
             if not object_name.startswith(prefix):
                 break
             if len(contents) >= max_keys:
@@ -275,7 +360,7 @@ class BucketHandler(BaseRequestHandler):
             "Prefix": prefix,
             "Marker": marker,
             "MaxKeys": max_keys,
-            "IsTruncated": truncated,
+            "IsTruncated": truncated and "true" or "false",
             "Contents": contents,
         }})
 
@@ -300,11 +385,20 @@ class BucketHandler(BaseRequestHandler):
             self.set_status(403)
             return
         os.rmdir(path)
+        self.application.object_names.pop(bucket_name, None)
         self.set_status(204)
         self.finish()
 
 
 class ObjectHandler(BaseRequestHandler):
+    def _set_object_headers(self, path):
+        info = os.stat(path)
+        self.set_header("Content-Type", "application/unknown")
+        self.set_header("Last-Modified", datetime.datetime.utcfromtimestamp(
+            info.st_mtime))
+        self.set_header("Accept-Ranges", "bytes")
+        return info
+
     def get(self, bucket, object_name):
         object_name = urllib.unquote(object_name)
         path = self._object_path(bucket, object_name)
@@ -312,15 +406,20 @@ class ObjectHandler(BaseRequestHandler):
             not os.path.isfile(path)):
             self.set_status(404)
             return
-        info = os.stat(path)
-        self.set_header("Content-Type", "application/unknown")
-        self.set_header("Last-Modified", datetime.datetime.utcfromtimestamp(
-            info.st_mtime))
-        object_file = open(path, "r")
-        try:
-            self.finish(object_file.read())
-        finally:
-            object_file.close()
+        info = self._set_object_headers(path)
+        self.response.app_iter = FileIter(open(path, "rb"))
+        self.response.content_length = info.st_size
+        self.response.conditional_response = True
+
+    def head(self, bucket, object_name):
+        object_name = urllib.unquote(object_name)
+        path = self._object_path(bucket, object_name)
+        if (not path.startswith(self.application.directory) or
+            not os.path.isfile(path)):
+            self.set_status(404)
+            return
+        info = self._set_object_headers(path)
+        self.response.content_length = info.st_size
 
     def put(self, bucket, object_name):
         object_name = urllib.unquote(object_name)
@@ -337,11 +436,34 @@ class ObjectHandler(BaseRequestHandler):
         directory = os.path.dirname(path)
         if not os.path.exists(directory):
             os.makedirs(directory)
-        object_file = open(path, "w")
-        object_file.write(self.request.body)
-        object_file.close()
-        self.set_header('ETag',
-                        '"%s"' % hashlib.md5(self.request.body).hexdigest())
+
+        # NOTE: the body is streamed into a temporary file that replaces the
+        # object once complete, so readers never see a partial object.
+        md5 = hashlib.md5()
+        remaining = self.request.content_length
+        body_file = self.request.body_file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=UPLOAD_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as object_file:
+                while remaining is None or remaining > 0:
+                    size = CHUNK_SIZE
+                    if remaining is not None:
+                        size = min(size, remaining)
+                    chunk = body_file.read(size)
+                    if not chunk:
+                        break
+                    if remaining is not None:
+                        remaining -= len(chunk)
+                    md5.update(chunk)
+                    object_file.write(chunk)
+            os.chmod(tmp_path, 0644)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        self.application.object_added(bucket, object_name)
+        self.set_header('ETag', '"%s"' % md5.hexdigest())
         self.finish()
 
     def delete(self, bucket, object_name):
@@ -352,5 +474,6 @@ class ObjectHandler(BaseRequestHandler):
             self.set_status(404)
             return
         os.unlink(path)
+        self.application.object_removed(bucket, object_name)
         self.set_status(204)
         self.finish()
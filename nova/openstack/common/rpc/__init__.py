@@ -56,6 +56,16 @@ rpc_opts = [
     cfg.BoolOpt('fake_rabbit',
                 default=False,
                 help='If passed, use a fake RabbitMQ provider'),
+    cfg.StrOpt('rpc_serializer',
+               default='json',
+               help='Wire format of the rpc messages sent with kombu or '
+                    'ZeroMQ: json or msgpack. msgpack is more compact but '
+                    'every receiver needs the msgpack module.'),
+    cfg.IntOpt('rpc_compression_threshold',
+               default=0,
+               help='Compress the rpc messages sent with kombu or ZeroMQ '
+                    'which are larger than this many bytes; 0 disables '
+                    'compression'),
 ]
 
 cfg.CONF.register_opts(rpc_opts)
@@ -30,15 +30,44 @@ import logging
 import sys
 import uuid
 
+import eventlet
 from eventlet import greenpool
 from eventlet import pools
+from eventlet import queue
 from eventlet import semaphore
 
+from nova.openstack.common import cfg
 from nova.openstack.common import excutils
+from nova.openstack.common import jsonutils
 from nova.openstack.common import local
 from nova.openstack.common.rpc import common as rpc_common
 
 
+amqp_opts = [
+    cfg.BoolOpt('amqp_rpc_single_reply_queue',
+                default=False,
+                help='Enable a single reply queue per process for rpc '
+                     'calls, instead of one queue per call. Servers '
+                     'answering these calls need to support it too.'),
+    cfg.IntOpt('amqp_cast_batch_window_ms',
+               default=0,
+               help='Milliseconds during which casts and fanout casts are '
+                    'buffered to be published together; 0 publishes each '
+                    'cast right away'),
+    cfg.IntOpt('amqp_cast_batch_size',
+               default=100,
+               help='Number of buffered casts which triggers publishing '
+                    'them before the end of amqp_cast_batch_window_ms'),
+    cfg.ListOpt('amqp_cast_coalesce_methods',
+                default=['refresh_security_group_rules',
+                         'refresh_security_group_members',
+                         'refresh_provider_fw_rules'],
+                help='Idempotent methods whose identical casts are only '
+                     'published once per batch'),
+]
+
+cfg.CONF.register_opts(amqp_opts)
+
 LOG = logging.getLogger(__name__)
 
 
@@ -50,6 +79,8 @@ class Pool(pools.Pool):
         kwargs.setdefault("max_size", self.conf.rpc_conn_pool_size)
         kwargs.setdefault("order_as_stack", True)
         super(Pool, self).__init__(*args, **kwargs)
+        self.reply_proxy = None
+        self.cast_pipeline = None
 
     # TODO(comstud): Timeout connections not used in a while
     def create(self):
@@ -57,11 +88,17 @@ class Pool(pools.Pool):
         return self.connection_cls(self.conf)
 
     def empty(self):
+        if self.cast_pipeline:
+            self.cast_pipeline.flush()
         while self.free_items:
             self.get().close()
+        if self.reply_proxy:
+            self.reply_proxy.close()
+            self.reply_proxy = None
 
 
 _pool_create_sem = semaphore.Semaphore()
+_reply_proxy_create_sem = semaphore.Semaphore()
 
 
 def get_connection_pool(conf, connection_cls):
@@ -147,10 +184,152 @@ class ConnectionContext(rpc_common.Connection):
             raise rpc_common.InvalidRPCConnectionReuse()
 
 
-def msg_reply(conf, msg_id, connection_pool, reply=None, failure=None,
-              ending=False):
+class ReplyProxy(ConnectionContext):
+    """Connection consuming the replies to all the rpc calls of a process.
+
+    Calls are answered on a single, long-lived reply queue, and each reply
+    is routed by its msg_id to the MulticallProxyWaiter of the call.
+    """
+
+    def __init__(self, conf, connection_pool):
+        self._call_waiters = {}
+        self._reply_q = 'reply_' + uuid.uuid4().hex
+        super(ReplyProxy, self).__init__(conf, connection_pool, pooled=False)
+        self.declare_direct_consumer(self._reply_q, self._process_data)
+        self.consume_in_thread()
+
+    def _process_data(self, message_data):
+        msg_id = message_data.pop('_msg_id', None)
+        waiter = self._call_waiters.get(msg_id)
+        if not waiter:
+            LOG.warn(_('no calling threads waiting for msg_id : %s'), msg_id)
+        else:
+            waiter.put(message_data)
+
+    def add_call_waiter(self, waiter, msg_id):
+        self._call_waiters[msg_id] = waiter
+
+    def del_call_waiter(self, msg_id):
+        self._call_waiters.pop(msg_id, None)
+
+    def get_reply_q(self):
+        return self._reply_q
+
+
+def get_reply_proxy(conf, connection_pool):
+    with _reply_proxy_create_sem:
+        # Make sure only one thread tries to create the reply proxy.
+        if not connection_pool.reply_proxy:
+            connection_pool.reply_proxy = ReplyProxy(conf, connection_pool)
+    return connection_pool.reply_proxy
+
+
+class CastPipeline(object):
+    """Buffers the casts of a process for amqp_cast_batch_window_ms and
+    publishes them together on one pooled connection.
+
+    Identical casts of the amqp_cast_coalesce_methods are only published
+    once per batch.  The stats dict counts the casts buffered, those
+    coalesced, the batches flushed, and the messages published or lost.
+    """
+
+    def __init__(self, conf, connection_pool):
+        self.conf = conf
+        self.connection_pool = connection_pool
+        self.stats = {'casts': 0, 'coalesced': 0, 'flushes': 0,
+                      'published': 0, 'lost': 0}
+        self._casts = []
+        self._coalesce_keys = set()
+        self._flusher = None
+
+    def _coalesce_key(self, send_method, topic, msg):
+        if msg.get('method') not in self.conf.amqp_cast_coalesce_methods:
+            return None
+        return (send_method, topic, msg['method'], msg.get('version'),
+                jsonutils.dumps(msg.get('args'), sort_keys=True))
+
+    def add(self, send_method, topic, msg):
+        """Buffers a message for conn.<send_method>(topic, msg)."""
+        self.stats['casts'] += 1
+        key = self._coalesce_key(send_method, topic, msg)
+        if key is not None:
+            if key in self._coalesce_keys:
+                self.stats['coalesced'] += 1
+                return
+            self._coalesce_keys.add(key)
+
+        self._casts.append((send_method, topic, msg))
+        if len(self._casts) >= self.conf.amqp_cast_batch_size:
+            self.flush()
+        elif self._flusher is None:
+            self._flusher = eventlet.spawn_after(
+                    self.conf.amqp_cast_batch_window_ms / 1000.0, self.flush)
+
+    def flush(self):
+        """Publishes the buffered casts."""
+        casts = self._casts
+        self._casts = []
+        self._coalesce_keys = set()
+        if self._flusher is not None:
+            # NOTE: this does nothing if called from the flusher itself
+            self._flusher.cancel()
+            self._flusher = None
+        if not casts:
+            return
+
+        self.stats['flushes'] += 1
+        LOG.debug(_('Publishing %(count)d batched casts, %(stats)s'),
+                  {'count': len(casts), 'stats': self.stats})
+        # NOTE: this usually runs in the flusher, after the callers of
+        #       cast() returned, so errors can only be logged and counted
+        sent = 0
+        try:
+            with ConnectionContext(self.conf, self.connection_pool) as conn:
+                for send_method, topic, msg in casts:
+                    sent += 1
+                    try:
+                        getattr(conn, send_method)(topic, msg)
+                        self.stats['published'] += 1
+                    except Exception:
+                        self.stats['lost'] += 1
+                        LOG.exception(_('Failed to publish batched cast '
+                                        'on %s'), topic)
+        except Exception:
+            lost = len(casts) - sent
+            self.stats['lost'] += lost
+            LOG.exception(_('Failed to publish batched casts, %d of them '
+                            'were lost'), lost)
+
+    def get_stats(self):
+        """Returns a copy of the stats dict."""
+        return dict(self.stats)
+
+
+def get_cast_pipeline(conf, connection_pool):
+    """Returns the CastPipeline of the pool, or None if casts aren't
+    batched."""
+    if conf.amqp_cast_batch_window_ms <= 0:
+        return None
+    if not connection_pool.cast_pipeline:
+        connection_pool.cast_pipeline = CastPipeline(conf, connection_pool)
+    return connection_pool.cast_pipeline
+
+
+def get_cast_pipeline_stats(connection_pool):
+    """Returns the stats of the CastPipeline of the pool, or None if no
+    cast was batched."""
+    if not connection_pool or not connection_pool.cast_pipeline:
+        return None
+    return connection_pool.cast_pipeline.get_stats()
+
+
+def msg_reply(conf, msg_id, reply_q, connection_pool, reply=None,
+              failure=None, ending=False):
     """Sends a reply or an error on the channel signified by msg_id.
 
+    If the caller gave a reply queue, the reply is sent there instead,
+    tagged with msg_id.
+
     Failure should be a sys.exc_info() tuple.
 
     """
@@ -166,13 +345,18 @@ def msg_reply(conf, msg_id, connection_pool, reply=None, failure=None,
                    'failure': failure}
         if ending:
             msg['ending'] = True
-        conn.direct_send(msg_id, msg)
+        if reply_q:
+            msg['_msg_id'] = msg_id
+            conn.direct_send(reply_q, msg)
+        else:
+            conn.direct_send(msg_id, msg)
 
 
 class RpcContext(rpc_common.CommonRpcContext):
     """Context that supports replying to a rpc.call"""
     def __init__(self, **kwargs):
         self.msg_id = kwargs.pop('msg_id', None)
+        self.reply_q = kwargs.pop('reply_q', None)
         self.conf = kwargs.pop('conf')
         super(RpcContext, self).__init__(**kwargs)
 
@@ -180,13 +364,14 @@ class RpcContext(rpc_common.CommonRpcContext):
         values = self.to_dict()
         values['conf'] = self.conf
         values['msg_id'] = self.msg_id
+        values['reply_q'] = self.reply_q
         return self.__class__(**values)
 
     def reply(self, reply=None, failure=None, ending=False,
               connection_pool=None):
         if self.msg_id:
-            msg_reply(self.conf, self.msg_id, connection_pool, reply, failure,
-                      ending)
+            msg_reply(self.conf, self.msg_id, self.reply_q, connection_pool,
+                      reply, failure, ending)
             if ending:
                 self.msg_id = None
 
@@ -202,6 +387,7 @@ def unpack_context(conf, msg):
             value = msg.pop(key)
             context_dict[key[9:]] = value
     context_dict['msg_id'] = msg.pop('_msg_id', None)
+    context_dict['reply_q'] = msg.pop('_reply_q', None)
     context_dict['conf'] = conf
     ctx = RpcContext.from_dict(context_dict)
     rpc_common._safe_log(LOG.debug, _('unpacked context: %s'), ctx.to_dict())
@@ -336,6 +522,66 @@ class MulticallWaiter(object):
             yield result
 
 
+class MulticallProxyWaiter(object):
+    """Waits for the replies to a call on the ReplyProxy of the process."""
+
+    def __init__(self, conf, msg_id, timeout, connection_pool):
+        self._msg_id = msg_id
+        self._timeout = timeout or conf.rpc_response_timeout
+        self._reply_proxy = connection_pool.reply_proxy
+        self._done = False
+        self._got_ending = False
+        self._conf = conf
+        self._dataqueue = queue.LightQueue()
+        # Add this caller to the reply proxy's call_waiters
+        self._reply_proxy.add_call_waiter(self, self._msg_id)
+
+    def put(self, data):
+        self._dataqueue.put(data)
+
+    def done(self):
+        if self._done:
+            return
+        self._done = True
+        # Remove this caller from reply proxy's call_waiters
+        self._reply_proxy.del_call_waiter(self._msg_id)
+
+    def _process_data(self, data):
+        result = None
+        if data['failure']:
+            failure = data['failure']
+            result = rpc_common.deserialize_remote_exception(self._conf,
+                                                             failure)
+        elif data.get('ending', False):
+            self._got_ending = True
+        else:
+            result = data['result']
+        return result
+
+    def __iter__(self):
+        """Return a result until we get a reply with an 'ending' flag"""
+        if self._done:
+            raise StopIteration
+        while True:
+            try:
+                data = self._dataqueue.get(timeout=self._timeout)
+                result = self._process_data(data)
+            except queue.Empty:
+                LOG.exception(_('Timed out waiting for RPC response.'))
+                self.done()
+                raise rpc_common.Timeout()
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    self.done()
+            if self._got_ending:
+                self.done()
+                raise StopIteration
+            if isinstance(result, Exception):
+                self.done()
+                raise result
+            yield result
+
+
 def create_connection(conf, new, connection_pool):
     """Create a connection"""
     return ConnectionContext(conf, connection_pool, pooled=not new)
@@ -353,6 +599,15 @@ def multicall(conf, context, topic, msg, timeout, connection_pool):
     LOG.debug(_('MSG_ID is %s') % (msg_id))
     pack_context(msg, context)
 
+    if conf.amqp_rpc_single_reply_queue:
+        reply_proxy = get_reply_proxy(conf, connection_pool)
+        msg.update({'_reply_q': reply_proxy.get_reply_q()})
+        wait_msg = MulticallProxyWaiter(conf, msg_id, timeout,
+                                        connection_pool)
+        with ConnectionContext(conf, connection_pool) as conn:
+            conn.topic_send(topic, msg)
+        return wait_msg
+
     conn = ConnectionContext(conf, connection_pool)
     wait_msg = MulticallWaiter(conf, conn, timeout)
     conn.declare_direct_consumer(msg_id, wait_msg)
@@ -374,6 +629,10 @@ def cast(conf, context, topic, msg, connection_pool):
     """Sends a message on a topic without waiting for a response."""
     LOG.debug(_('Making asynchronous cast on %s...'), topic)
     pack_context(msg, context)
+    pipeline = get_cast_pipeline(conf, connection_pool)
+    if pipeline:
+        pipeline.add('topic_send', topic, msg)
+        return
     with ConnectionContext(conf, connection_pool) as conn:
         conn.topic_send(topic, msg)
 
@@ -382,6 +641,10 @@ def fanout_cast(conf, context, topic, msg, connection_pool):
     """Sends a message on a fanout exchange without waiting for a response."""
     LOG.debug(_('Making asynchronous fanout cast...'))
     pack_context(msg, context)
+    pipeline = get_cast_pipeline(conf, connection_pool)
+    if pipeline:
+        pipeline.add('fanout_send', topic, msg)
+        return
     with ConnectionContext(conf, connection_pool) as conn:
         conn.fanout_send(topic, msg)
 
@@ -21,6 +21,7 @@ import copy
 import logging
 import sys
 import traceback
+import zlib
 
 from nova.openstack.common import cfg
 from nova.openstack.common.gettextutils import _
@@ -28,6 +29,11 @@ from nova.openstack.common import importutils
 from nova.openstack.common import jsonutils
 from nova.openstack.common import local
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 
 LOG = logging.getLogger(__name__)
 
@@ -168,6 +174,14 @@ class Connection(object):
 
 def _safe_log(log_func, msg, msg_data):
     """Sanitizes the msg_data field before logging."""
+    # NOTE: payloads can be big, so don't bother copying them when the
+    #       level of log_func is not enabled
+    logger = getattr(log_func, 'im_self', None)
+    level = logging.getLevelName(log_func.__name__.upper())
+    if (isinstance(logger, logging.Logger) and isinstance(level, int) and
+        not logger.isEnabledFor(level)):
+        return
+
     SANITIZE = {'set_admin_password': ('new_pass',),
                 'run_instance': ('admin_password',), }
 
@@ -313,3 +327,61 @@ class CommonRpcContext(object):
             context.values['read_deleted'] = read_deleted
 
         return context
+
+
+# NOTE: payloads which aren't plain json start with this marker, followed
+#       by one byte naming their codec and one naming their compression,
+#       so that receivers can decode whatever format they are sent.
+_ENVELOPE_MARKER = '\x00'
+_CODECS = {'json': 'j', 'msgpack': 'm'}
+
+
+def serialize_msg(data, serializer='json', compression_threshold=0):
+    """Encodes an rpc payload for the wire.
+
+    :param serializer: 'json' or 'msgpack'
+    :param compression_threshold: size in bytes above which the payload is
+                                  compressed with zlib, 0 to never do it
+    """
+    if serializer not in _CODECS:
+        raise RPCException(_('Unknown rpc serializer %s') % serializer)
+    if serializer == 'msgpack':
+        if msgpack is None:
+            raise RPCException(_('The msgpack rpc serializer requires the '
+                                 'msgpack module'))
+        body = msgpack.packb(data, default=jsonutils.to_primitive)
+    else:
+        try:
+            body = str(jsonutils.dumps(data, ensure_ascii=True))
+        except TypeError:
+            LOG.error(_("JSON serialization failed."))
+            raise
+
+    compressed = compression_threshold and len(body) > compression_threshold
+    if compressed:
+        body = zlib.compress(body)
+    elif serializer == 'json':
+        # Plain json can still be read by receivers predating envelopes
+        return body
+    return ''.join([_ENVELOPE_MARKER, _CODECS[serializer],
+                    compressed and 'z' or '-', body])
+
+
+def deserialize_msg(data):
+    """Decodes an rpc payload encoded by serialize_msg()."""
+    if not data.startswith(_ENVELOPE_MARKER):
+        return jsonutils.loads(data)
+
+    codec, compression, body = data[1], data[2], data[3:]
+    if compression == 'z':
+        body = zlib.decompress(body)
+    elif compression != '-':
+        raise RPCException(_('Unknown rpc payload compression %r') %
+                           compression)
+
+    if codec == _CODECS['json']:
+        return jsonutils.loads(body)
+    elif codec == _CODECS['msgpack'] and msgpack is not None:
+        return msgpack.unpackb(body, encoding='utf-8')
+    raise RPCException(_('Unable to decode rpc payload encoded with %r') %
+                       codec)
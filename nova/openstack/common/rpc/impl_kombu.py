@@ -28,6 +28,7 @@ import kombu
 import kombu.connection
 import kombu.entity
 import kombu.messaging
+import kombu.serialization
 
 from nova.openstack.common import cfg
 from nova.openstack.common.gettextutils import _
@@ -275,9 +276,21 @@ class Publisher(object):
                                                  channel=channel,
                                                  routing_key=self.routing_key)
 
-    def send(self, msg):
-        """Send a message"""
-        self.producer.publish(msg)
+    def send(self, msg, serializer='json', compression_threshold=0):
+        """Send a message, compressed if it is larger than
+        compression_threshold bytes once encoded
+        """
+        if not compression_threshold:
+            self.producer.publish(msg, serializer=serializer)
+            return
+        content_type, content_encoding, body = kombu.serialization.encode(
+                msg, serializer=serializer)
+        compression = None
+        if len(body) > compression_threshold:
+            compression = 'zlib'
+        self.producer.publish(body, content_type=content_type,
+                              content_encoding=content_encoding,
+                              compression=compression)
 
 
 class DirectPublisher(Publisher):
@@ -333,6 +346,11 @@ class NotifyPublisher(TopicPublisher):
         self.durable = kwargs.pop('durable', conf.rabbit_durable_queues)
         super(NotifyPublisher, self).__init__(conf, channel, topic, **kwargs)
 
+    def send(self, msg, *args, **kwargs):
+        # NOTE: notifications are also read outside of nova, so they are
+        #       always sent as plain json
+        super(NotifyPublisher, self).send(msg)
+
     def reconnect(self, channel):
         super(NotifyPublisher, self).reconnect(channel)
 
@@ -614,7 +632,8 @@ class Connection(object):
 
         def _publish():
             publisher = cls(self.conf, self.channel, topic, **kwargs)
-            publisher.send(msg)
+            publisher.send(msg, self.conf.rpc_serializer,
+                           self.conf.rpc_compression_threshold)
 
         self.ensure(_error_callback, _publish)
 
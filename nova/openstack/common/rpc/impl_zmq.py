@@ -14,7 +14,6 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import json
 import pprint
 import string
 import sys
@@ -59,6 +58,15 @@ zmq_opts = [
 
     cfg.StrOpt('rpc_zmq_ipc_dir', default='/var/run/openstack',
                help='Directory for holding IPC sockets'),
+
+    cfg.BoolOpt('rpc_zmq_single_reply_subscriber', default=False,
+                help='Wait for the replies of all calls of a process on '
+                     'one subscriber socket, instead of opening one per '
+                     'call'),
+
+    cfg.IntOpt('rpc_zmq_socket_pool_size', default=0,
+               help='Maximum number of idle outgoing sockets kept open '
+                    'for reuse; 0 opens a new socket for every message'),
 ]
 
 
@@ -67,27 +75,26 @@ zmq_opts = [
 FLAGS = None
 ZMQ_CTX = None  # ZeroMQ Context, must be global.
 matchmaker = None  # memoized matchmaker object
+reply_reactor = None  # memoized ZmqReplyReactor, see _get_reply_reactor()
+client_pool = None  # memoized ZmqClientPool, see _get_client_pool()
 
 
 def _serialize(data):
     """
     Serialization wrapper
-    We prefer using JSON, but it cannot encode all types.
+    Encodes with the rpc_serializer format, JSON by default.
     Error if a developer passes us bad data.
     """
-    try:
-        return str(json.dumps(data, ensure_ascii=True))
-    except TypeError:
-        LOG.error(_("JSON serialization failed."))
-        raise
+    return rpc_common.serialize_msg(data, FLAGS.rpc_serializer,
+                                    FLAGS.rpc_compression_threshold)
 
 
 def _deserialize(data):
     """
     Deserialization wrapper
     """
-    LOG.debug(_("Deserializing: %s"), data)
-    return json.loads(data)
+    LOG.debug(_("Deserializing %d bytes"), len(data))
+    return rpc_common.deserialize_msg(data)
 
 
 class ZmqSocket(object):
@@ -204,6 +211,42 @@ class ZmqClient(object):
         self.outq.close()
 
 
+class ZmqClientPool(object):
+    """
+    A bounded pool of idle ZmqClients, keyed by address.
+
+    A client is checked out for the duration of one send, so green
+    threads never interleave the frames of their messages on a socket.
+    At most max_size idle clients are kept; the surplus is closed.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.idle = {}
+        self.idle_count = 0
+
+    def get(self, addr):
+        clients = self.idle.get(addr)
+        if clients:
+            self.idle_count -= 1
+            return clients.pop()
+        return ZmqClient(addr)
+
+    def put(self, addr, client):
+        if self.idle_count >= self.max_size:
+            client.close()
+            return
+        self.idle.setdefault(addr, []).append(client)
+        self.idle_count += 1
+
+    def close(self):
+        for clients in self.idle.values():
+            for client in clients:
+                client.close()
+        self.idle = {}
+        self.idle_count = 0
+
+
 class RpcContext(rpc_common.CommonRpcContext):
     """Context that supports replying to a rpc.call."""
     def __init__(self, **kwargs):
@@ -474,6 +517,58 @@ class ZmqReactor(ZmqBaseReactor):
                           proxy, ctx, request)
 
 
+class ZmqReplyReactor(ZmqBaseReactor):
+    """
+    A consumer class waiting for the replies
+    of all calls of this process on one
+    subscriber socket.
+
+    The msg_ids of our calls start with a
+    prefix unique to this process, which is
+    all we subscribe to; replies are routed
+    to their callers by msg_id.
+    """
+
+    def __init__(self, conf):
+        super(ZmqReplyReactor, self).__init__(conf)
+
+        self.prefix = uuid.uuid4().hex
+        self.waiters = {}
+
+        self.register(None,
+                      "ipc://%s/zmq_topic_zmq_replies" % conf.rpc_zmq_ipc_dir,
+                      zmq.SUB, subscribe=self.prefix, in_bind=False)
+        self.consume_in_thread()
+
+    def new_msg_id(self):
+        return "%s.%s" % (self.prefix, uuid.uuid4().hex)
+
+    def add_waiter(self, msg_id):
+        """Return the queue the reply for msg_id will be put in."""
+        queue = eventlet.queue.LightQueue()
+        self.waiters[msg_id] = queue
+        return queue
+
+    def del_waiter(self, msg_id):
+        self.waiters.pop(msg_id, None)
+
+    def consume(self, sock):
+        # NOTE: every call of the process waits on this thread, so a bad
+        #       reply must not end it
+        try:
+            data = sock.recv()
+            msg_id = data[0]
+        except Exception:
+            LOG.exception(_("Failed to receive a reply, dropping it"))
+            return
+
+        queue = self.waiters.pop(msg_id, None)
+        if queue is None:
+            LOG.warn(_("No call waiting for reply %s, dropping it"), msg_id)
+            return
+        queue.put(data)
+
+
 class Connection(rpc_common.Connection):
     """Manages connections and threads."""
 
@@ -517,29 +612,65 @@ class Connection(rpc_common.Connection):
         self.reactor.consume_in_thread()
 
 
+def _get_client_pool():
+    global client_pool
+    if not client_pool:
+        client_pool = ZmqClientPool(FLAGS.rpc_zmq_socket_pool_size)
+    return client_pool
+
+
+def _get_reply_reactor():
+    global reply_reactor
+    if not reply_reactor:
+        reply_reactor = ZmqReplyReactor(FLAGS)
+    return reply_reactor
+
+
 def _cast(addr, context, msg_id, topic, msg, timeout=None):
     timeout_cast = timeout or FLAGS.rpc_cast_timeout
     payload = [RpcContext.marshal(context), msg]
+    pool = None
+    if FLAGS.rpc_zmq_socket_pool_size > 0:
+        pool = _get_client_pool()
+    sent = False
 
     with Timeout(timeout_cast, exception=rpc_common.Timeout):
         try:
-            conn = ZmqClient(addr)
+            if pool:
+                conn = pool.get(addr)
+            else:
+                conn = ZmqClient(addr)
 
             # assumes cast can't return an exception
             conn.cast(msg_id, topic, payload)
+            sent = True
         except zmq.ZMQError:
             raise RPCException("Cast failed. ZMQ Socket Exception")
         finally:
             if 'conn' in vars():
-                conn.close()
+                # NOTE: only a socket whose send completed goes back to
+                # the pool; one interrupted by the timeout or an error
+                # may hold part of a message.
+                if pool and sent:
+                    pool.put(addr, conn)
+                else:
+                    conn.close()
 
 
 def _call(addr, context, msg_id, topic, msg, timeout=None):
     # timeout_response is how long we wait for a response
     timeout = timeout or FLAGS.rpc_response_timeout
 
+    if FLAGS.rpc_zmq_single_reply_subscriber:
+        reactor = _get_reply_reactor()
+    else:
+        reactor = None
+
     # The msg_id is used to track replies.
-    msg_id = str(uuid.uuid4().hex)
+    if reactor:
+        msg_id = reactor.new_msg_id()
+    else:
+        msg_id = str(uuid.uuid4().hex)
 
     # Replies always come into the reply service.
     # We require that FLAGS.host is a FQDN, IP, or resolvable hostname.
@@ -558,23 +689,28 @@ def _call(addr, context, msg_id, topic, msg, timeout=None):
         }
     }
 
-    LOG.debug(_("Creating queue socket for reply waiter"))
-
     # Messages arriving async.
-    # TODO(ewindisch): have reply consumer with dynamic subscription mgmt
     with Timeout(timeout, exception=rpc_common.Timeout):
         try:
-            msg_waiter = ZmqSocket(
-                "ipc://%s/zmq_topic_zmq_replies" % FLAGS.rpc_zmq_ipc_dir,
-                zmq.SUB, subscribe=msg_id, bind=False
-            )
+            if reactor:
+                LOG.debug(_("Registering reply waiter"))
+                msg_waiter = reactor.add_waiter(msg_id)
+            else:
+                LOG.debug(_("Creating queue socket for reply waiter"))
+                msg_waiter = ZmqSocket(
+                    "ipc://%s/zmq_topic_zmq_replies" % FLAGS.rpc_zmq_ipc_dir,
+                    zmq.SUB, subscribe=msg_id, bind=False
+                )
 
             LOG.debug(_("Sending cast"))
             _cast(addr, context, msg_id, topic, payload)
 
             LOG.debug(_("Cast sent; Waiting reply"))
             # Blocks until receives reply
-            msg = msg_waiter.recv()
+            if reactor:
+                msg = msg_waiter.get()
+            else:
+                msg = msg_waiter.recv()
             LOG.debug(_("Received message: %s"), msg)
             LOG.debug(_("Unpacking response"))
             responses = _deserialize(msg[-1])
@@ -582,7 +718,9 @@ def _call(addr, context, msg_id, topic, msg, timeout=None):
         except zmq.ZMQError:
             raise RPCException("ZMQ Socket Error")
         finally:
-            if 'msg_waiter' in vars():
+            if reactor:
+                reactor.del_waiter(msg_id)
+            elif 'msg_waiter' in vars():
                 msg_waiter.close()
 
     # It seems we don't need to do all of the following,
@@ -675,6 +813,14 @@ def cleanup():
     """Clean up resources in use by implementation."""
     global ZMQ_CTX
     global matchmaker
+    global reply_reactor
+    global client_pool
+    if reply_reactor:
+        reply_reactor.close()
+        reply_reactor = None
+    if client_pool:
+        client_pool.close()
+        client_pool = None
     matchmaker = None
     ZMQ_CTX.destroy()
     ZMQ_CTX = None
@@ -19,6 +19,7 @@ You can customize this scheduler by specifying your own Host Filters and
 Weighing Functions.
 """
 
+import heapq
 import operator
 
 from nova import exception
@@ -27,6 +28,7 @@ from nova.notifier import api as notifier
 from nova.openstack.common import importutils
 from nova.openstack.common import log as logging
 from nova.scheduler import driver
+from nova.scheduler import host_manager
 from nova.scheduler import least_cost
 from nova.scheduler import scheduler_options
 
@@ -175,10 +177,11 @@ class FilterScheduler(driver.Scheduler):
         self.populate_filter_properties(request_spec,
                                         filter_properties)
 
-        # Find our local list of acceptable hosts by repeatedly
-        # filtering and weighing our options. Each time we choose a
-        # host, we virtually consume resources on it so subsequent
-        # selections can adjust accordingly.
+        # Find our local list of acceptable hosts by filtering and
+        # weighing our options once, then place the instances one by one
+        # on the best host. Each time we choose a host, we virtually
+        # consume resources on it so subsequent selections can adjust
+        # accordingly.
 
         # unfiltered_hosts_dict is {host : ZoneManager.HostInfo()}
         unfiltered_hosts_dict = self.host_manager.get_all_host_states(
@@ -189,36 +192,87 @@ class FilterScheduler(driver.Scheduler):
         # are being scanned in a filter or weighing function.
         hosts = unfiltered_hosts_dict.itervalues()
 
-        num_instances = request_spec.get('num_instances', 1)
-        selected_hosts = []
-        for num in xrange(num_instances):
+        weighed_hosts = None
+        if FLAGS.scheduler_use_host_columns:
+            if host_manager.numpy is not None:
+                weighed_hosts = self._weigh_host_columns(hosts,
+                        cost_functions, filter_properties)
+            else:
+                LOG.warning(_("scheduler_use_host_columns is set but numpy "
+                              "is not available, filtering hosts one by "
+                              "one"))
+        if weighed_hosts is None:
             # Filter local hosts based on requirements ...
             hosts = self.host_manager.filter_hosts(hosts,
                     filter_properties)
-            if not hosts:
-                # Can't get any more locally.
-                break
-
             LOG.debug(_("Filtered %(hosts)s") % locals())
 
-            # weighted_host = WeightedHost() ... the best
-            # host for the job.
             # TODO(comstud): filter_properties will also be used for
             # weighing and I plan fold weighing into the host manager
             # in a future patch.  I'll address the naming of this
             # variable at that time.
-            weighted_host = least_cost.weighted_sum(cost_functions,
-                    hosts, filter_properties)
+            weighed_hosts = [(least_cost.weigh_host(cost_functions,
+                                                    host_state,
+                                                    filter_properties),
+                              host_state)
+                             for host_state in hosts]
+
+        num_instances = request_spec.get('num_instances', 1)
+        selected_hosts = self._place_instances(weighed_hosts, num_instances,
+                cost_functions, instance_properties, filter_properties)
+        selected_hosts.sort(key=operator.attrgetter('weight'))
+        return selected_hosts
+
+    def _weigh_host_columns(self, hosts, cost_functions, filter_properties):
+        """Filter and weigh all hosts at once through a HostStateColumns.
+
+        Returns a list of (weight, host_state) tuples for the hosts passing
+        the filters, in the order of hosts.
+        """
+        columns = host_manager.HostStateColumns(hosts)
+        mask = self.host_manager.filter_host_columns(columns,
+                filter_properties)
+        indexes = mask.nonzero()[0]
+        scores = least_cost.weigh_host_columns(cost_functions, columns,
+                indexes, filter_properties)
+        return [(float(score), columns.host_states[index])
+                for score, index in zip(scores, indexes)]
+
+    def _place_instances(self, weighed_hosts, num_instances, cost_functions,
+                         instance_properties, filter_properties):
+        """Place num_instances on the filtered and weighed hosts.
+
+        Every instance goes to the host with the lowest weight, the first
+        one winning ties like in least_cost.weighted_sum().  Consuming an
+        instance only changes the chosen host, so only that host is
+        filtered and weighed again before the next instance is placed.
+
+        :param weighed_hosts: list of (weight, host_state) tuples
+        :returns: a list of WeightedHosts, one per instance placed.
+        """
+        # NOTE: the position in weighed_hosts breaks ties between hosts
+        # of the same weight and keeps host states from being compared.
+        heap = [(weight, i, host_state)
+                for i, (weight, host_state) in enumerate(weighed_hosts)]
+        heapq.heapify(heap)
+
+        selected_hosts = []
+        while heap and len(selected_hosts) < num_instances:
+            weight, i, host_state = heapq.heappop(heap)
+            weighted_host = least_cost.WeightedHost(weight,
+                                                    host_state=host_state)
             LOG.debug(_("Weighted %(weighted_host)s") % locals())
             selected_hosts.append(weighted_host)
 
             # Now consume the resources so the filter/weights
             # will change for the next instance.
-            weighted_host.host_state.consume_from_instance(
-                    instance_properties)
-
-        selected_hosts.sort(key=operator.attrgetter('weight'))
-        return selected_hosts[:num_instances]
+            host_state.consume_from_instance(instance_properties)
+            if self.host_manager.filter_hosts([host_state],
+                                              filter_properties):
+                weight = least_cost.weigh_host(cost_functions, host_state,
+                                               filter_properties)
+                heapq.heappush(heap, (weight, i, host_state))
+        return selected_hosts
 
     def get_cost_functions(self, topic=None):
         """Returns a list of tuples containing weights and cost functions to
@@ -30,6 +30,14 @@ class BaseHostFilter(object):
     def host_passes(self, host_state, filter_properties):
         raise NotImplemented()
 
+    def hosts_pass(self, host_columns, filter_properties):
+        """Filter all hosts of a HostStateColumns at once.
+
+        Return a boolean array indexed like host_columns, or None if the
+        filter can only be evaluated per host with host_passes().
+        """
+        return None
+
     def _full_name(self):
         """module.classname of the filter."""
         return "%s.%s" % (self.__module__, self.__class__.__name__)
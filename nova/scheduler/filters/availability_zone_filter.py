@@ -28,3 +28,15 @@ class AvailabilityZoneFilter(filters.BaseHostFilter):
         if availability_zone:
             return availability_zone == host_state.service['availability_zone']
         return True
+
+    def hosts_pass(self, host_columns, filter_properties):
+        spec = filter_properties.get('request_spec', {})
+        props = spec.get('instance_properties', {})
+        availability_zone = props.get('availability_zone')
+
+        if availability_zone:
+            zones = host_columns.column('availability_zone',
+                    lambda host_state:
+                        host_state.service['availability_zone'])
+            return zones == availability_zone
+        return host_columns.all_hosts()
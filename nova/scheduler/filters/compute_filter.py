@@ -58,3 +58,18 @@ class ComputeFilter(filters.BaseHostFilter):
                     "requirements"), locals())
             return False
         return True
+
+    def hosts_pass(self, host_columns, filter_properties):
+        instance_type = filter_properties.get('instance_type')
+        if not instance_type:
+            return host_columns.all_hosts()
+
+        passes = host_columns.column('compute_enabled',
+                lambda host_state: bool(
+                    utils.service_is_up(host_state.service) and
+                    not host_state.service['disabled'] and
+                    host_state.capabilities.get('enabled', True)),
+                dtype=bool).copy()
+        for key, value in instance_type.get('extra_specs', {}).iteritems():
+            passes &= host_columns.capability_equals(key, value)
+        return passes | ~host_columns.is_compute
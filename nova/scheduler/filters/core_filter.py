@@ -48,3 +48,17 @@ class CoreFilter(filters.BaseHostFilter):
         instance_vcpus = instance_type['vcpus']
         vcpus_total = host_state.vcpus_total * FLAGS.cpu_allocation_ratio
         return (vcpus_total - host_state.vcpus_used) >= instance_vcpus
+
+    def hosts_pass(self, host_columns, filter_properties):
+        instance_type = filter_properties.get('instance_type')
+        passes = host_columns.all_hosts()
+        if not instance_type:
+            return passes
+
+        # Non-compute hosts and hosts with no VCPUs set always pass
+        checked = host_columns.is_compute & (host_columns.vcpus_total != 0)
+        vcpus_total = host_columns.vcpus_total * FLAGS.cpu_allocation_ratio
+        enough = (vcpus_total - host_columns.vcpus_used >=
+                  instance_type['vcpus'])
+        passes[checked] = enough[checked]
+        return passes
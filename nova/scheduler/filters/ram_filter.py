@@ -41,3 +41,11 @@ class RamFilter(filters.BaseHostFilter):
         used_ram_mb = total_usable_ram_mb - free_ram_mb
         return (total_usable_ram_mb * FLAGS.ram_allocation_ratio -
                 used_ram_mb >= requested_ram)
+
+    def hosts_pass(self, host_columns, filter_properties):
+        instance_type = filter_properties.get('instance_type')
+        requested_ram = instance_type['memory_mb']
+        total_usable_ram_mb = host_columns.total_usable_ram_mb
+        used_ram_mb = total_usable_ram_mb - host_columns.free_ram_mb
+        return (total_usable_ram_mb * FLAGS.ram_allocation_ratio -
+                used_ram_mb >= requested_ram)
@@ -20,6 +20,11 @@ Manage hosts in the current zone.
 import datetime
 import UserDict
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from nova import db
 from nova import exception
 from nova import flags
@@ -27,6 +32,7 @@ from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
 from nova.scheduler import filters
+from nova import utils
 
 
 host_manager_opts = [
@@ -50,6 +56,18 @@ host_manager_opts = [
                   ],
                 help='Which filter class names to use for filtering hosts '
                       'when not specified in the request.'),
+    cfg.IntOpt('scheduler_host_state_reconcile_interval',
+               default=300,
+               help='Interval in seconds after which the cached host states '
+                    'are rebuilt from the database for all hosts.  Between '
+                    'rebuilds, only hosts that reported new capabilities are '
+                    'refreshed.  Set to 0 to rebuild on every request.'),
+    cfg.BoolOpt('scheduler_use_host_columns',
+                default=False,
+                help='Filter and weigh all hosts at once using numpy arrays '
+                     'of their resources.  Filters and cost functions that '
+                     'do not support it are still run per host.  Requires '
+                     'numpy.'),
     ]
 
 FLAGS = flags.FLAGS
@@ -115,6 +133,9 @@ class HostState(object):
         self.vcpus_total = 0
         self.vcpus_used = 0
 
+        # When the resources were last read from the database.
+        self.updated = timeutils.utcnow()
+
     def update_from_compute_node(self, compute):
         """Update information about a host from its compute_node info."""
         all_disk_mb = compute['local_gb'] * 1024
@@ -165,11 +186,77 @@ class HostState(object):
         LOG.debug(_('Host filter passes for %(host)s'), {'host': self.host})
         return True
 
+    def staleness(self):
+        """Return the number of seconds since the state was read from the
+        database."""
+        return utils.total_seconds(timeutils.utcnow() - self.updated)
+
     def __repr__(self):
         return ("host '%s': free_ram_mb:%s free_disk_mb:%s" %
                 (self.host, self.free_ram_mb, self.free_disk_mb))
 
 
+class HostStateColumns(object):
+    """Columnar view of a list of HostStates.
+
+    The resources looked at by the core filters and cost functions are
+    kept in numpy arrays, indexed like host_states, so that they can be
+    evaluated for all hosts at once.  Requires numpy.
+    """
+
+    def __init__(self, host_states):
+        self.host_states = list(host_states)
+        self.hosts = [host_state.host for host_state in self.host_states]
+        self.free_ram_mb = self._resource_column('free_ram_mb')
+        self.total_usable_ram_mb = self._resource_column(
+                'total_usable_ram_mb')
+        self.free_disk_mb = self._resource_column('free_disk_mb')
+        self.vcpus_total = self._resource_column('vcpus_total')
+        self.vcpus_used = self._resource_column('vcpus_used')
+        self.is_compute = numpy.array([host_state.topic == 'compute'
+                                       for host_state in self.host_states],
+                                      dtype=bool)
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.host_states)
+
+    def _resource_column(self, name):
+        return numpy.array([getattr(host_state, name, 0)
+                            for host_state in self.host_states],
+                           dtype=float)
+
+    def all_hosts(self):
+        """Return a mask selecting every host."""
+        return numpy.ones(len(self), dtype=bool)
+
+    def column(self, name, value_fn, dtype=object):
+        """Return an array of value_fn(host_state) for every host.
+
+        The array is computed once and cached under name, so value_fn
+        must only look at things that don't change when resources are
+        consumed, such as the service or capabilities.
+        """
+        column = self._columns.get(name)
+        if column is None:
+            column = numpy.empty(len(self), dtype=dtype)
+            for i, host_state in enumerate(self.host_states):
+                column[i] = value_fn(host_state)
+            self._columns[name] = column
+        return column
+
+    def capability(self, key):
+        """Return an array of the capability key for every host."""
+        return self.column('capability:%s' % key,
+                           lambda host_state: host_state.capabilities.get(key))
+
+    def capability_equals(self, key, value):
+        """Return a mask of the hosts whose capability key is value."""
+        return numpy.array([capability == value
+                            for capability in self.capability(key)],
+                           dtype=bool)
+
+
 class HostManager(object):
     """Base HostManager class."""
 
@@ -178,14 +265,18 @@ class HostManager(object):
 
     def __init__(self):
         self.service_states = {}  # { <host> : { <service> : { cap k : v }}}
+        self.host_state_map = {}  # { <host> : HostState }
+        self.last_reconcile = None
+        # Hosts that reported capabilities since their state was read
+        self.changed_hosts = set()
         self.filter_classes = filters.get_filter_classes(
                 FLAGS.scheduler_available_filters)
 
-    def _choose_host_filters(self, filters):
+    def _choose_host_filter_objs(self, filters):
         """Since the caller may specify which filters to use we need
         to have an authoritative list of what is permissible. This
         function checks the filter names against a predefined set
-        of acceptable filters.
+        of acceptable filters and returns instances of them.
         """
         if filters is None:
             filters = FLAGS.scheduler_default_filters
@@ -199,11 +290,8 @@ class HostManager(object):
                 if cls.__name__ == filter_name:
                     found_class = True
                     filter_instance = cls()
-                    # Get the filter function
-                    filter_func = getattr(filter_instance,
-                            'host_passes', None)
-                    if filter_func:
-                        good_filters.append(filter_func)
+                    if hasattr(filter_instance, 'host_passes'):
+                        good_filters.append(filter_instance)
                     break
             if not found_class:
                 bad_filters.append(filter_name)
@@ -212,6 +300,11 @@ class HostManager(object):
             raise exception.SchedulerHostFilterNotFound(filter_name=msg)
         return good_filters
 
+    def _choose_host_filters(self, filters):
+        """Return the filter functions of the filters to use."""
+        return [filter_obj.host_passes
+                for filter_obj in self._choose_host_filter_objs(filters)]
+
     def filter_hosts(self, hosts, filter_properties, filters=None):
         """Filter hosts and return only ones passing all filters"""
         filtered_hosts = []
@@ -221,6 +314,43 @@ class HostManager(object):
                 filtered_hosts.append(host)
         return filtered_hosts
 
+    def filter_host_columns(self, columns, filter_properties, filters=None,
+                            mask=None):
+        """Filter the hosts of a HostStateColumns.
+
+        Returns a boolean array of the hosts passing all filters, out of
+        those selected by mask.  Filters that can't be evaluated for all
+        hosts at once are run per host, for the remaining hosts only.
+        """
+        if mask is None:
+            mask = columns.all_hosts()
+        else:
+            mask = mask.copy()
+
+        ignore_hosts = filter_properties.get('ignore_hosts', [])
+        if ignore_hosts:
+            mask &= numpy.array([host not in ignore_hosts
+                                 for host in columns.hosts], dtype=bool)
+
+        force_hosts = filter_properties.get('force_hosts', [])
+        if force_hosts:
+            return mask & numpy.array([host in force_hosts
+                                       for host in columns.hosts], dtype=bool)
+
+        for filter_obj in self._choose_host_filter_objs(filters):
+            passes = filter_obj.hosts_pass(columns, filter_properties)
+            if passes is not None:
+                mask &= passes
+                continue
+            for i in numpy.flatnonzero(mask):
+                if not filter_obj.host_passes(columns.host_states[i],
+                                              filter_properties):
+                    mask[i] = False
+
+        LOG.debug(_('%(passed)d of %(count)d hosts passed filters'),
+                  {'passed': mask.sum(), 'count': len(columns)})
+        return mask
+
     def get_host_list(self):
         """Returns a list of dicts for each host that the Zone Manager
         knows about. Each dict contains the host_name and the service
@@ -279,6 +409,8 @@ class HostManager(object):
         capab_copy["timestamp"] = timeutils.utcnow()  # Reported time
         service_caps[service_name] = capab_copy
         self.service_states[host] = service_caps
+        if service_name == 'compute':
+            self.changed_hosts.add(host)
 
     def host_service_caps_stale(self, host, service):
         """Check if host service capabilites are not recent enough."""
@@ -298,39 +430,28 @@ class HostManager(object):
                 if len(service_caps) == 0:  # Delete host if no services
                     del self.service_states[host]
 
-    def get_all_host_states(self, context, topic):
-        """Returns a dict of all the hosts the HostManager
-        knows about. Also, each of the consumable resources in HostState
-        are pre-populated and adjusted based on data in the db.
-
-        For example:
-        {'192.168.1.100': HostState(), ...}
-
-        Note: this can be very slow with a lot of instances.
-        InstanceType table isn't required since a copy is stored
-        with the instance (in case the InstanceType changed since the
-        instance was created)."""
-
-        if topic != 'compute':
-            raise NotImplementedError(_(
-                "host_manager only implemented for 'compute'"))
-
+    def _create_host_state(self, compute, topic):
+        service = compute['service']
+        host = service['host']
+        capabilities = self.service_states.get(host, None)
+        host_state = self.host_state_cls(host, topic,
+                capabilities=capabilities,
+                service=dict(service.iteritems()))
+        host_state.update_from_compute_node(compute)
+        return host_state
+
+    def _reconcile_host_states(self, context, topic):
+        """Rebuild the state of every host from the database."""
         host_state_map = {}
 
         # Make a compute node dict with the bare essential metrics.
         compute_nodes = db.compute_node_get_all(context)
         for compute in compute_nodes:
-            service = compute['service']
-            if not service:
+            if not compute['service']:
                 LOG.warn(_("No service for compute ID %s") % compute['id'])
                 continue
-            host = service['host']
-            capabilities = self.service_states.get(host, None)
-            host_state = self.host_state_cls(host, topic,
-                    capabilities=capabilities,
-                    service=dict(service.iteritems()))
-            host_state.update_from_compute_node(compute)
-            host_state_map[host] = host_state
+            host_state = self._create_host_state(compute, topic)
+            host_state_map[host_state.host] = host_state
 
         # "Consume" resources from the host the instance resides on.
         instances = db.instance_get_all(context,
@@ -343,4 +464,74 @@ class HostManager(object):
             if not host_state:
                 continue
             host_state.consume_from_instance(instance)
-        return host_state_map
+
+        self.host_state_map = host_state_map
+        self.last_reconcile = timeutils.utcnow()
+        self.changed_hosts.clear()
+
+    def _refresh_host_state(self, context, topic, host):
+        """Rebuild the state of a single host from the database."""
+        try:
+            services = db.service_get_all_compute_by_host(context, host)
+        except exception.ComputeHostNotFound:
+            services = []
+
+        compute = None
+        for service in services:
+            if service['compute_node']:
+                compute = service['compute_node'][0]
+                break
+        if compute is None:
+            self.host_state_map.pop(host, None)
+            return
+
+        host_state = self._create_host_state(compute, topic)
+        for instance in db.instance_get_all_by_host(context, host):
+            host_state.consume_from_instance(instance)
+        self.host_state_map[host] = host_state
+
+    def get_host_state_staleness(self):
+        """Returns a dict of the number of seconds since the state of
+        each host was read from the database."""
+        return dict((host, host_state.staleness())
+                    for host, host_state in self.host_state_map.iteritems())
+
+    def get_all_host_states(self, context, topic):
+        """Returns a dict of all the hosts the HostManager
+        knows about. Also, each of the consumable resources in HostState
+        are pre-populated and adjusted based on data in the db.
+
+        For example:
+        {'192.168.1.100': HostState(), ...}
+
+        The host states are kept between calls, so resources consumed by
+        scheduling decisions remain accounted for.  Hosts that reported
+        new capabilities since the last call are re-read from the db, and
+        every scheduler_host_state_reconcile_interval seconds all hosts
+        are rebuilt from the compute nodes and instances in the db.
+
+        Note: a full rebuild can be very slow with a lot of instances.
+        InstanceType table isn't required since a copy is stored
+        with the instance (in case the InstanceType changed since the
+        instance was created)."""
+
+        if topic != 'compute':
+            raise NotImplementedError(_(
+                "host_manager only implemented for 'compute'"))
+
+        interval = FLAGS.scheduler_host_state_reconcile_interval
+        if (self.last_reconcile is None or interval <= 0 or
+            timeutils.is_older_than(self.last_reconcile, interval)):
+            self._reconcile_host_states(context, topic)
+        else:
+            while self.changed_hosts:
+                host = self.changed_hosts.pop()
+                self._refresh_host_state(context, topic, host)
+
+        staleness = self.get_host_state_staleness()
+        if staleness:
+            LOG.debug(_("Host states are at most %(max)d seconds stale "
+                        "(%(count)d hosts)"),
+                      {'max': max(staleness.values()),
+                       'count': len(staleness)})
+        return self.host_state_map
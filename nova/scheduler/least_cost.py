@@ -22,6 +22,11 @@ The cost-function and weights are tabulated, and the host with the least cost
 is then selected for provisioning.
 """
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from nova import flags
 from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
@@ -78,12 +83,32 @@ def noop_cost_fn(host_state, weighing_properties):
     return 1
 
 
+def _noop_cost_columns(host_columns, weighing_properties):
+    return host_columns.all_hosts().astype(float)
+
+
+noop_cost_fn.columns = _noop_cost_columns
+
+
 def compute_fill_first_cost_fn(host_state, weighing_properties):
     """More free ram = higher weight. So servers will less free
     ram will be preferred."""
     return host_state.free_ram_mb
 
 
+def _compute_fill_first_cost_columns(host_columns, weighing_properties):
+    return host_columns.free_ram_mb
+
+
+compute_fill_first_cost_fn.columns = _compute_fill_first_cost_columns
+
+
+def weigh_host(weighted_fns, host_state, weighing_properties):
+    """Return the weighted sum of the cost functions for a single host."""
+    return sum(weight * fn(host_state, weighing_properties)
+               for weight, fn in weighted_fns)
+
+
 def weighted_sum(weighted_fns, host_states, weighing_properties):
     """Use the weighted-sum method to compute a score for an array of objects.
 
@@ -104,9 +129,29 @@ def weighted_sum(weighted_fns, host_states, weighing_properties):
 
     min_score, best_host = None, None
     for host_state in host_states:
-        score = sum(weight * fn(host_state, weighing_properties)
-                    for weight, fn in weighted_fns)
+        score = weigh_host(weighted_fns, host_state, weighing_properties)
         if min_score is None or score < min_score:
             min_score, best_host = score, host_state
 
     return WeightedHost(min_score, host_state=best_host)
+
+
+def weigh_host_columns(weighted_fns, host_columns, indexes,
+                       weighing_properties):
+    """Return an array of the weighted sums of the cost functions for the
+    hosts of a HostStateColumns at the given indexes.
+
+    Cost functions with a ``columns`` attribute are evaluated for all
+    hosts at once, others are called for every host.
+    """
+    scores = numpy.zeros(len(indexes))
+    for weight, fn in weighted_fns:
+        columns_fn = getattr(fn, 'columns', None)
+        if columns_fn is not None:
+            values = columns_fn(host_columns, weighing_properties)[indexes]
+        else:
+            values = numpy.array([fn(host_columns.host_states[i],
+                                     weighing_properties)
+                                  for i in indexes], dtype=float)
+        scores += weight * values
+    return scores
@@ -32,6 +32,7 @@ import nose.plugins.skip
 import stubout
 
 from nova import flags
+from nova.image import glance
 from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
@@ -132,6 +133,8 @@ class TestCase(unittest.TestCase):
         #             to work properly.
         self.start = timeutils.utcnow()
         tests.reset_db()
+        glance._GLANCE_CLIENTS.clear()
+        glance._IMAGE_META_CACHE.clear()
 
         # emulate some of the mox stuff, we can't use the metaclass
         # because it screws with our generators
@@ -781,6 +781,80 @@ class CloudTestCase(test.TestCase):
         db.service_destroy(self.context, comp1['id'])
         db.service_destroy(self.context, comp2['id'])
 
+    def test_describe_instances_paginated(self):
+        """Makes sure describe_instances honours max_results/next_token."""
+        self._stub_instance_get_with_fixed_ips('get_all')
+
+        image_uuid = 'cedef40a-ed67-4d10-800e-17455edce175'
+        insts = []
+        for i in xrange(3):
+            insts.append(db.instance_create(self.context,
+                                            {'reservation_id': 'a',
+                                             'image_ref': image_uuid,
+                                             'instance_type_id': 1,
+                                             'vm_state': 'active'}))
+        ec2_ids = [ec2utils.id_to_ec2_inst_id(inst['uuid'])
+                   for inst in insts]
+
+        result = self.cloud.describe_instances(self.context, max_results=2)
+        instances = result['reservationSet'][0]['instancesSet']
+        self.assertEqual(ec2_ids[:2], [i['instanceId'] for i in instances])
+        self.assertEqual(result['nextToken'], ec2_ids[1])
+
+        result = self.cloud.describe_instances(self.context, max_results=2,
+                                               next_token=result['nextToken'])
+        instances = result['reservationSet'][0]['instancesSet']
+        self.assertEqual(ec2_ids[2:], [i['instanceId'] for i in instances])
+        self.assertFalse('nextToken' in result)
+
+        for inst in insts:
+            db.instance_destroy(self.context, inst['uuid'])
+
+    def test_describe_instances_looks_up_in_bulk(self):
+        """Makes sure describe_instances doesn't look up each instance."""
+        self._stub_instance_get_with_fixed_ips('get_all')
+
+        image_uuid = 'cedef40a-ed67-4d10-800e-17455edce175'
+        kernel_uuid = '76fa36fc-c930-4bf3-8c8a-ea2a2420deb6'
+        insts = []
+        for i in xrange(3):
+            insts.append(db.instance_create(self.context,
+                                            {'reservation_id': 'a',
+                                             'image_ref': image_uuid,
+                                             'kernel_id': kernel_uuid,
+                                             'instance_type_id': 1,
+                                             'host': 'host1',
+                                             'vm_state': 'active'}))
+        comp = db.service_create(self.context, {'host': 'host1',
+                                                'availability_zone': 'zone1',
+                                                'topic': "compute"})
+        ec2_ids = [ec2utils.id_to_ec2_inst_id(inst['uuid'])
+                   for inst in insts]
+        image_id = ec2utils.glance_id_to_ec2_id(self.context, image_uuid)
+        kernel_id = ec2utils.glance_id_to_ec2_id(self.context, kernel_uuid,
+                                                 'aki')
+
+        def fake_lookup(*args, **kwargs):
+            self.fail('Looked up a single instance')
+        for name in ('get_ec2_instance_id_by_uuid', 's3_image_get_by_uuid',
+                     'block_device_mapping_get_all_by_instance',
+                     'service_get_all_by_host'):
+            self.stubs.Set(db, name, fake_lookup)
+
+        result = self.cloud.describe_instances(self.context)
+        instances = result['reservationSet'][0]['instancesSet']
+        self.assertEqual(ec2_ids, [i['instanceId'] for i in instances])
+        for instance in instances:
+            self.assertEqual(instance['imageId'], image_id)
+            self.assertEqual(instance['kernelId'], kernel_id)
+            self.assertEqual(instance['placement']['availabilityZone'],
+                             'zone1')
+            self.assertEqual(instance['rootDeviceType'], 'instance-store')
+
+        for inst in insts:
+            db.instance_destroy(self.context, inst['uuid'])
+        db.service_destroy(self.context, comp['id'])
+
     def test_describe_instances_sorting(self):
         """Makes sure describe_instances works and is sorted as expected."""
         self.flags(use_ipv6=True)
@@ -159,6 +159,27 @@ class HostTestCase(test.TestCase):
         result = self.controller.reboot(self.req, "host_c1")
         self.assertEqual(result["power_action"], "reboot")
 
+    def test_host_prefetch_images(self):
+        prefetched = []
+
+        def fake_prefetch_images(context, host, image_ids):
+            prefetched.append((host, image_ids))
+        self.stubs.Set(self.controller.api, 'prefetch_images',
+                       fake_prefetch_images)
+        body = {'prefetch_images': {'image_ids': ['id1', 'id2']}}
+        result = self.controller.prefetch_images(self.req, 'host_c1',
+                                                 body=body)
+        self.assertEqual(result.status_int, 202)
+        self.assertEqual(prefetched, [('host_c1', ['id1', 'id2'])])
+
+    def test_host_prefetch_images_bad_body(self):
+        for body in ({}, {'prefetch_images': {}},
+                     {'prefetch_images': {'image_ids': 'id1'}},
+                     {'prefetch_images': {'image_ids': [1]}}):
+            self.assertRaises(webob.exc.HTTPBadRequest,
+                              self.controller.prefetch_images,
+                              self.req, 'host_c1', body=body)
+
     def test_bad_status_value(self):
         bad_body = {"status": "bad"}
         self.assertRaises(webob.exc.HTTPBadRequest, self.controller.update,
@@ -491,12 +491,23 @@ def fake_instance_get(**kwargs):
 
 
 def fake_instance_get_all_by_filters(num_servers=5, **kwargs):
-    def _return_servers(context, *args, **kwargs):
+    def _return_servers(context, *args, **pagination):
         servers_list = []
+        marker = pagination.get('marker')
+        limit = pagination.get('limit')
+        found_marker = marker is None
         for i in xrange(num_servers):
-            server = stub_instance(id=i + 1, uuid=get_fake_uuid(i),
-                    **kwargs)
+            uuid = get_fake_uuid(i)
+            server = stub_instance(id=i + 1, uuid=uuid, **kwargs)
+            if not found_marker:
+                found_marker = uuid == marker
+                continue
             servers_list.append(server)
+
+        if not found_marker:
+            raise exc.MarkerNotFound(marker=marker)
+        if limit is not None:
+            servers_list = servers_list[:limit]
         return servers_list
     return _return_servers
 
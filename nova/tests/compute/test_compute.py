@@ -1452,7 +1452,7 @@ class ComputeTestCase(BaseTestCase):
                   "args": {'instance_id': inst_ref['id'],
                            'block_migration': True,
                            'disk': None},
-                  "version": compute_rpcapi.ComputeAPI.RPC_API_VERSION
+                  "version": compute_rpcapi.ComputeAPI.BASE_RPC_API_VERSION
                  }, None).AndRaise(rpc.common.RemoteError('', '', ''))
 
         # mocks for rollback
@@ -1464,7 +1464,8 @@ class ComputeTestCase(BaseTestCase):
                 {"method": "remove_volume_connection",
                  "args": {'instance_id': inst_ref['id'],
                           'volume_id': volume_id},
-                 "version": compute_rpcapi.ComputeAPI.RPC_API_VERSION}, None)
+                 "version": compute_rpcapi.ComputeAPI.BASE_RPC_API_VERSION},
+                None)
         rpc.cast(c, topic, {"method": "rollback_live_migration_at_destination",
                             "args": {'instance_id': inst_ref['id']}})
 
@@ -1497,7 +1498,8 @@ class ComputeTestCase(BaseTestCase):
                  "args": {'instance_id': instance_id,
                           'block_migration': False,
                           'disk': None},
-                 "version": compute_rpcapi.ComputeAPI.RPC_API_VERSION}, None)
+                 "version": compute_rpcapi.ComputeAPI.BASE_RPC_API_VERSION},
+                None)
 
         # start test
         self.mox.ReplayAll()
@@ -1536,7 +1538,8 @@ class ComputeTestCase(BaseTestCase):
         rpc.call(c, rpc.queue_get_for(c, FLAGS.compute_topic, dest),
             {"method": "post_live_migration_at_destination",
              "args": {'instance_id': i_ref['id'], 'block_migration': False},
-             "version": compute_rpcapi.ComputeAPI.RPC_API_VERSION}, None)
+             "version": compute_rpcapi.ComputeAPI.BASE_RPC_API_VERSION},
+            None)
         self.mox.StubOutWithMock(self.compute.driver, 'unplug_vifs')
         self.compute.driver.unplug_vifs(i_ref, [])
         rpc.call(c, 'network', {'method': 'setup_networks_on_host',
@@ -1583,6 +1586,83 @@ class ComputeTestCase(BaseTestCase):
         self.assertEqual(len(instances), 1)
         self.assertEqual(task_states.STOPPING, instances[0]['task_state'])
 
+    def test_sync_power_states_rereads_changed_instances(self):
+        """Only instances with a new power state are read again"""
+        self.stubs.Set(compute_manager.ComputeManager,
+                '_report_driver_status', nop_report_driver_status)
+
+        ctxt = context.get_admin_context()
+        instance1 = self._create_fake_instance()
+        instance2 = self._create_fake_instance()
+        self.compute.run_instance(self.context, instance1['uuid'])
+        self.compute.run_instance(self.context, instance2['uuid'])
+        instance2 = db.instance_get_by_uuid(ctxt, instance2['uuid'])
+        self.compute.driver.test_remove_vm(instance2['name'])
+
+        def fake_get_info(instance):
+            self.fail('get_info() should not be called')
+
+        reread_uuids = []
+        orig_instance_get_all_by_filters = db.instance_get_all_by_filters
+
+        def fake_instance_get_all_by_filters(context, filters, *args,
+                                             **kwargs):
+            reread_uuids.extend(filters['uuid'])
+            return orig_instance_get_all_by_filters(context, filters,
+                                                    *args, **kwargs)
+
+        self.stubs.Set(self.compute.driver, 'get_info', fake_get_info)
+        self.stubs.Set(db, 'instance_get_all_by_filters',
+                       fake_instance_get_all_by_filters)
+        self.compute._sync_power_states(ctxt)
+
+        self.assertEqual(reread_uuids, [instance2['uuid']])
+        instance1 = db.instance_get_by_uuid(ctxt, instance1['uuid'])
+        self.assertEqual(instance1['task_state'], None)
+        instance2 = db.instance_get_by_uuid(ctxt, instance2['uuid'])
+        self.assertEqual(instance2['power_state'], power_state.NOSTATE)
+        self.assertEqual(instance2['task_state'], task_states.STOPPING)
+
+    def test_sync_power_states_rereads_soft_deleted_instances(self):
+        """Soft deleted instances get their new power state too"""
+        self.stubs.Set(compute_manager.ComputeManager,
+                '_report_driver_status', nop_report_driver_status)
+
+        ctxt = context.get_admin_context()
+        instance = self._create_fake_instance()
+        self.compute.run_instance(self.context, instance['uuid'])
+        db.instance_update(ctxt, instance['uuid'],
+                           {'vm_state': vm_states.SOFT_DELETED,
+                            'power_state': power_state.SHUTDOWN})
+
+        self.compute._sync_power_states(ctxt)
+
+        instance = db.instance_get_by_uuid(ctxt, instance['uuid'])
+        self.assertEqual(instance['power_state'], power_state.RUNNING)
+        self.assertEqual(instance['vm_state'], vm_states.SOFT_DELETED)
+
+    def test_sync_power_states_without_bulk_driver_call(self):
+        """Drivers without get_power_states() are asked per instance"""
+        self.stubs.Set(compute_manager.ComputeManager,
+                '_report_driver_status', nop_report_driver_status)
+
+        def fake_get_power_states():
+            raise NotImplementedError()
+
+        self.stubs.Set(self.compute.driver, 'get_power_states',
+                       fake_get_power_states)
+
+        instance = self._create_fake_instance()
+        self.compute.run_instance(self.context, instance['uuid'])
+
+        ctxt = context.get_admin_context()
+        instance = db.instance_get_by_uuid(ctxt, instance['uuid'])
+        self.compute.driver.test_remove_vm(instance['name'])
+        self.compute._sync_power_states(ctxt)
+
+        instance = db.instance_get_by_uuid(ctxt, instance['uuid'])
+        self.assertEqual(instance['task_state'], task_states.STOPPING)
+
     def test_add_instance_fault(self):
         exc_info = None
         instance_uuid = str(utils.gen_uuid())
@@ -1746,80 +1826,112 @@ class ComputeTestCase(BaseTestCase):
 
     def test_heal_instance_info_cache(self):
         # Update on every call for the test
-        self.flags(heal_instance_info_cache_interval=-1)
+        self.flags(heal_instance_info_cache_interval=-1,
+                   heal_instance_info_cache_batch_size=2)
         ctxt = context.get_admin_context()
 
         instance_map = {}
         instances = []
-        for x in xrange(5):
+        for x in xrange(7):
             uuid = 'fake-uuid-%s' % x
-            instance_map[uuid] = {'uuid': uuid, 'host': FLAGS.host}
+            instance_map[uuid] = {'uuid': uuid, 'host': FLAGS.host,
+                                  'deleted': False}
             instances.append(instance_map[uuid])
 
-        call_info = {'get_all_by_host': 0, 'get_by_uuid': 0,
-                'get_nw_info': 0, 'expected_instance': None}
+        call_info = {'get_all_by_host': 0, 'get_all_by_filters': 0,
+                'get_nw_info': 0, 'expected_instances': None}
 
         def fake_instance_get_all_by_host(context, host):
             call_info['get_all_by_host'] += 1
             return instances[:]
 
-        def fake_instance_get_by_uuid(context, instance_uuid):
-            if instance_uuid not in instance_map:
-                raise exception.InstanceNotFound
-            call_info['get_by_uuid'] += 1
-            return instance_map[instance_uuid]
+        def fake_instance_get_all_by_filters(context, filters, sort_key,
+                                             sort_dir):
+            call_info['get_all_by_filters'] += 1
+            return [instance_map[uuid] for uuid in filters['uuid']
+                    if uuid in instance_map]
 
         # NOTE(comstud): Override the stub in setUp()
-        def fake_get_instance_nw_info(context, instance):
+        def fake_get_instances_nw_info(context, instances):
             # Note that this exception gets caught in compute/manager
             # and is ignored.  However, the below increment of
             # 'get_nw_info' won't happen, and you'll get an assert
             # failure checking it below.
-            self.assertEqual(instance, call_info['expected_instance'])
+            self.assertEqual(instances, call_info['expected_instances'])
             call_info['get_nw_info'] += 1
 
         self.stubs.Set(db, 'instance_get_all_by_host',
                 fake_instance_get_all_by_host)
-        self.stubs.Set(db, 'instance_get_by_uuid',
-                fake_instance_get_by_uuid)
-        self.stubs.Set(self.compute.network_api, 'get_instance_nw_info',
-                fake_get_instance_nw_info)
+        self.stubs.Set(db, 'instance_get_all_by_filters',
+                fake_instance_get_all_by_filters)
+        self.stubs.Set(self.compute.network_api, 'get_instances_nw_info',
+                fake_get_instances_nw_info)
 
-        call_info['expected_instance'] = instances[0]
+        call_info['expected_instances'] = instances[0:2]
         self.compute._heal_instance_info_cache(ctxt)
         self.assertEqual(call_info['get_all_by_host'], 1)
-        self.assertEqual(call_info['get_by_uuid'], 0)
+        self.assertEqual(call_info['get_all_by_filters'], 0)
         self.assertEqual(call_info['get_nw_info'], 1)
 
-        call_info['expected_instance'] = instances[1]
+        call_info['expected_instances'] = instances[2:4]
         self.compute._heal_instance_info_cache(ctxt)
         self.assertEqual(call_info['get_all_by_host'], 1)
-        self.assertEqual(call_info['get_by_uuid'], 1)
+        self.assertEqual(call_info['get_all_by_filters'], 1)
         self.assertEqual(call_info['get_nw_info'], 2)
 
         # Make an instance switch hosts
-        instances[2]['host'] = 'not-me'
+        instances[4]['host'] = 'not-me'
         # Make an instance disappear
-        instance_map.pop(instances[3]['uuid'])
-        # '2' and '3' should be skipped..
-        call_info['expected_instance'] = instances[4]
+        instance_map.pop(instances[5]['uuid'])
+        # '4' and '5' should be skipped..
+        call_info['expected_instances'] = [instances[6]]
         self.compute._heal_instance_info_cache(ctxt)
         self.assertEqual(call_info['get_all_by_host'], 1)
-        # Incremented for '2' and '4'.. '3' caused a raise above.
-        self.assertEqual(call_info['get_by_uuid'], 3)
+        # One query for '4' and '5', another one for '6'
+        self.assertEqual(call_info['get_all_by_filters'], 3)
         self.assertEqual(call_info['get_nw_info'], 3)
         # Should be no more left.
         self.assertEqual(len(self.compute._instance_uuids_to_heal), 0)
 
-        # This should cause a DB query now so we get first instance
+        # This should cause a DB query now so we get first instances
         # back again
-        call_info['expected_instance'] = instances[0]
+        call_info['expected_instances'] = instances[0:2]
         self.compute._heal_instance_info_cache(ctxt)
         self.assertEqual(call_info['get_all_by_host'], 2)
-        # Stays the same, beacuse the instance came from the DB
-        self.assertEqual(call_info['get_by_uuid'], 3)
+        # Stays the same, beacuse the instances came from the DB
+        self.assertEqual(call_info['get_all_by_filters'], 3)
         self.assertEqual(call_info['get_nw_info'], 4)
 
+    def test_heal_instance_info_cache_of_soft_deleted_instances(self):
+        """Soft deleted instances are healed, deleted ones are skipped"""
+        self.flags(heal_instance_info_cache_interval=-1,
+                   heal_instance_info_cache_batch_size=1)
+        ctxt = context.get_admin_context()
+        instances = [self._create_fake_instance({'host': self.compute.host})
+                     for x in xrange(3)]
+
+        healed = []
+
+        def fake_get_instances_nw_info(context, instances):
+            healed.extend(instance['uuid'] for instance in instances)
+
+        self.stubs.Set(self.compute.network_api, 'get_instances_nw_info',
+                fake_get_instances_nw_info)
+
+        self.compute._heal_instance_info_cache(ctxt)
+        db.instance_update(ctxt, instances[1]['uuid'],
+                           {'vm_state': vm_states.SOFT_DELETED})
+        db.instance_destroy(ctxt, instances[2]['uuid'])
+        self.compute._heal_instance_info_cache(ctxt)
+        self.assertEqual(healed, [instances[0]['uuid'],
+                                  instances[1]['uuid']])
+
+        # The deleted instance is skipped and the DB is queried again
+        self.compute._heal_instance_info_cache(ctxt)
+        self.assertEqual(healed, [instances[0]['uuid'],
+                                  instances[1]['uuid'],
+                                  instances[0]['uuid']])
+
     def test_poll_unconfirmed_resizes(self):
         instances = [{'uuid': 'fake_uuid1', 'vm_state': vm_states.RESIZED,
                       'task_state': None},
@@ -3514,7 +3626,7 @@ class ComputeAPITestCase(BaseTestCase):
         rpc_msg1 = {'method': 'get_vnc_console',
                     'args': {'instance_uuid': fake_instance['uuid'],
                              'console_type': fake_console_type},
-                   'version': compute_rpcapi.ComputeAPI.RPC_API_VERSION}
+                   'version': compute_rpcapi.ComputeAPI.BASE_RPC_API_VERSION}
         rpc_msg2 = {'method': 'authorize_console',
                     'args': fake_connect_info,
                     'version': '1.0'}
@@ -3541,7 +3653,7 @@ class ComputeAPITestCase(BaseTestCase):
         rpc_msg = {'method': 'get_console_output',
                    'args': {'instance_uuid': fake_instance['uuid'],
                             'tail_length': fake_tail_length},
-                   'version': compute_rpcapi.ComputeAPI.RPC_API_VERSION}
+                   'version': compute_rpcapi.ComputeAPI.BASE_RPC_API_VERSION}
         rpc.call(self.context, 'compute.%s' % fake_instance['host'],
                 rpc_msg, None).AndReturn(fake_console_output)
 
@@ -4055,7 +4167,7 @@ class ComputeHostAPITestCase(BaseTestCase):
         self.assertEqual(call_info['msg'],
                 {'method': 'set_host_enabled',
                  'args': {'enabled': 'fake_enabled'},
-                 'version': compute_rpcapi.ComputeAPI.RPC_API_VERSION})
+                 'version': compute_rpcapi.ComputeAPI.BASE_RPC_API_VERSION})
 
     def test_host_power_action(self):
         ctxt = context.RequestContext('fake', 'fake')
@@ -4067,7 +4179,7 @@ class ComputeHostAPITestCase(BaseTestCase):
         self.assertEqual(call_info['msg'],
                 {'method': 'host_power_action',
                  'args': {'action': 'fake_action'},
-                 'version': compute_rpcapi.ComputeAPI.RPC_API_VERSION})
+                 'version': compute_rpcapi.ComputeAPI.BASE_RPC_API_VERSION})
 
     def test_set_host_maintenance(self):
         ctxt = context.RequestContext('fake', 'fake')
@@ -4079,7 +4191,7 @@ class ComputeHostAPITestCase(BaseTestCase):
         self.assertEqual(call_info['msg'],
                 {'method': 'host_maintenance_mode',
                  'args': {'host': 'fake_host', 'mode': 'fake_mode'},
-                 'version': compute_rpcapi.ComputeAPI.RPC_API_VERSION})
+                 'version': compute_rpcapi.ComputeAPI.BASE_RPC_API_VERSION})
 
 
 class KeypairAPITestCase(BaseTestCase):
@@ -51,6 +51,7 @@ class ComputeRpcAPITestCase(test.TestCase):
             rpcapi_class = compute_rpcapi.ComputeAPI
         rpcapi = rpcapi_class()
         expected_retval = 'foo' if method == 'call' else None
+        expected_version = kwargs.pop('version', rpcapi.default_version)
 
         expected_msg = rpcapi.make_msg(method, **kwargs)
         if 'host_param' in expected_msg['args']:
@@ -70,7 +71,7 @@ class ComputeRpcAPITestCase(test.TestCase):
                 expected_msg['args']['instance_name'] = instance['name']
             else:
                 expected_msg['args']['instance_uuid'] = instance['uuid']
-        expected_msg['version'] = rpcapi.RPC_API_VERSION
+        expected_msg['version'] = expected_version
 
         cast_and_call = ['confirm_resize', 'stop_instance']
         if rpc_method == 'call' and method in cast_and_call:
@@ -277,6 +278,10 @@ class ComputeRpcAPITestCase(test.TestCase):
         self._test_compute_api('set_admin_password', 'cast',
                 instance=self.fake_instance, new_pass='pw')
 
+    def test_prefetch_images(self):
+        self._test_compute_api('prefetch_images', 'cast',
+                image_ids=['id1', 'id2'], host='host', version='1.1')
+
     def test_set_host_enabled(self):
         self._test_compute_api('set_host_enabled', 'call',
                 enabled='enabled', host='host')
@@ -299,6 +299,22 @@ class TestGlanceImageService(test.TestCase):
             self.assertDictMatch(meta, expected)
             i = i + 1
 
+    def test_detail_more_pages_than_recursion_limit(self):
+        class OneImagePerPageClient(glance_stubs.StubGlanceClient):
+            def get_images_detailed(self, filters=None, marker=None,
+                                    limit=1):
+                parent = super(OneImagePerPageClient, self)
+                return parent.get_images_detailed(filters, marker, limit)
+
+        client = OneImagePerPageClient()
+        for i in xrange(1500):
+            client.add_image(self._make_fixture(id=i), None)
+        service = glance.GlanceImageService(client=client)
+
+        image_metas = service.detail(self.context)
+        self.assertEqual(len(image_metas), 1500)
+        self.assertEqual(image_metas[-1]['id'], '1499')
+
     def test_detail_invalid_marker(self):
         fixtures = []
         ids = []
@@ -439,6 +455,77 @@ class TestGlanceImageService(test.TestCase):
         ]
         self.assertEqual(image_metas, expected)
 
+    def _default_service_with_images(self, *images):
+        client = glance_stubs.StubGlanceClient()
+        for image in images:
+            client.add_image(self._make_fixture(**image), None)
+
+        calls = []
+        get_image_meta = client.get_image_meta
+
+        def fake_get_image_meta(image_id):
+            calls.append(image_id)
+            return get_image_meta(image_id)
+        client.get_image_meta = fake_get_image_meta
+        self.stubs.Set(glance, '_create_glance_client',
+                       lambda context, host, port: client)
+        return glance.GlanceImageService(), calls
+
+    def test_show_caches_active_images(self):
+        service, calls = self._default_service_with_images(
+                {'id': 'public', 'status': 'active', 'is_public': True},
+                {'id': 'private', 'status': 'active', 'is_public': False},
+                {'id': 'queued', 'status': 'queued', 'is_public': True})
+        other_context = context.RequestContext('other', 'other',
+                                               auth_token=True)
+
+        for image_id in ('public', 'private', 'queued'):
+            service.show(self.context, image_id)
+            service.show(self.context, image_id)
+        self.assertEqual(calls, ['public', 'private', 'queued', 'queued'])
+
+        service.show(other_context, 'public')
+        service.show(other_context, 'private')
+        self.assertEqual(calls[4:], ['private'])
+
+    def test_update_uncaches_image(self):
+        service, calls = self._default_service_with_images(
+                {'id': 'public', 'status': 'active', 'is_public': True})
+
+        service.show(self.context, 'public')
+        service.update(self.context, 'public', {'name': 'renamed'})
+        image_meta = service.show(self.context, 'public')
+        self.assertEqual(image_meta['name'], 'renamed')
+        self.assertEqual(calls, ['public', 'public'])
+
+        stats = glance.get_image_meta_cache_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['size'], 1)
+
+    def test_show_reports_cache_stats(self):
+        self.flags(glance_image_cache_stats_interval=60)
+        service, calls = self._default_service_with_images(
+                {'id': 'public', 'status': 'active', 'is_public': True})
+        reports = []
+
+        def fake_debug(msg, *args, **kwargs):
+            if args and 'hit_ratio' in args[0]:
+                reports.append(args[0])
+
+        self.stubs.Set(glance.LOG, 'debug', fake_debug)
+        self.stubs.Set(glance, '_image_meta_cache_reported_at', 0)
+        service.show(self.context, 'public')
+        service.show(self.context, 'public')
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0]['misses'], 1)
+
+        glance._image_meta_cache_reported_at = 0
+        service.show(self.context, 'public')
+        self.assertEqual(len(reports), 2)
+        self.assertEqual(reports[1]['hits'], 2)
+        self.assertEqual(reports[1]['hit_ratio'], 2.0 / 3)
+
     def test_show_makes_datetimes(self):
         fixture = self._make_datetime_fixture()
         image_id = self.service.create(self.context, fixture)['id']
@@ -19,7 +19,8 @@ import binascii
 import eventlet
 import mox
 import os
-import tempfile
+import StringIO
+import tarfile
 
 from nova import context
 import nova.db.api
@@ -162,7 +163,6 @@ class TestS3ImageService(test.TestCase):
         metadata = {'properties': {
                     'image_location': 'mybucket/my.img.manifest.xml'},
                     'name': 'mybucket/my.img'}
-        handle, tempf = tempfile.mkstemp(dir='/tmp')
 
         ignore = mox.IgnoreArg()
         mockobj = self.mox.CreateMockAnything()
@@ -174,15 +174,17 @@ class TestS3ImageService(test.TestCase):
         mockobj(ignore).AndReturn(mockobj)
         self.stubs.Set(mockobj, 'get_contents_as_string', mockobj)
         mockobj().AndReturn(file_manifest_xml)
-        self.stubs.Set(self.image_service, '_download_file', mockobj)
-        mockobj(ignore, ignore, ignore).AndReturn(tempf)
         self.stubs.Set(binascii, 'a2b_hex', mockobj)
         mockobj(ignore).AndReturn('foo')
         mockobj(ignore).AndReturn('foo')
+        self.stubs.Set(self.image_service, '_decrypt_image_key', mockobj)
+        mockobj(ignore, ignore, ignore).AndReturn(('key', 'iv'))
+        self.stubs.Set(self.image_service, '_download_parts', mockobj)
+        mockobj(ignore, ignore).AndReturn(iter(['part']))
         self.stubs.Set(self.image_service, '_decrypt_image', mockobj)
-        mockobj(ignore, ignore, ignore, ignore, ignore).AndReturn(mockobj)
-        self.stubs.Set(self.image_service, '_untarzip_image', mockobj)
-        mockobj(ignore, ignore).AndReturn(tempf)
+        mockobj(ignore, ignore, ignore).AndReturn(
+                (FakeDecrypter(self._make_bundle('image data')),
+                 eventlet.spawn(lambda: None)))
         self.mox.ReplayAll()
 
         img = self.image_service._s3_create(self.context, metadata)
@@ -198,10 +200,60 @@ class TestS3ImageService(test.TestCase):
         self.assertEqual(updated_image['properties']['image_state'],
                           'available')
 
+    @staticmethod
+    def _make_bundle(data):
+        bundle = StringIO.StringIO()
+        tar_file = tarfile.open(fileobj=bundle, mode='w|gz')
+        member = tarfile.TarInfo('my.img')
+        member.size = len(data)
+        tar_file.addfile(member, StringIO.StringIO(data))
+        tar_file.close()
+        return bundle.getvalue()
+
     def test_s3_malicious_tarballs(self):
-        self.assertRaises(exception.NovaException,
-            self.image_service._test_for_malicious_tarball,
-            "/unused", os.path.join(os.path.dirname(__file__), 'abs.tar.gz'))
-        self.assertRaises(exception.NovaException,
-            self.image_service._test_for_malicious_tarball,
-            "/unused", os.path.join(os.path.dirname(__file__), 'rel.tar.gz'))
+        for name in ('abs.tar.gz', 'rel.tar.gz'):
+            path = os.path.join(os.path.dirname(__file__), name)
+            tar_file = tarfile.open(path, mode='r|gz')
+            self.assertRaises(exception.NovaException,
+                              self.image_service._image_member, tar_file)
+            tar_file.close()
+
+    def test_s3_download_parts_in_order(self):
+        contents = dict(('part.%d' % i, 'data %d' % i) for i in xrange(10))
+
+        def fake_download_part(bucket, filename):
+            # Finish the later parts first.
+            eventlet.sleep(0.001 * (10 - int(filename.split('.')[1])))
+            return contents[filename]
+
+        self.flags(s3_image_download_concurrency=3)
+        self.stubs.Set(self.image_service, '_download_part',
+                       fake_download_part)
+        filenames = ['part.%d' % i for i in xrange(10)]
+        parts = list(self.image_service._download_parts(None, filenames))
+        self.assertEqual(parts, [contents[fn] for fn in filenames])
+
+    def test_s3_image_data_reader_reports_progress(self):
+        reported = []
+        image_data = s3.ImageDataReader(StringIO.StringIO('x' * 100), 100,
+                                        reported.append)
+        while image_data.read(25):
+            pass
+        self.assertEqual(reported, [20, 50, 70, 100])
+
+
+class FakeDecrypter(object):
+    """Stands in for the openssl process, already done decrypting."""
+
+    def __init__(self, data):
+        self.stdout = StringIO.StringIO(data)
+        self.stderr = StringIO.StringIO()
+
+    def poll(self):
+        return 0
+
+    def kill(self):
+        pass
+
+    def wait(self):
+        return 0
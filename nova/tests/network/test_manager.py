@@ -1468,6 +1468,41 @@ class AllocateTestCase(test.TestCase):
                                              host=self.network.host,
                                              project_id=project_id)
 
+    def test_get_instances_nw_info(self):
+        self.flags(auto_assign_floating_ip=True)
+        self.compute = self.start_service('compute')
+        self.network = self.start_service('network')
+
+        self.context = context.RequestContext('fake', 'fake', is_admin=True)
+        for address in ('10.10.10.10', '10.10.10.11'):
+            db.floating_ip_create(self.context, {'address': address,
+                                                 'pool': 'nova'})
+        for network in db.network_get_all(self.context):
+            db.network_update(self.context, network['id'],
+                              {'host': self.network.host})
+
+        instances = []
+        for x in xrange(2):
+            inst = db.instance_create(self.context,
+                                      {'host': self.compute.host,
+                                       'instance_type_id': 1})
+            args = dict(instance_id=inst['id'], instance_uuid=inst['uuid'],
+                        host=inst['host'], rxtx_factor=3,
+                        project_id=self.context.project_id)
+            self.network.allocate_for_instance(self.context, vpn=None,
+                                               **args)
+            instances.append(args)
+
+        nw_infos = self.network.get_instances_nw_info(self.context,
+                                                      instances)
+        self.assertEqual(len(nw_infos), 2)
+        for args in instances:
+            nw_info = self.network.get_instance_nw_info(self.context,
+                                                        **args)
+            self.assertEqual(nw_infos[args['instance_uuid']], nw_info)
+        for nw_info in nw_infos.values():
+            self.assertEqual(len(nw_info.floating_ips()), 1)
+
 
 class FloatingIPTestCase(test.TestCase):
     """Tests nova.network.manager.FloatingIP"""
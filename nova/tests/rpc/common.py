@@ -0,0 +1,155 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Unit Tests for remote procedure calls shared between all implementations
+"""
+
+from nova import context
+from nova import flags
+from nova.openstack.common import log as logging
+from nova.openstack.common.rpc import amqp as rpc_amqp
+from nova.openstack.common.rpc import common as rpc_common
+from nova.openstack.common.rpc import dispatcher as rpc_dispatcher
+from nova import test
+
+
+FLAGS = flags.FLAGS
+LOG = logging.getLogger(__name__)
+
+
+class BaseRpcTestCase(test.TestCase):
+    """Tests every rpc implementation sets in self.rpc before setUp()"""
+    def setUp(self):
+        super(BaseRpcTestCase, self).setUp()
+        self.topic = 'test'
+        self.context = context.get_admin_context()
+        self.conn = self._create_consumer(TestReceiver(), self.topic)
+
+    def tearDown(self):
+        self.conn.close()
+        super(BaseRpcTestCase, self).tearDown()
+
+    def _create_consumer(self, proxy, topic, fanout=False):
+        dispatcher = rpc_dispatcher.RpcDispatcher([proxy])
+        conn = self.rpc.create_connection(FLAGS, True)
+        conn.create_consumer(topic, dispatcher, fanout)
+        conn.consume_in_thread()
+        return conn
+
+    def test_call_succeed(self):
+        value = 42
+        result = self.rpc.call(FLAGS, self.context, self.topic,
+                               {"method": "echo", "args": {"value": value}})
+        self.assertEqual(value, result)
+
+    def test_multicall_succeed_three_times_yield(self):
+        value = 42
+        result = self.rpc.multicall(FLAGS, self.context, self.topic,
+                                    {"method": "echo_three_times_yield",
+                                     "args": {"value": value}})
+        self.assertEqual(list(result), [value, value + 1, value + 2])
+
+    def test_call_exception(self):
+        self.assertRaises(rpc_common.RemoteError,
+                          self.rpc.call, FLAGS, self.context, self.topic,
+                          {"method": "fail", "args": {"value": 42}})
+
+
+class BaseRpcAMQPTestCase(BaseRpcTestCase):
+    """Base test class for all AMQP-based RPC tests"""
+    def _get_call_waiters(self):
+        pool = rpc_amqp.get_connection_pool(FLAGS, self.rpc.Connection)
+        return pool.reply_proxy._call_waiters
+
+    def test_single_reply_queue_call_succeed(self):
+        self.flags(amqp_rpc_single_reply_queue=True)
+        value = 42
+        result = self.rpc.call(FLAGS, self.context, self.topic,
+                               {"method": "echo", "args": {"value": value}})
+        self.assertEqual(value, result)
+        self.assertEqual(self._get_call_waiters(), {})
+
+    def test_single_reply_queue_multicall_ends(self):
+        self.flags(amqp_rpc_single_reply_queue=True)
+        value = 42
+        result = self.rpc.multicall(FLAGS, self.context, self.topic,
+                                    {"method": "echo_three_times_yield",
+                                     "args": {"value": value}})
+        self.assertEqual(list(result), [value, value + 1, value + 2])
+        self.assertEqual(self._get_call_waiters(), {})
+
+    def test_single_reply_queue_call_timeout(self):
+        self.flags(amqp_rpc_single_reply_queue=True)
+        # Nothing consumes this topic, so the call never gets a reply
+        self.assertRaises(rpc_common.Timeout,
+                          self.rpc.call, FLAGS, self.context, 'no_consumer',
+                          {"method": "echo", "args": {"value": 42}},
+                          timeout=0.1)
+        self.assertEqual(self._get_call_waiters(), {})
+
+    def test_single_reply_queue_call_exception(self):
+        self.flags(amqp_rpc_single_reply_queue=True)
+        self.assertRaises(rpc_common.RemoteError,
+                          self.rpc.call, FLAGS, self.context, self.topic,
+                          {"method": "fail", "args": {"value": 42}})
+        self.assertEqual(self._get_call_waiters(), {})
+
+    def test_single_reply_queue_server_answers_old_callers(self):
+        self.flags(amqp_rpc_single_reply_queue=True)
+        self.assertEqual(self.rpc.call(FLAGS, self.context, self.topic,
+                                       {"method": "echo",
+                                        "args": {"value": 1}}), 1)
+
+        # Callers without the option send no _reply_q, and get their reply
+        # on the queue of the call instead of the reply proxy's
+        self.flags(amqp_rpc_single_reply_queue=False)
+        reply_qs = []
+        orig_msg_reply = rpc_amqp.msg_reply
+
+        def fake_msg_reply(conf, msg_id, reply_q, *args, **kwargs):
+            reply_qs.append(reply_q)
+            return orig_msg_reply(conf, msg_id, reply_q, *args, **kwargs)
+
+        self.stubs.Set(rpc_amqp, 'msg_reply', fake_msg_reply)
+        self.assertEqual(self.rpc.call(FLAGS, self.context, self.topic,
+                                       {"method": "echo",
+                                        "args": {"value": 2}}), 2)
+        self.assertEqual(reply_qs, [None, None])
+
+
+class TestReceiver(object):
+    """Simple Proxy class so the consumer has methods to call.
+
+    Uses static methods because we aren't actually storing any state.
+
+    """
+    @staticmethod
+    def echo(context, value):
+        """Simply returns whatever value is sent in."""
+        LOG.debug(_("Received %s"), value)
+        return value
+
+    @staticmethod
+    def echo_three_times_yield(context, value):
+        """Yields value, then value + 1 and value + 2."""
+        for i in xrange(3):
+            yield value + i
+
+    @staticmethod
+    def fail(context, value):
+        """Raises an exception with the value sent in."""
+        raise NotImplementedError(value)
@@ -0,0 +1,136 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Unit Tests for the batching of casts of the AMQP rpc implementations
+"""
+
+import eventlet
+
+from nova import context
+from nova import flags
+from nova.openstack.common.rpc import amqp as rpc_amqp
+from nova import test
+
+
+FLAGS = flags.FLAGS
+
+
+class FakeConnection(object):
+    """Records the messages published through it."""
+    sent = []
+
+    def __init__(self, conf):
+        pass
+
+    def topic_send(self, topic, msg):
+        self.sent.append(('topic_send', topic, msg))
+
+    def fanout_send(self, topic, msg):
+        self.sent.append(('fanout_send', topic, msg))
+
+    def reset(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class CastPipelineTestCase(test.TestCase):
+    def setUp(self):
+        super(CastPipelineTestCase, self).setUp()
+        self.flags(amqp_cast_batch_window_ms=60 * 1000,
+                   amqp_cast_batch_size=100)
+        self.context = context.get_admin_context()
+        self.pool = rpc_amqp.Pool(FLAGS, FakeConnection)
+        FakeConnection.sent = []
+
+    def tearDown(self):
+        self.pool.empty()
+        super(CastPipelineTestCase, self).tearDown()
+
+    def _cast(self, method, **args):
+        rpc_amqp.cast(FLAGS, self.context, 'compute.host',
+                      {'method': method, 'args': args}, self.pool)
+
+    def _sent_methods(self):
+        return [(send_method, topic, msg['method'], msg['args'])
+                for send_method, topic, msg in FakeConnection.sent]
+
+    def test_coalesces_identical_casts(self):
+        self._cast('refresh_security_group_rules', security_group_id=1)
+        self._cast('refresh_security_group_rules', security_group_id=1)
+        self._cast('refresh_security_group_rules', security_group_id=2)
+        self._cast('reboot_instance', instance_uuid='fake')
+        self._cast('reboot_instance', instance_uuid='fake')
+        rpc_amqp.fanout_cast(FLAGS, self.context, 'compute',
+                             {'method': 'refresh_security_group_rules',
+                              'args': {'security_group_id': 1}}, self.pool)
+        self.assertEqual(FakeConnection.sent, [])
+
+        self.pool.cast_pipeline.flush()
+        self.assertEqual(self._sent_methods(), [
+            ('topic_send', 'compute.host', 'refresh_security_group_rules',
+             {'security_group_id': 1}),
+            ('topic_send', 'compute.host', 'refresh_security_group_rules',
+             {'security_group_id': 2}),
+            ('topic_send', 'compute.host', 'reboot_instance',
+             {'instance_uuid': 'fake'}),
+            ('topic_send', 'compute.host', 'reboot_instance',
+             {'instance_uuid': 'fake'}),
+            ('fanout_send', 'compute', 'refresh_security_group_rules',
+             {'security_group_id': 1})])
+        self.assertEqual(rpc_amqp.get_cast_pipeline_stats(self.pool),
+                         {'casts': 6, 'coalesced': 1, 'flushes': 1,
+                          'published': 5, 'lost': 0})
+
+    def test_flushes_when_batch_is_full(self):
+        self.flags(amqp_cast_batch_size=2)
+        self._cast('reboot_instance', instance_uuid='fake1')
+        self.assertEqual(FakeConnection.sent, [])
+        self._cast('reboot_instance', instance_uuid='fake2')
+        self.assertEqual(len(FakeConnection.sent), 2)
+
+    def test_flushes_after_batch_window(self):
+        self.flags(amqp_cast_batch_window_ms=10)
+        self._cast('reboot_instance', instance_uuid='fake')
+        self.assertEqual(FakeConnection.sent, [])
+        eventlet.sleep(0.1)
+        self.assertEqual(len(FakeConnection.sent), 1)
+
+    def test_empty_pool_flushes(self):
+        self._cast('reboot_instance', instance_uuid='fake')
+        self.pool.empty()
+        self.assertEqual(len(FakeConnection.sent), 1)
+
+    def test_counts_casts_lost_without_connection(self):
+        def fake_create():
+            raise IOError('broker is down')
+
+        self.stubs.Set(self.pool, 'create', fake_create)
+        self._cast('reboot_instance', instance_uuid='fake1')
+        self._cast('reboot_instance', instance_uuid='fake2')
+        self.pool.cast_pipeline.flush()
+        self.assertEqual(FakeConnection.sent, [])
+        stats = rpc_amqp.get_cast_pipeline_stats(self.pool)
+        self.assertEqual(stats['published'], 0)
+        self.assertEqual(stats['lost'], 2)
+
+    def test_casts_are_not_batched_by_default(self):
+        self.flags(amqp_cast_batch_window_ms=0)
+        self._cast('reboot_instance', instance_uuid='fake')
+        self.assertEqual(len(FakeConnection.sent), 1)
+        self.assertEqual(rpc_amqp.get_cast_pipeline_stats(self.pool), None)
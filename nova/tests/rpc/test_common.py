@@ -0,0 +1,102 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Unit Tests for the rpc code shared between all implementations, which need
+no message broker
+"""
+
+import logging
+
+from nova.openstack.common import jsonutils
+from nova.openstack.common.rpc import common as rpc_common
+from nova import test
+
+
+class RpcSerializationTestCase(test.TestCase):
+    def setUp(self):
+        super(RpcSerializationTestCase, self).setUp()
+        self.data = {'method': 'run_instance',
+                     'args': {'request_spec': {'num_instances': 1,
+                                               'image': 'x' * 2048}}}
+        self.serializers = ['json']
+        if rpc_common.msgpack is not None:
+            self.serializers.append('msgpack')
+
+    def test_json_is_plain(self):
+        encoded = rpc_common.serialize_msg(self.data)
+        self.assertEqual(encoded, jsonutils.dumps(self.data))
+        self.assertEqual(rpc_common.deserialize_msg(encoded), self.data)
+
+    def test_round_trip(self):
+        for serializer in self.serializers:
+            encoded = rpc_common.serialize_msg(self.data, serializer)
+            self.assertEqual(rpc_common.deserialize_msg(encoded), self.data)
+
+    def test_round_trip_compressed(self):
+        for serializer in self.serializers:
+            uncompressed = rpc_common.serialize_msg(self.data, serializer)
+            encoded = rpc_common.serialize_msg(self.data, serializer, 1024)
+            self.assertEqual(encoded[2], 'z')
+            self.assertTrue(len(encoded) < len(uncompressed))
+            self.assertEqual(rpc_common.deserialize_msg(encoded), self.data)
+
+    def test_below_compression_threshold(self):
+        encoded = rpc_common.serialize_msg(self.data, 'json', 1024 * 1024)
+        self.assertEqual(encoded, jsonutils.dumps(self.data))
+
+    def test_unknown_serializer(self):
+        self.assertRaises(rpc_common.RPCException,
+                          rpc_common.serialize_msg, self.data, 'pickle')
+
+    def test_unknown_codec(self):
+        self.assertRaises(rpc_common.RPCException,
+                          rpc_common.deserialize_msg, '\x00p-data')
+
+    def test_unknown_compression(self):
+        self.assertRaises(rpc_common.RPCException,
+                          rpc_common.deserialize_msg, '\x00jb{}')
+
+
+class SafeLogTestCase(test.TestCase):
+    def setUp(self):
+        super(SafeLogTestCase, self).setUp()
+        self.data = {'method': 'run_instance',
+                     'args': {'admin_password': 'secret'},
+                     '_context_auth_token': 'token'}
+
+    def test_sanitizes(self):
+        logged = []
+
+        def log_func(msg, msg_data):
+            logged.append(msg_data)
+
+        rpc_common._safe_log(log_func, 'received %s', self.data)
+        self.assertEqual(logged, [{'method': 'run_instance',
+                                   'args': {'admin_password': '<SANITIZED>'},
+                                   '_context_auth_token': '<SANITIZED>'}])
+        self.assertEqual(self.data['args']['admin_password'], 'secret')
+
+    def test_disabled_level_is_not_copied(self):
+        logger = logging.getLogger('nova.tests.rpc.test_common.safe_log')
+        logger.setLevel(logging.INFO)
+
+        def fake_deepcopy(value):
+            self.fail('the message should not be copied')
+
+        self.stubs.Set(rpc_common.copy, 'deepcopy', fake_deepcopy)
+        self.assertEqual(rpc_common._safe_log(logger.debug, 'received %s',
+                                              self.data), None)
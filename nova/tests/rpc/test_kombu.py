@@ -0,0 +1,43 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Unit Tests for remote procedure calls using kombu
+"""
+
+import nose
+
+from nova.tests.rpc import common
+
+try:
+    import kombu
+    from nova.openstack.common.rpc import impl_kombu
+except ImportError:
+    kombu = None
+    impl_kombu = None
+
+
+class RpcKombuTestCase(common.BaseRpcAMQPTestCase):
+    """Runs the AMQP rpc tests over the in-memory transport of kombu"""
+    def setUp(self):
+        if kombu is None:
+            raise nose.SkipTest('kombu is not installed')
+        self.rpc = impl_kombu
+        super(RpcKombuTestCase, self).setUp()
+
+    def tearDown(self):
+        super(RpcKombuTestCase, self).tearDown()
+        impl_kombu.cleanup()
@@ -23,6 +23,7 @@ from nova import exception
 from nova.scheduler import filter_scheduler
 from nova.scheduler import host_manager
 from nova.scheduler import least_cost
+from nova import test
 from nova.tests.scheduler import fakes
 from nova.tests.scheduler import test_scheduler
 
@@ -134,11 +135,9 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
 
         self.next_weight = 1.0
 
-        def _fake_weighted_sum(functions, hosts, options):
+        def _fake_weigh_host(functions, host_state, options):
             self.next_weight += 2.0
-            host_state = hosts[0]
-            return least_cost.WeightedHost(self.next_weight,
-                    host_state=host_state)
+            return self.next_weight
 
         sched = fakes.FakeFilterScheduler()
         fake_context = context.RequestContext('user', 'project',
@@ -146,7 +145,7 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
 
         self.stubs.Set(sched.host_manager, 'filter_hosts',
                 fake_filter_hosts)
-        self.stubs.Set(least_cost, 'weighted_sum', _fake_weighted_sum)
+        self.stubs.Set(least_cost, 'weigh_host', _fake_weigh_host)
         fakes.mox_host_manager_db_calls(self.mox, fake_context)
 
         request_spec = {'num_instances': 10,
@@ -165,6 +164,94 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
         for weighted_host in weighted_hosts:
             self.assertTrue(weighted_host.host_state is not None)
 
+    def test_schedule_places_like_greedy_loop(self):
+        """_schedule() places instances on the same hosts as filtering and
+        weighing all hosts again for every instance would."""
+        self.flags(reserved_host_memory_mb=0, reserved_host_disk_mb=0,
+                   ram_allocation_ratio=1.0,
+                   scheduler_default_filters=['RamFilter', 'CoreFilter'])
+        fake_context = context.RequestContext('user', 'project',
+                is_admin=True)
+        instance_properties = {'project_id': 1, 'root_gb': 1,
+                               'memory_mb': 512, 'ephemeral_gb': 0,
+                               'vcpus': 1}
+        request_spec = {'num_instances': 20,
+                        'instance_type': instance_properties,
+                        'instance_properties': instance_properties}
+
+        sched = fakes.FakeFilterScheduler()
+        fakes.mox_host_manager_db_calls(self.mox, fake_context)
+        self.mox.ReplayAll()
+        weighted_hosts = sched._schedule(fake_context, 'compute',
+                request_spec)
+        self.mox.VerifyAll()
+        self.mox.UnsetStubs()
+        self.mox.ResetAll()
+
+        filter_properties = {'instance_type': instance_properties}
+        cost_functions = sched.get_cost_functions()
+        manager = host_manager.HostManager()
+        fakes.mox_host_manager_db_calls(self.mox, fake_context)
+        self.mox.ReplayAll()
+        hosts = manager.get_all_host_states(fake_context,
+                'compute').values()
+        expected = []
+        for num in xrange(request_spec['num_instances']):
+            hosts = manager.filter_hosts(hosts, filter_properties)
+            if not hosts:
+                break
+            weighted_host = least_cost.weighted_sum(cost_functions, hosts,
+                    filter_properties)
+            expected.append(weighted_host)
+            weighted_host.host_state.consume_from_instance(
+                    instance_properties)
+        expected.sort(key=lambda weighted_host: weighted_host.weight)
+
+        self.assertEqual([(weighted_host.weight,
+                           weighted_host.host_state.host)
+                          for weighted_host in weighted_hosts],
+                         [(weighted_host.weight,
+                           weighted_host.host_state.host)
+                          for weighted_host in expected])
+        self.assertTrue(len(expected) > 4)
+
+    @test.skip_unless(host_manager.numpy, "numpy not available")
+    def test_schedule_host_columns_matches_host_states(self):
+        """_schedule() picks the same hosts whether it filters and weighs
+        host by host or all hosts at once."""
+        self.flags(reserved_host_memory_mb=0, reserved_host_disk_mb=0,
+                   ram_allocation_ratio=1.0,
+                   scheduler_default_filters=['RamFilter', 'CoreFilter'])
+        fake_context = context.RequestContext('user', 'project',
+                is_admin=True)
+        request_spec = {'num_instances': 6,
+                        'instance_type': {'memory_mb': 1024, 'root_gb': 1,
+                                          'ephemeral_gb': 0,
+                                          'vcpus': 1},
+                        'instance_properties': {'project_id': 1,
+                                                'root_gb': 1,
+                                                'memory_mb': 1024,
+                                                'ephemeral_gb': 0,
+                                                'vcpus': 1}}
+
+        results = []
+        for use_host_columns in (False, True):
+            self.flags(scheduler_use_host_columns=use_host_columns)
+            sched = fakes.FakeFilterScheduler()
+            fakes.mox_host_manager_db_calls(self.mox, fake_context)
+            self.mox.ReplayAll()
+            weighted_hosts = sched._schedule(fake_context, 'compute',
+                    request_spec)
+            self.mox.VerifyAll()
+            self.mox.UnsetStubs()
+            self.mox.ResetAll()
+            results.append([(weighted_host.weight,
+                             weighted_host.host_state.host)
+                            for weighted_host in weighted_hosts])
+
+        self.assertEqual(results[0], results[1])
+        self.assertTrue(results[0])
+
     def test_get_cost_functions(self):
         self.flags(reserved_host_memory_mb=128)
         fixture = fakes.FakeFilterScheduler()
@@ -24,6 +24,7 @@ from nova import flags
 from nova.openstack.common import jsonutils
 from nova.scheduler import filters
 from nova.scheduler.filters.trusted_filter import AttestationService
+from nova.scheduler import host_manager
 from nova import test
 from nova.tests.scheduler import fakes
 from nova import utils
@@ -885,3 +886,92 @@ class HostFiltersTestCase(test.TestCase):
         host = fakes.FakeHostState('host1', 'compute',
             {'capabilities': capabilities, 'service': service})
         self.assertFalse(filt_cls.host_passes(host, filter_properties))
+
+
+class HostFiltersColumnsTestCase(test.TestCase):
+    """Test that hosts_pass() agrees with host_passes()."""
+
+    def setUp(self):
+        super(HostFiltersColumnsTestCase, self).setUp()
+        self.stubs = stubout.StubOutForTesting()
+        classes = filters.get_filter_classes(
+                ['nova.scheduler.filters.standard_filters'])
+        self.class_map = dict((cls.__name__, cls) for cls in classes)
+
+    def _assert_hosts_pass_matches(self, filter_name, hosts,
+                                   filter_properties):
+        filt_cls = self.class_map[filter_name]()
+        expected = [filt_cls.host_passes(host, filter_properties)
+                    for host in hosts]
+        columns = host_manager.HostStateColumns(hosts)
+        passes = filt_cls.hosts_pass(columns, filter_properties)
+        self.assertEqual(list(passes), expected)
+        return expected
+
+    def test_base_filter_has_no_hosts_pass(self):
+        filt_cls = filters.BaseHostFilter()
+        self.assertEqual(filt_cls.hosts_pass(None, {}), None)
+
+    @test.skip_unless(host_manager.numpy, "numpy not available")
+    def test_ram_filter(self):
+        self.flags(ram_allocation_ratio=1.5)
+        filter_properties = {'instance_type': {'memory_mb': 1024}}
+        hosts = [fakes.FakeHostState('host%d' % i, 'compute',
+                    {'free_ram_mb': free, 'total_usable_ram_mb': 2048})
+                 for i, free in enumerate([-100, 0, 1023, 1024, 2048])]
+        expected = self._assert_hosts_pass_matches('RamFilter', hosts,
+                                                   filter_properties)
+        self.assertEqual(expected, [False, True, True, True, True])
+
+    @test.skip_unless(host_manager.numpy, "numpy not available")
+    def test_core_filter(self):
+        self.flags(cpu_allocation_ratio=2)
+        filter_properties = {'instance_type': {'vcpus': 1}}
+        hosts = [fakes.FakeHostState('host1', 'compute',
+                    {'vcpus_total': 4, 'vcpus_used': 7}),
+                 fakes.FakeHostState('host2', 'compute',
+                    {'vcpus_total': 4, 'vcpus_used': 8}),
+                 fakes.FakeHostState('host3', 'compute', {}),
+                 fakes.FakeHostState('host4', 'volume',
+                    {'vcpus_total': 4, 'vcpus_used': 8})]
+        expected = self._assert_hosts_pass_matches('CoreFilter', hosts,
+                                                   filter_properties)
+        self.assertEqual(expected, [True, False, True, True])
+
+    @test.skip_unless(host_manager.numpy, "numpy not available")
+    def test_compute_filter(self):
+        def fake_service_is_up(service):
+            return service['host'] != 'down'
+        self.stubs.Set(utils, 'service_is_up', fake_service_is_up)
+
+        extra_specs = {'opt1': 1, 'opt2': 2}
+        filter_properties = {'instance_type': {'memory_mb': 1024,
+                                               'extra_specs': extra_specs}}
+
+        def host(name, topic, capabilities, disabled=False):
+            service = {'host': name, 'disabled': disabled}
+            return fakes.FakeHostState(name, topic,
+                    {'capabilities': capabilities, 'service': service})
+
+        hosts = [host('up', 'compute', {'opt1': 1, 'opt2': 2}),
+                 host('down', 'compute', {'opt1': 1, 'opt2': 2}),
+                 host('disabled', 'compute', {'opt1': 1, 'opt2': 2},
+                      disabled=True),
+                 host('capabs', 'compute',
+                      {'enabled': False, 'opt1': 1, 'opt2': 2}),
+                 host('specs', 'compute', {'opt1': 1, 'opt2': 222}),
+                 host('volume', 'volume', {})]
+        expected = self._assert_hosts_pass_matches('ComputeFilter', hosts,
+                                                   filter_properties)
+        self.assertEqual(expected, [True, False, False, False, False, True])
+
+    @test.skip_unless(host_manager.numpy, "numpy not available")
+    def test_availability_zone_filter(self):
+        filter_properties = {'request_spec': {
+                'instance_properties': {'availability_zone': 'nova'}}}
+        hosts = [fakes.FakeHostState('host%d' % i, 'compute',
+                    {'service': {'availability_zone': zone}})
+                 for i, zone in enumerate(['nova', 'other', 'nova'])]
+        expected = self._assert_hosts_pass_matches('AvailabilityZoneFilter',
+                                                   hosts, filter_properties)
+        self.assertEqual(expected, [True, False, True])
@@ -87,6 +87,58 @@ class HostManagerTestCase(test.TestCase):
         self.assertEqual(len(filtered_hosts), 1)
         self.assertEqual(filtered_hosts[0], fake_host2)
 
+    @test.skip_unless(host_manager.numpy, "numpy not available")
+    def test_filter_host_columns(self):
+        class RamColumnsFilter(object):
+            def host_passes(self, host_state, filter_properties):
+                raise AssertionError('host_passes should not be called')
+
+            def hosts_pass(self, host_columns, filter_properties):
+                return host_columns.free_ram_mb >= 1024
+
+        class NameFilter(object):
+            def host_passes(self, host_state, filter_properties):
+                self.called.append(host_state.host)
+                return host_state.host != 'host3'
+
+            def hosts_pass(self, host_columns, filter_properties):
+                return None
+
+        name_filter = NameFilter()
+        name_filter.called = []
+        self.mox.StubOutWithMock(self.host_manager,
+                '_choose_host_filter_objs')
+        self.host_manager._choose_host_filter_objs(None).AndReturn(
+                [RamColumnsFilter(), name_filter])
+
+        hosts = [fakes.FakeHostState('host%d' % i, 'compute',
+                                     {'free_ram_mb': free_ram_mb})
+                 for i, free_ram_mb in enumerate([2048, 512, 4096, 4096])]
+        columns = host_manager.HostStateColumns(hosts)
+        filter_properties = {'ignore_hosts': ['host2']}
+
+        self.mox.ReplayAll()
+        mask = self.host_manager.filter_host_columns(columns,
+                filter_properties)
+        self.assertEqual(list(mask), [True, False, False, False])
+        # Per host filters only see the hosts still selected
+        self.assertEqual(name_filter.called, ['host0', 'host3'])
+
+    @test.skip_unless(host_manager.numpy, "numpy not available")
+    def test_filter_host_columns_force_hosts(self):
+        self.mox.StubOutWithMock(self.host_manager,
+                '_choose_host_filter_objs')
+        self.mox.ReplayAll()
+
+        hosts = [host_manager.HostState('host%d' % i, 'compute')
+                 for i in xrange(3)]
+        columns = host_manager.HostStateColumns(hosts)
+        filter_properties = {'force_hosts': ['host0', 'host2'],
+                             'ignore_hosts': ['host0']}
+        mask = self.host_manager.filter_host_columns(columns,
+                filter_properties)
+        self.assertEqual(list(mask), [False, False, True])
+
     def test_update_service_capabilities(self):
         service_states = self.host_manager.service_states
         self.assertDictMatch(service_states, {})
@@ -277,6 +329,92 @@ class HostManagerTestCase(test.TestCase):
         # 8191GB
         self.assertEqual(host_states['host4'].free_disk_mb, 8387584)
 
+    def test_get_all_host_states_cached(self):
+        self.flags(reserved_host_memory_mb=512,
+                reserved_host_disk_mb=1024)
+
+        context = 'fake_context'
+        topic = 'compute'
+
+        fakes.mox_host_manager_db_calls(self.mox, context)
+        self.mox.ReplayAll()
+
+        host_states = self.host_manager.get_all_host_states(context, topic)
+        host_states['host4'].consume_from_instance(dict(root_gb=1,
+                ephemeral_gb=0, memory_mb=1024, vcpus=1))
+
+        # No db access, and resources consumed by the scheduler are kept
+        host_states = self.host_manager.get_all_host_states(context, topic)
+        self.assertEqual(len(host_states), 4)
+        self.assertEqual(host_states['host4'].free_ram_mb, 6656)
+
+    def test_get_all_host_states_refreshes_changed_hosts(self):
+        self.flags(reserved_host_memory_mb=512,
+                reserved_host_disk_mb=1024)
+
+        context = 'fake_context'
+        topic = 'compute'
+
+        fakes.mox_host_manager_db_calls(self.mox, context)
+        self.mox.StubOutWithMock(db, 'service_get_all_compute_by_host')
+        self.mox.StubOutWithMock(db, 'instance_get_all_by_host')
+
+        service = dict(host='host4', disabled=False)
+        compute = dict(id=4, local_gb=8192, memory_mb=8192, vcpus=8,
+                       service=service)
+        service_with_node = dict(service, compute_node=[compute])
+        db.service_get_all_compute_by_host(context, 'host4').AndReturn(
+                [service_with_node])
+        db.instance_get_all_by_host(context, 'host4').AndReturn(
+                [dict(root_gb=1024, ephemeral_gb=0, memory_mb=2048,
+                      vcpus=1, host='host4')])
+        db.service_get_all_compute_by_host(context, 'host3').AndRaise(
+                exception.ComputeHostNotFound(host='host3'))
+        self.mox.ReplayAll()
+
+        self.host_manager.get_all_host_states(context, topic)
+        self.host_manager.update_service_capabilities('compute', 'host4',
+                                                      {})
+        self.host_manager.update_service_capabilities('volume', 'host2',
+                                                      {})
+        host_states = self.host_manager.get_all_host_states(context, topic)
+        self.assertEqual(host_states['host4'].free_ram_mb, 5632)
+
+        self.host_manager.update_service_capabilities('compute', 'host3',
+                                                      {})
+        host_states = self.host_manager.get_all_host_states(context, topic)
+        self.assertEqual(sorted(host_states.keys()),
+                         ['host1', 'host2', 'host4'])
+
+    def test_get_all_host_states_reconciles(self):
+        self.flags(scheduler_host_state_reconcile_interval=60)
+
+        context = 'fake_context'
+        topic = 'compute'
+
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        self.mox.StubOutWithMock(db, 'instance_get_all')
+        for i in xrange(2):
+            db.compute_node_get_all(context).AndReturn(
+                    fakes.COMPUTE_NODES[:4])
+            db.instance_get_all(context,
+                    columns_to_join=['instance_type']).AndReturn([])
+        self.mox.ReplayAll()
+
+        timeutils.set_time_override()
+        try:
+            self.host_manager.get_all_host_states(context, topic)
+            timeutils.advance_time_seconds(30)
+            self.host_manager.get_all_host_states(context, topic)
+            self.assertEqual(self.host_manager.get_host_state_staleness(),
+                             dict(host1=30, host2=30, host3=30, host4=30))
+            timeutils.advance_time_seconds(31)
+            self.host_manager.get_all_host_states(context, topic)
+            self.assertEqual(self.host_manager.get_host_state_staleness(),
+                             dict(host1=0, host2=0, host3=0, host4=0))
+        finally:
+            timeutils.clear_time_override()
+
 
 class HostStateTestCase(test.TestCase):
     """Test case for HostState class"""
@@ -368,3 +506,20 @@ class HostStateTestCase(test.TestCase):
         self.mox.ReplayAll()
         result = fake_host.passes_filters(filter_fns, filter_properties)
         self.assertTrue(result)
+
+
+class HostStateColumnsTestCase(test.TestCase):
+    """Test case for HostStateColumns class"""
+
+    @test.skip_unless(host_manager.numpy, "numpy not available")
+    def test_capability(self):
+        hosts = [fakes.FakeHostState('host1', 'compute',
+                    {'capabilities': {'cpu_info': {'arch': 'x86_64'}}}),
+                 fakes.FakeHostState('host2', 'compute',
+                    {'capabilities': {}})]
+        columns = host_manager.HostStateColumns(hosts)
+        self.assertEqual(list(columns.capability('cpu_info')),
+                         [{'arch': 'x86_64'}, None])
+        self.assertEqual(list(columns.capability_equals('cpu_info',
+                                                        {'arch': 'x86_64'})),
+                         [True, False])
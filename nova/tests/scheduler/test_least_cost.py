@@ -88,6 +88,23 @@ class LeastCostTestCase(test.TestCase):
         self.assertEqual(weighted_host.weight, 10512)
         self.assertEqual(weighted_host.host_state.host, 'host1')
 
+    @test.skip_unless(host_manager.numpy, "numpy not available")
+    def test_weigh_host_columns(self):
+        fn_tuples = [(1.0, offset), (-1.0, least_cost.noop_cost_fn),
+                     (-2.0, least_cost.compute_fill_first_cost_fn)]
+        hostinfo_list = self._get_all_hosts()
+        columns = host_manager.HostStateColumns(hostinfo_list)
+
+        options = {}
+        indexes = columns.all_hosts().nonzero()[0][1:]
+        scores = least_cost.weigh_host_columns(fn_tuples, columns, indexes,
+                                               options)
+        self.assertEqual(len(scores), len(indexes))
+        for index, score in zip(indexes, scores):
+            expected = least_cost.weighted_sum(fn_tuples,
+                                               [hostinfo_list[index]], options)
+            self.assertEqual(score, expected.weight)
+
 
 class TestWeightedHost(test.TestCase):
     def test_dict_conversion_without_host_state(self):
@@ -93,7 +93,7 @@ class _AuthManagerBaseTestCase(test.TestCase):
         self.flags(auth_driver=self.auth_driver,
                 compute_driver='nova.virt.fake.FakeDriver')
         self.manager = manager.AuthManager(new=True)
-        self.manager.mc.cache = {}
+        self.manager.mc.flush_all()
 
     def test_create_and_find_user(self):
         with user_generator(self.manager):
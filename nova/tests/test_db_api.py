@@ -81,6 +81,100 @@ class DbApiTestCase(test.TestCase):
         else:
             self.assertTrue(result[1].deleted)
 
+    def test_instance_get_all_by_filters_paginate(self):
+        uuids = []
+        for i in xrange(5):
+            values = {'display_name': 'a%d' % i,
+                      'project_id': self.project_id}
+            inst = db.instance_create(self.context, values)
+            uuids.append(inst['uuid'])
+        expected = db.instance_get_all_by_filters(self.context, {},
+                                                  'display_name', 'asc')
+        self.assertEqual(uuids, [i['uuid'] for i in expected])
+
+        result = db.instance_get_all_by_filters(self.context, {},
+                                                'display_name', 'asc',
+                                                limit=2)
+        self.assertEqual(uuids[:2], [i['uuid'] for i in result])
+
+        result = db.instance_get_all_by_filters(self.context, {},
+                                                'display_name', 'asc',
+                                                limit=2, marker=uuids[1])
+        self.assertEqual(uuids[2:4], [i['uuid'] for i in result])
+
+        result = db.instance_get_all_by_filters(self.context, {},
+                                                'display_name', 'desc',
+                                                marker=uuids[1])
+        self.assertEqual(uuids[:1], [i['uuid'] for i in result])
+
+    def test_instance_get_all_by_filters_paginate_regexp(self):
+        uuids = []
+        for i in xrange(6):
+            name = 'match%d' % i if i % 2 else 'other%d' % i
+            inst = db.instance_create(self.context,
+                                      {'display_name': name,
+                                       'project_id': self.project_id})
+            uuids.append(inst['uuid'])
+        result = db.instance_get_all_by_filters(self.context,
+                                                {'display_name': 'match'},
+                                                'display_name', 'asc',
+                                                limit=2)
+        self.assertEqual([uuids[1], uuids[3]], [i['uuid'] for i in result])
+
+        result = db.instance_get_all_by_filters(self.context,
+                                                {'display_name': 'match'},
+                                                'display_name', 'asc',
+                                                limit=2, marker=uuids[3])
+        self.assertEqual([uuids[5]], [i['uuid'] for i in result])
+
+    def test_instance_get_all_by_filters_regexp_in_sql(self):
+        names = ['web-1', 'web-2', 'WEB-3', 'db_1', 'dbx1', 'api.web']
+        uuids = {}
+        for name in names:
+            inst = db.instance_create(self.context,
+                                      {'display_name': name,
+                                       'project_id': self.project_id})
+            uuids[name] = inst['uuid']
+
+        def _names(filters):
+            result = db.instance_get_all_by_filters(self.context, filters,
+                                                    'display_name', 'asc')
+            return [i['display_name'] for i in result]
+
+        self.assertEqual(['web-1', 'web-2'], _names({'display_name': 'web'}))
+        self.assertEqual(['web-2'], _names({'display_name': '^web-2$'}))
+        self.assertEqual(['db_1'], _names({'display_name': 'db_'}))
+        self.assertEqual(['api.web', 'web-1', 'web-2'],
+                         _names({'display_name': '.*web'}))
+        self.assertEqual(['api.web'], _names({'display_name': 'api\\.web'}))
+        self.assertEqual(['db_1', 'dbx1'], _names({'display_name': 'db.1'}))
+
+    def test_instance_get_all_by_filters_metadata_in_sql(self):
+        inst1 = db.instance_create(self.context,
+                                   {'metadata': {'role': 'web', 'az': '1'},
+                                    'project_id': self.project_id})
+        inst2 = db.instance_create(self.context,
+                                   {'metadata': {'role': 'db', 'az': '1'},
+                                    'project_id': self.project_id})
+        db.instance_create(self.context, {'project_id': self.project_id})
+
+        def _uuids(filters):
+            result = db.instance_get_all_by_filters(self.context, filters)
+            return sorted(i['uuid'] for i in result)
+
+        self.assertEqual([inst1['uuid']],
+                         _uuids({'metadata': {'role': 'web'}}))
+        self.assertEqual(sorted([inst1['uuid'], inst2['uuid']]),
+                         _uuids({'metadata': [{'az': '1'}]}))
+        self.assertEqual([], _uuids({'metadata': {'role': 'web',
+                                                  'az': '2'}}))
+
+    def test_instance_get_all_by_filters_bad_marker(self):
+        self.assertRaises(exception.MarkerNotFound,
+                          db.instance_get_all_by_filters,
+                          self.context, {}, 'created_at', 'desc',
+                          marker=str(utils.gen_uuid()))
+
     def test_migration_get_all_unconfirmed(self):
         ctxt = context.get_admin_context()
 
@@ -351,6 +445,69 @@ class DbApiTestCase(test.TestCase):
         data = db.network_get_associated_fixed_ips(ctxt, 1, 'nothing')
         self.assertEqual(len(data), 0)
 
+    def test_network_info_bulk_lookups(self):
+        ctxt = context.get_admin_context()
+        vifs = []
+        fixed_ips = []
+        for x in xrange(3):
+            instance = db.instance_create(ctxt, {'host': 'foo'})
+            vif = db.virtual_interface_create(ctxt,
+                    {'address': 'vif-%d' % x, 'instance_id': instance['id']})
+            address = db.fixed_ip_create(ctxt,
+                    {'address': '10.0.0.%d' % x,
+                     'instance_id': instance['id'],
+                     'virtual_interface_id': vif['id']})
+            fixed_ip = db.fixed_ip_get_by_address(ctxt, address)
+            db.floating_ip_create(ctxt, {'address': '10.1.0.%d' % x,
+                                         'fixed_ip_id': fixed_ip['id']})
+            vifs.append(vif)
+            fixed_ips.append(fixed_ip)
+
+        data = db.virtual_interface_get_by_instances(ctxt,
+                [vif['instance_id'] for vif in vifs[:2]])
+        self.assertEqual(sorted(v['address'] for v in data),
+                         ['vif-0', 'vif-1'])
+        data = db.fixed_ips_by_virtual_interfaces(ctxt,
+                [vif['id'] for vif in vifs[1:]])
+        self.assertEqual(sorted(f['address'] for f in data),
+                         ['10.0.0.1', '10.0.0.2'])
+        data = db.floating_ip_get_by_fixed_ip_ids(ctxt,
+                [fixed_ips[0]['id'], fixed_ips[2]['id']])
+        self.assertEqual(sorted(f['address'] for f in data),
+                         ['10.1.0.0', '10.1.0.2'])
+
+        self.assertEqual(db.virtual_interface_get_by_instances(ctxt, []), [])
+        self.assertEqual(db.fixed_ips_by_virtual_interfaces(ctxt, []), [])
+        self.assertEqual(db.floating_ip_get_by_fixed_ip_ids(ctxt, []), [])
+
+    def test_ec2_bulk_lookups(self):
+        ctxt = context.get_admin_context()
+        uuids = []
+        for x in xrange(3):
+            instance = db.instance_create(ctxt, {})
+            db.block_device_mapping_create(ctxt,
+                    {'instance_uuid': instance['uuid'],
+                     'device_name': '/dev/vd%s' % 'abc'[x]})
+            uuids.append(instance['uuid'])
+        images = [db.s3_image_create(ctxt, 'image-%d' % x)
+                  for x in xrange(3)]
+
+        data = db.get_ec2_instance_ids_by_uuids(ctxt, uuids[:2])
+        self.assertEqual(data,
+                {uuids[0]: db.get_ec2_instance_id_by_uuid(ctxt, uuids[0]),
+                 uuids[1]: db.get_ec2_instance_id_by_uuid(ctxt, uuids[1])})
+        data = db.s3_image_get_all_by_uuids(ctxt, ['image-0', 'image-2'])
+        self.assertEqual([i['id'] for i in data],
+                         [images[0]['id'], images[2]['id']])
+        data = db.block_device_mapping_get_all_by_instances(ctxt, uuids[1:])
+        self.assertEqual(sorted(bdm['device_name'] for bdm in data),
+                         ['/dev/vdb', '/dev/vdc'])
+
+        self.assertEqual(db.get_ec2_instance_ids_by_uuids(ctxt, []), {})
+        self.assertEqual(db.s3_image_get_all_by_uuids(ctxt, []), [])
+        self.assertEqual(
+                db.block_device_mapping_get_all_by_instances(ctxt, []), [])
+
     def _timeout_test(self, ctxt, timeout, multi_host):
         values = {'host': 'foo'}
         instance = db.instance_create(ctxt, values)
@@ -852,6 +1009,25 @@ class TestIpAllocation(test.TestCase):
         self.assertEqual(fixed_ip.instance_id, self.instance.id)
         self.assertEqual(fixed_ip.network_id, self.network.id)
 
+    def test_fixed_ip_associate_pool_skips_used_ips(self):
+        self.create_fixed_ip(address='192.168.0.1',
+                             network_id=self.network.id,
+                             instance_id=self.instance.id)
+        self.create_fixed_ip(address='192.168.0.2',
+                             network_id=self.network.id, reserved=True)
+        self.create_fixed_ip(address='192.168.0.3', host='fake_host')
+        address = self.create_fixed_ip(address='192.168.0.4')
+        self.assertEqual(db.fixed_ip_associate_pool(self.ctxt,
+                                                    self.network.id,
+                                                    self.instance.id),
+                         address)
+        fixed_ip = db.fixed_ip_get_by_address(self.ctxt, address)
+        self.assertEqual(fixed_ip.instance_id, self.instance.id)
+        self.assertEqual(fixed_ip.network_id, self.network.id)
+        self.assertRaises(exception.NoMoreFixedIps,
+                          db.fixed_ip_associate_pool,
+                          self.ctxt, self.network.id, self.instance.id)
+
 
 class InstanceDestroyConstraints(test.TestCase):
 
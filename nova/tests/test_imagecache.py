@@ -145,8 +145,8 @@ class ImageCacheManagerTestCase(test.TestCase):
         self.assertFalse(unexpected in image_cache_manager.originals)
 
     def test_list_running_instances(self):
-        self.stubs.Set(db, 'instance_get_all',
-                       lambda x: [{'image_ref': '1',
+        self.stubs.Set(db, 'instance_get_all_by_host_or_resizing',
+                       lambda x, y: [{'image_ref': '1',
                                    'host': FLAGS.host,
                                    'name': 'inst-1',
                                    'uuid': '123',
@@ -165,6 +165,8 @@ class ImageCacheManagerTestCase(test.TestCase):
                                    'vm_state': '',
                                    'task_state': ''}])
 
+        self.stubs.Set(os, 'listdir', lambda x: [])
+
         image_cache_manager = imagecache.ImageCacheManager()
 
         # The argument here should be a context, but it's mocked out
@@ -181,14 +183,16 @@ class ImageCacheManagerTestCase(test.TestCase):
         self.assertEqual(image_cache_manager.image_popularity['2'], 2)
 
     def test_list_resizing_instances(self):
-        self.stubs.Set(db, 'instance_get_all',
-                       lambda x: [{'image_ref': '1',
+        self.stubs.Set(db, 'instance_get_all_by_host_or_resizing',
+                       lambda x, y: [{'image_ref': '1',
                                    'host': FLAGS.host,
                                    'name': 'inst-1',
                                    'uuid': '123',
                                    'vm_state': vm_states.RESIZED,
                                    'task_state': None}])
 
+        self.stubs.Set(os, 'listdir', lambda x: [])
+
         image_cache_manager = imagecache.ImageCacheManager()
         image_cache_manager._list_running_instances(None)
 
@@ -201,6 +205,61 @@ class ImageCacheManagerTestCase(test.TestCase):
         self.assertEqual(len(image_cache_manager.image_popularity), 1)
         self.assertEqual(image_cache_manager.image_popularity['1'], 1)
 
+    def test_list_remote_instances_looked_up_once(self):
+        self.stubs.Set(db, 'instance_get_all_by_host_or_resizing',
+                       lambda x, y: [{'image_ref': '1',
+                                      'host': FLAGS.host,
+                                      'name': 'inst-1',
+                                      'uuid': '123',
+                                      'vm_state': vm_states.ACTIVE,
+                                      'task_state': ''}])
+        lookups = []
+
+        def fake_instance_get_all(context, columns_to_join=None):
+            lookups.append(columns_to_join)
+            return [{'host': 'remotehost', 'name': 'inst-2'},
+                    {'host': 'remotehost', 'name': 'inst-3'}]
+        self.stubs.Set(db, 'instance_get_all', fake_instance_get_all)
+        self.stubs.Set(os, 'listdir',
+                       lambda x: ['_base', 'inst-1', 'inst-2', 'junk'])
+        self.stubs.Set(os.path, 'isdir', lambda x: True)
+
+        image_cache_manager = imagecache.ImageCacheManager()
+        for x in xrange(2):
+            image_cache_manager._list_running_instances(None)
+            self.assertEqual(image_cache_manager.instance_names,
+                             set(['inst-1', 'inst-2']))
+            self.assertEqual(image_cache_manager.used_images,
+                             {'1': (1, 0, ['inst-1'])})
+        self.assertEqual(lookups, [[]])
+
+    def test_list_backing_images_cached(self):
+        lookups = []
+
+        def fake_get_disk_backing_file(path):
+            lookups.append(path)
+            return 'e97222e91fc4241f49a7f520d1dcf446751129b3_sm'
+        self.stubs.Set(virtutils, 'get_disk_backing_file',
+                       fake_get_disk_backing_file)
+
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            disk_path = os.path.join(tmpdir, 'instance-00000001', 'disk')
+            os.mkdir(os.path.dirname(disk_path))
+            with open(disk_path, 'w') as f:
+                f.write('disk')
+
+            image_cache_manager = imagecache.ImageCacheManager()
+            image_cache_manager.instance_names = self.stock_instance_names
+            for x in xrange(2):
+                image_cache_manager._list_backing_images()
+            self.assertEqual(lookups, [disk_path])
+
+            with open(disk_path, 'a') as f:
+                f.write('more disk')
+            image_cache_manager._list_backing_images()
+            self.assertEqual(lookups, [disk_path, disk_path])
+
     def test_list_backing_images_small(self):
         self.stubs.Set(os, 'listdir',
                        lambda x: ['_base', 'instance-00000001',
@@ -380,6 +439,35 @@ class ImageCacheManagerTestCase(test.TestCase):
                 res = image_cache_manager._verify_checksum(img, fname)
                 self.assertTrue(res)
 
+    def test_verify_checksum_over_passes(self):
+        img = {'container_format': 'ami', 'id': '42'}
+
+        self.flags(checksum_base_images=True)
+        self.flags(checksum_base_images_bytes_per_pass=20)
+
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            self.flags(image_info_filename_pattern=('$instances_path/'
+                                                    '%(image)s.info'))
+            fname, info_fname, testdata = self._make_checksum(tmpdir)
+
+            f = open(info_fname, 'w')
+            f.write('{"sha1": "%s"}\n' % hashlib.sha1(testdata).hexdigest())
+            f.close()
+
+            # The file is hashed 20 bytes a pass, and only the last of
+            # those passes has a result
+            image_cache_manager = imagecache.ImageCacheManager()
+            passes = (len(testdata) + 19) / 20
+            for x in xrange(passes):
+                image_cache_manager._reset_state()
+                res = image_cache_manager._verify_checksum(img, fname)
+                self.assertEqual(res, x == passes - 1 or None)
+
+            # That result holds until a pass had budget to spare
+            image_cache_manager._reset_state()
+            self.assertTrue(image_cache_manager._verify_checksum(img, fname))
+
     def test_verify_checksum_invalid_json(self):
         img = {'container_format': 'ami', 'id': '42'}
 
@@ -765,8 +853,8 @@ class ImageCacheManagerTestCase(test.TestCase):
         self.stubs.Set(os.path, 'isfile', lambda x: isfile(x))
 
         # Fake the database call which lists running instances
-        self.stubs.Set(db, 'instance_get_all',
-                       lambda x: [{'image_ref': '1',
+        self.stubs.Set(db, 'instance_get_all_by_host_or_resizing',
+                       lambda x, y: [{'image_ref': '1',
                                    'host': FLAGS.host,
                                    'name': 'instance-1',
                                    'uuid': '123',
@@ -866,8 +954,8 @@ class ImageCacheManagerTestCase(test.TestCase):
             os.mkdir(os.path.join(tmpdir, '_base'))
 
             # Fake the database call which lists running instances
-            self.stubs.Set(db, 'instance_get_all',
-                           lambda x: [{'image_ref': '1',
+            self.stubs.Set(db, 'instance_get_all_by_host_or_resizing',
+                           lambda x, y: [{'image_ref': '1',
                                        'host': FLAGS.host,
                                        'name': 'instance-1',
                                        'uuid': '123',
@@ -17,6 +17,7 @@
 #    under the License.
 """Unit Tests for network code."""
 
+from nova import exception
 from nova.network import linux_net
 from nova import test
 
@@ -94,6 +95,17 @@ class IptablesManagerTestCase(test.TestCase):
                         '-s 1.2.3.4/5 -j DROP' % self.binary_name \
                         not in new_lines)
 
+    def test_remove_chain_keeps_jumps_to_other_chains(self):
+        table = self.manager.ipv4['filter']
+        table.add_chain('inst-1')
+        table.add_chain('inst-12')
+        table.add_rule('local', '-d 10.0.0.1 -j $inst-1')
+        table.add_rule('local', '-d 10.0.0.12 -j $inst-12')
+        table.remove_chain('inst-1')
+        rules = [rule.rule for rule in table.rules if rule.chain == 'local']
+        self.assertEqual(rules,
+                         ['-d 10.0.0.12 -j %s-inst-12' % self.binary_name])
+
     def test_nat_rules(self):
         current_lines = self.sample_nat
         new_lines = self.manager._modify_rules(current_lines,
@@ -164,3 +176,113 @@ class IptablesManagerTestCase(test.TestCase):
             self.assertTrue('-A %s -j %s-%s' %
                             (chain, self.binary_name, chain) in new_lines,
                             "Built-in chain %s not wrapped" % (chain,))
+
+    def _fake_execute(self, *cmd, **kwargs):
+        self.executes.append((cmd, kwargs.get('process_input')))
+        if cmd[0].endswith('-save'):
+            if cmd[2] == 'nat':
+                return '\n'.join(self.sample_nat), ''
+            return '\n'.join(self.sample_filter), ''
+        return '', ''
+
+    def _stub_execute(self):
+        self.flags(use_ipv6=False)
+        self.executes = []
+        self.manager.execute = self._fake_execute
+
+    def _restores(self):
+        return [(cmd, lines) for cmd, lines in self.executes
+                if cmd[0].endswith('-restore')]
+
+    def test_apply_deferred(self):
+        self._stub_execute()
+        self.manager.defer_apply_on()
+        self.manager.ipv4['filter'].add_rule('FORWARD', '-s 1.2.3.4/5 -j DROP')
+        self.manager.apply()
+        self.manager.apply()
+        self.assertEqual(self.executes, [])
+
+        self.manager.defer_apply_off()
+        self.assertEqual(len(self._restores()), 2)
+
+    def test_apply_already_done_by_concurrent_call(self):
+        self._stub_execute()
+        self.manager.apply()
+        self.assertEqual(len(self._restores()), 2)
+
+        # A call that was waiting while the apply above went out has
+        # nothing left to do.
+        self.manager._apply(self.manager._apply_requests)
+        self.assertEqual(len(self._restores()), 2)
+
+    def test_incremental_apply(self):
+        self.flags(iptables_incremental_apply=True)
+        self._stub_execute()
+        table = self.manager.ipv4['filter']
+
+        # The first apply rewrites whole tables
+        self.manager.apply()
+        self.assertEqual(len(self.executes), 4)
+        self.assertEqual(len(self._restores()), 2)
+
+        # Nothing changed, nothing to do
+        self.executes = []
+        self.manager.apply()
+        self.assertEqual(self.executes, [])
+
+        # Only the changed and new chains get restored
+        table.add_chain('inst-1')
+        table.add_rule('inst-1', '-j DROP')
+        table.add_rule('local', '-d 10.0.0.1 -j $inst-1')
+        self.manager.apply()
+        self.assertEqual(len(self.executes), 1)
+        cmd, lines = self.executes[0]
+        self.assertEqual(cmd, ('iptables-restore', '--noflush'))
+        self.assertEqual(sorted(lines.split('\n')),
+                         sorted(['*filter',
+                                 ':%s-inst-1 - [0:0]' % self.binary_name,
+                                 ':%s-local - [0:0]' % self.binary_name,
+                                 '-A %s-inst-1 -j DROP' % self.binary_name,
+                                 '-A %s-local -d 10.0.0.1 -j %s-inst-1' %
+                                 (self.binary_name, self.binary_name),
+                                 'COMMIT', '']))
+
+        # Removed chains are flushed and deleted after the chains
+        # jumping to them
+        self.executes = []
+        table.remove_chain('inst-1')
+        self.manager.apply()
+        self.assertEqual(len(self.executes), 1)
+        lines = self.executes[0][1].split('\n')
+        self.assertTrue(':%s-local - [0:0]' % self.binary_name in lines)
+        self.assertTrue(lines.index(':%s-inst-1 - [0:0]' % self.binary_name) <
+                        lines.index('-X %s-inst-1' % self.binary_name))
+
+        # Changes outside of our wrapped chains need the whole table
+        self.executes = []
+        table.add_rule('FORWARD', '-j ACCEPT', wrap=False)
+        self.manager.apply()
+        self.assertEqual(len(self.executes), 2)
+        self.assertEqual(self.executes[0][0], ('iptables-save', '-t',
+                                               'filter'))
+
+    def test_incremental_apply_after_failure(self):
+        self.flags(iptables_incremental_apply=True)
+        self._stub_execute()
+        self.manager.apply()
+
+        def fail_execute(*cmd, **kwargs):
+            raise exception.ProcessExecutionError()
+
+        table = self.manager.ipv4['filter']
+        table.add_rule('local', '-j DROP')
+        self.manager.execute = fail_execute
+        self.assertRaises(exception.ProcessExecutionError,
+                          self.manager.apply)
+
+        # The table is rewritten as a whole once things work again
+        self.executes = []
+        self.manager.execute = self._fake_execute
+        self.manager.apply()
+        self.assertEqual(self.executes[0][0], ('iptables-save', '-t',
+                                               'filter'))
@@ -100,6 +100,28 @@ class TgtAdmTestCase(test.TestCase, TargetAdminTestCase):
         params['lun'] += 1
         return params
 
+    def test_show_targets(self):
+        output = "\n".join([
+            "Target 1: %s" % self.target_name,
+            "    System information:",
+            "        Driver: iscsi",
+            "    LUN information:",
+            "        LUN: 0",
+            "            Type: controller",
+            "            Backing store path: None",
+            "        LUN: 1",
+            "            Type: disk",
+            "            Backing store path: %s" % self.path,
+            "Target 2: iqn.2011-09.org.foo.bar:empty",
+            "    LUN information:",
+            "        LUN: 0",
+            "            Backing store path: None"])
+        tgtadm = iscsi.get_target_admin()
+        tgtadm.set_execute(lambda *cmd, **kwargs: (output, None))
+        self.assertEqual(tgtadm.show_targets(),
+                         {1: (self.target_name, [self.path]),
+                          2: ('iqn.2011-09.org.foo.bar:empty', [])})
+
 
 class IetAdmTestCase(test.TestCase, TargetAdminTestCase):
 
@@ -1517,6 +1517,8 @@ class LibvirtConnTestCase(test.TestCase):
                       '/test/disk.local').AndReturn((ret, ''))
 
         os.path.getsize('/test/disk.local').AndReturn((21474836480))
+        self.mox.StubOutWithMock(os.path, "getmtime")
+        os.path.getmtime('/test/disk.local').AndReturn(1350000000.0)
 
         self.mox.ReplayAll()
         conn = libvirt_driver.LibvirtDriver(False)
@@ -1820,6 +1822,75 @@ class LibvirtConnTestCase(test.TestCase):
         space = fake_libvirt_utils.get_fs_info(FLAGS.instances_path)['free']
         self.assertEqual(result, space / 1024 ** 3)
 
+    def test_qcow2_info_cached_until_disk_changes(self):
+        conn = libvirt_driver.LibvirtDriver(False)
+        mtimes = {'/test/disk': 1350000000.0}
+        self.stubs.Set(os.path, 'getmtime', lambda path: mtimes[path])
+        ret = ("image: /test/disk\n"
+               "file format: qcow2\n"
+               "virtual size: 20G (21474836480 bytes)\n")
+        executes = []
+
+        def fake_execute(*cmd, **kwargs):
+            executes.append(cmd)
+            return ret, ''
+        self.stubs.Set(utils, 'execute', fake_execute)
+
+        for x in xrange(2):
+            info = conn._get_qcow2_info('/test/disk', 1024)
+            self.assertEqual(info, (21474836480, None))
+        self.assertEqual(len(executes), 1)
+
+        mtimes['/test/disk'] += 1
+        conn._get_qcow2_info('/test/disk', 1024)
+        conn._get_qcow2_info('/test/disk', 2048)
+        self.assertEqual(len(executes), 3)
+
+    def test_vcpu_used_cached_per_domain(self):
+        dom_ids = [1, 2]
+        lookups = []
+
+        class FakeTwoVcpuDomain(FakeVirtDomain):
+            def vcpus(self):
+                return [], [None, None]
+
+        def fake_lookup(dom_id):
+            lookups.append(dom_id)
+            return FakeTwoVcpuDomain()
+        self.create_fake_libvirt_mock(lookupByID=fake_lookup)
+        self.mox.ReplayAll()
+        conn = libvirt_driver.LibvirtDriver(False)
+        self.stubs.Set(conn, 'list_instance_ids', lambda: dom_ids)
+
+        self.assertEqual(conn.get_vcpu_used(), 4)
+        self.assertEqual(conn.get_vcpu_used(), 4)
+        self.assertEqual(lookups, [1, 2])
+
+        dom_ids[:] = [2, 3]
+        self.assertEqual(conn.get_vcpu_used(), 4)
+        self.assertEqual(lookups, [1, 2, 3])
+        self.assertEqual(sorted(conn._domain_vcpus), [2, 3])
+
+    def test_prefetch_images(self):
+        fetched = []
+
+        def fake_fetch_image(context, target, image_id, user_id, project_id):
+            fetched.append(image_id)
+            open(target, 'w').close()
+        self.stubs.Set(libvirt_driver.libvirt_utils, 'fetch_image',
+                       fake_fetch_image)
+
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            os.mkdir(os.path.join(tmpdir, FLAGS.base_dir_name))
+            conn = libvirt_driver.LibvirtDriver(False)
+
+            conn.prefetch_images(self.context, ['1', '2', '1'])
+            self.assertEqual(sorted(fetched), ['1', '2'])
+
+            conn.prefetch_images(self.context, ['2', '3'])
+            self.assertEqual(sorted(fetched), ['1', '2', '3'])
+
     def test_cpu_info(self):
         conn = libvirt_driver.LibvirtDriver(True)
 
@@ -2197,14 +2268,121 @@ class IptablesFirewallTestCase(test.TestCase):
                   ipv6_rules_per_addr * ipv6_addr_per_network * networks_count)
 
     def test_do_refresh_security_group_rules(self):
+        admin_ctxt = context.get_admin_context()
         instance_ref = self._create_instance_ref()
+        secgroup = db.security_group_create(admin_ctxt,
+                                            {'user_id': 'fake',
+                                             'project_id': 'fake',
+                                             'name': 'testgroup',
+                                             'description': 'test group'})
         self.mox.StubOutWithMock(self.fw,
                                  'add_filters_for_instance',
                                  use_mock_anything=True)
         self.fw.prepare_instance_filter(instance_ref, mox.IgnoreArg())
         self.fw.instances[instance_ref['id']] = instance_ref
         self.mox.ReplayAll()
-        self.fw.do_refresh_security_group_rules("fake")
+        # Instances are only refiltered when they join or leave the group
+        self.fw.do_refresh_security_group_rules(secgroup['id'])
+        db.instance_add_security_group(admin_ctxt, instance_ref['uuid'],
+                                       secgroup['id'])
+        self.fw.do_refresh_security_group_rules(secgroup['id'])
+
+    def _sg_chain_rules(self, security_group_id):
+        chain = 'sg-%s' % security_group_id
+        return [rule.rule for rule in self.fw.iptables.ipv4['filter'].rules
+                if rule.chain == chain]
+
+    def test_security_group_chain_shared_by_instances(self):
+        admin_ctxt = context.get_admin_context()
+        secgroup = db.security_group_create(admin_ctxt,
+                                            {'user_id': 'fake',
+                                             'project_id': 'fake',
+                                             'name': 'testgroup',
+                                             'description': 'test group'})
+        db.security_group_rule_create(admin_ctxt,
+                                      {'parent_group_id': secgroup['id'],
+                                       'protocol': 'tcp',
+                                       'from_port': 22,
+                                       'to_port': 22,
+                                       'cidr': '192.168.10.0/24'})
+        instances = []
+        for x in xrange(2):
+            instance_ref = self._create_instance_ref()
+            db.instance_add_security_group(admin_ctxt, instance_ref['uuid'],
+                                           secgroup['id'])
+            instances.append(instance_ref)
+
+        calls = []
+        orig_rule_get = db.security_group_rule_get_by_security_group
+
+        def fake_rule_get(context, security_group_id):
+            calls.append(security_group_id)
+            return orig_rule_get(context, security_group_id)
+
+        self.stubs.Set(db, 'security_group_rule_get_by_security_group',
+                       fake_rule_get)
+
+        network_info = _fake_network_info(self.stubs, 1)
+        for instance_ref in instances:
+            self.fw.prepare_instance_filter(instance_ref, network_info)
+        # The rules of the group are compiled once, in a shared chain
+        self.assertEqual(calls, [secgroup['id']])
+        self.assertEqual(self._sg_chain_rules(secgroup['id']),
+                         ['-j ACCEPT -p tcp --dport 22 -s 192.168.10.0/24'])
+        for instance_ref in instances:
+            inst_ipv4, _inst_ipv6 = self.fw.instance_rules(instance_ref,
+                                                           network_info)
+            self.assertTrue('-j $sg-%s' % secgroup['id'] in inst_ipv4)
+
+        # The chain goes away with the last instance using it
+        self.fw.remove_filters_for_instance(instances[0])
+        self.assertEqual(len(self._sg_chain_rules(secgroup['id'])), 1)
+        self.fw.remove_filters_for_instance(instances[1])
+        self.assertEqual(self._sg_chain_rules(secgroup['id']), [])
+        self.assertFalse('sg-%s' % secgroup['id'] in
+                         self.fw.iptables.ipv4['filter'].chains)
+        self.assertEqual(self.fw.security_group_rules, {})
+
+    def test_refresh_security_group_members_looks_up_members_once(self):
+        admin_ctxt = context.get_admin_context()
+        src_secgroup = db.security_group_create(admin_ctxt,
+                                                {'user_id': 'fake',
+                                                 'project_id': 'fake',
+                                                 'name': 'testsourcegroup',
+                                                 'description': 'src group'})
+        src_instance_ref = self._create_instance_ref()
+        db.instance_add_security_group(admin_ctxt, src_instance_ref['uuid'],
+                                       src_secgroup['id'])
+
+        network_model = _fake_network_info(self.stubs, 1, spectacular=True)
+        calls = []
+
+        def fake_get_nw_info(self, context, instance):
+            calls.append(instance['id'])
+            return network_model
+
+        _fake_stub_out_get_nw_info(self.stubs, fake_get_nw_info)
+
+        network_info = _fake_network_info(self.stubs, 1)
+        for name in ('web', 'db'):
+            secgroup = db.security_group_create(admin_ctxt,
+                                                {'user_id': 'fake',
+                                                 'project_id': 'fake',
+                                                 'name': name,
+                                                 'description': name})
+            db.security_group_rule_create(admin_ctxt,
+                                          {'parent_group_id': secgroup['id'],
+                                           'group_id': src_secgroup['id']})
+            instance_ref = self._create_instance_ref()
+            db.instance_add_security_group(admin_ctxt, instance_ref['uuid'],
+                                           secgroup['id'])
+            self.fw.prepare_instance_filter(instance_ref, network_info)
+
+        del calls[:]
+        self.fw.refresh_security_group_members(src_secgroup['id'])
+        self.assertEqual(calls, [src_instance_ref['id']])
+        for security_group_id in self.fw.security_group_grantees:
+            self.assertTrue(self._sg_chain_rules(security_group_id))
 
     @test.skip_if(missing_libvirt(), "Test requires libvirt")
     def test_unfilter_instance_undefines_nwfilter(self):
@@ -0,0 +1,92 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for the in process memcache client.
+"""
+
+from nova.common import memorycache
+from nova.openstack.common import timeutils
+from nova import test
+
+
+class MemoryCacheTestCase(test.TestCase):
+    def setUp(self):
+        super(MemoryCacheTestCase, self).setUp()
+        timeutils.set_time_override()
+        self.client = memorycache.Client()
+
+    def tearDown(self):
+        timeutils.clear_time_override()
+        super(MemoryCacheTestCase, self).tearDown()
+
+    def test_get_set_incr(self):
+        self.assertEqual(self.client.get('key'), None)
+        self.assertEqual(self.client.incr('key'), None)
+        self.assertTrue(self.client.add('key', '1'))
+        self.assertFalse(self.client.add('key', '5'))
+        self.assertEqual(self.client.incr('key', 2), 3)
+        self.assertEqual(self.client.get('key'), '3')
+        self.client.delete('key')
+        self.assertEqual(self.client.get('key'), None)
+
+        stats = self.client.get_stats()[0][1]
+        self.assertEqual(stats['get_hits'], 1)
+        self.assertEqual(stats['get_misses'], 2)
+
+    def test_entries_expire(self):
+        self.client.set('short', 'value', time=10)
+        self.client.set('long', 'value', time=20)
+        self.client.set('forever', 'value')
+
+        timeutils.advance_time_seconds(10)
+        self.assertEqual(self.client.get('short'), None)
+        self.assertEqual(self.client.get('long'), 'value')
+        self.assertTrue(self.client.add('short', 'again'))
+
+        timeutils.advance_time_seconds(10)
+        self.assertEqual(self.client.get('long'), None)
+        self.assertEqual(self.client.get('forever'), 'value')
+        self.assertEqual(self.client.get_stats()[0][1]['expirations'], 2)
+
+    def test_least_recently_used_evicted(self):
+        self.flags(memorycache_max_entries=3)
+        for key in ('a', 'b', 'c'):
+            self.client.set(key, key)
+        self.client.get('a')
+        self.client.set('d', 'd')
+        self.client.set('b', 'b')
+
+        self.assertEqual(sorted(self.client.cache), ['a', 'b', 'd'])
+        stats = self.client.get_stats()[0][1]
+        self.assertEqual(stats['evictions'], 2)
+        self.assertEqual(stats['curr_items'], 3)
+
+    def test_flush_all(self):
+        self.flags(memorycache_max_entries=2)
+        self.client.set('a', 'a')
+        self.client.set('b', 'b')
+        self.client.get('a')
+        self.client.flush_all()
+
+        self.assertEqual(self.client.get('a'), None)
+        self.client.set('c', 'c')
+        self.client.set('d', 'd')
+        self.client.set('e', 'e')
+        self.assertEqual(sorted(self.client.cache), ['d', 'e'])
+        stats = self.client.get_stats()[0][1]
+        self.assertEqual(stats['get_hits'], 0)
+        self.assertEqual(stats['evictions'], 1)
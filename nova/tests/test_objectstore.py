@@ -128,6 +128,34 @@ class S3APITestCase(test.TestCase):
 
         self._ensure_no_buckets(bucket.get_all_keys())
 
+    def test_get_key_range(self):
+        """Test that Range requests return only the requested bytes."""
+        bucket = self.conn.create_bucket('testbucket')
+        key = bucket.new_key('somekey')
+        key.set_contents_from_string('0123456789')
+
+        key = bucket.get_key('somekey')
+        self.assertEquals(key.size, 10)
+        self.assertEquals(key.get_contents_as_string(
+                              headers={'Range': 'bytes=2-4'}), '234')
+
+    def test_list_keys_paginated(self):
+        """Test that listings are truncated at max-keys."""
+        bucket = self.conn.create_bucket('testbucket')
+        for key_name in ('a', 'b', 'c'):
+            bucket.new_key(key_name).set_contents_from_string(key_name)
+
+        keys = bucket.get_all_keys(max_keys=2)
+        self.assertEquals([key.name for key in keys], ['a', 'b'])
+        self.assertTrue(keys.is_truncated)
+        keys = bucket.get_all_keys(max_keys=2, marker='b')
+        self.assertEquals([key.name for key in keys], ['c'])
+        self.assertFalse(keys.is_truncated)
+
+        bucket.get_key('b').delete()
+        self.assertEquals([key.name for key in bucket.get_all_keys()],
+                          ['a', 'c'])
+
     def test_unknown_bucket(self):
         bucket_name = 'falalala'
         self.assertRaises(boto_exception.S3ResponseError,
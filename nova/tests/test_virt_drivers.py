@@ -202,6 +202,13 @@ class _VirtDriverTestCase(_FakeDriverBackendTestCase):
     def test_list_instances_detail(self):
         self.connection.list_instances_detail()
 
+    @catch_notimplementederror
+    def test_get_power_states(self):
+        instance_ref, network_info = self._get_running_instance()
+        power_states = self.connection.get_power_states()
+        self.assertEqual(power_states[instance_ref['name']],
+                         self.connection.get_info(instance_ref)['state'])
+
     @catch_notimplementederror
     def test_spawn(self):
         instance_ref, network_info = self._get_running_instance()
@@ -36,6 +36,7 @@ import nova.policy
 from nova import quota
 from nova import test
 import nova.volume.api
+from nova.volume import driver
 
 QUOTAS = quota.QUOTAS
 FLAGS = flags.FLAGS
@@ -472,6 +473,70 @@ class VolumeDriverTestCase(DriverTestCase):
         self.output = 'x'
         self.volume.driver.delete_volume({'name': 'test1', 'size': 1024})
 
+    def _fake_lvm(self, outputs):
+        """Record the commands run and return outputs[command] for them."""
+        commands = []
+
+        def _fake_execute(*cmd, **kwargs):
+            commands.append(cmd)
+            return outputs.get(cmd[0], ''), None
+        self.volume.driver.set_execute(_fake_execute)
+        return commands
+
+    def test_delete_volume_lazily(self):
+        """Deleted volumes are renamed into the scrub queue."""
+        self.flags(volume_clear_lazily=True)
+        commands = self._fake_lvm({})
+        self.stubs.Set(self.volume.driver, '_start_scrubber',
+                       lambda: commands.append(('start_scrubber',)))
+
+        self.volume.driver._delete_volume({'name': 'volume-1'}, 2)
+        self.assertEqual(commands,
+                         [('lvrename', FLAGS.volume_group, 'volume-1',
+                           'scrub-volume-1'),
+                          ('start_scrubber',)])
+
+    def test_delete_snapshot_wipes_cow_store(self):
+        """Snapshots are wiped right away, through their cow device."""
+        self.flags(volume_clear_lazily=True, volume_clear_bandwidth=0)
+        commands = self._fake_lvm({})
+
+        self.volume.driver._delete_volume({'name': 'snapshot-1'}, 1,
+                                          is_snapshot=True)
+        self.assertEqual(commands[0][:3],
+                         ('dd', 'if=/dev/zero', 'of=%s-cow' %
+                          self.volume.driver.local_path(
+                              {'name': 'snapshot-1'})))
+        self.assertTrue('count=1024' in commands[0])
+        self.assertEqual(commands[1], ('lvremove', '-f', '%s/_snapshot-1' %
+                                       FLAGS.volume_group))
+
+    def test_scrub_deleted_volumes(self):
+        """The queue is zeroed in throttled chunks, then removed."""
+        self.flags(volume_clear_bandwidth=1024)
+        self.stubs.Set(driver.greenthread, 'sleep', lambda seconds: None)
+        outputs = {'lvs': '  scrub-volume-1 2048.00\n  volume-2 1024.00\n'}
+        commands = self._fake_lvm(outputs)
+
+        def _fake_lvremove(*cmd, **kwargs):
+            commands.append(cmd)
+            outputs['lvs'] = '  volume-2 1024.00\n'
+        self.stubs.Set(self.volume.driver, '_try_execute', _fake_lvremove)
+
+        self.volume.driver._start_scrubber()
+        self.volume.driver._scrubber.wait()
+
+        path = self.volume.driver.local_path({'name': 'scrub-volume-1'})
+        dds = [cmd for cmd in commands if cmd[0] == 'dd']
+        self.assertEqual([cmd[2:6] for cmd in dds],
+                         [('of=%s' % path, 'bs=1M', 'seek=0', 'count=1024'),
+                          ('of=%s' % path, 'bs=1M', 'seek=1024',
+                           'count=1024')])
+        self.assertTrue(('lvremove', '-f',
+                         '%s/scrub-volume-1' % FLAGS.volume_group)
+                        in commands)
+        self.assertEqual(self.volume.driver._scrubber, None)
+
 
 class ISCSITestCase(DriverTestCase):
     """Test Case for ISCSIDriver"""
@@ -540,6 +605,45 @@ class ISCSITestCase(DriverTestCase):
 
         self._detach_volume(volume_id_list)
 
+    def test_ensure_exports_only_missing(self):
+        """Only volumes missing from the target daemon are re-exported."""
+        volume_id_list = self._attach_volume()
+        volumes = [db.volume_get(self.context, volume_id)
+                   for volume_id in volume_id_list]
+
+        # The first volume is fully exported, the second lacks its
+        # logical unit and the third its target.
+        lines = []
+        for volume in volumes[:2]:
+            tid = db.volume_get_iscsi_target_num(self.context, volume['id'])
+            lines.append("Target %d: %s%s" % (tid, FLAGS.iscsi_target_prefix,
+                                              volume['name']))
+        lines.insert(1, "            Backing store path: /dev/%s/%s" %
+                     (FLAGS.volume_group, volumes[0]['name']))
+        self.output = "\n".join(lines)
+
+        exported = []
+        self.stubs.Set(self.volume.driver, 'ensure_export',
+                       lambda context, volume: exported.append(volume['id']))
+        self.volume.driver.ensure_exports(self.context, volumes)
+        self.assertEqual(sorted(exported), sorted(volume_id_list[1:]))
+
+        self._detach_volume(volume_id_list)
+
+    def test_get_volume_stats(self):
+        """Volumes waiting to be wiped are reported with the capacity."""
+        outputs = {'vgs': '  100.00 40.00\n',
+                   'lvs': '  scrub-volume-1 2048.00\n  volume-2 1024.00\n'}
+        self.volume.driver.set_execute(
+                lambda *cmd, **kwargs: (outputs[cmd[0]], None))
+
+        stats = self.volume.driver.get_volume_stats(refresh=True)
+        self.assertEqual(stats, {'storage_protocol': 'iSCSI',
+                                 'total_capacity_gb': 100.0,
+                                 'free_capacity_gb': 40.0,
+                                 'scrubbing_capacity_gb': 2.0,
+                                 'scrubbing_volumes': 1})
+
 
 class VolumePolicyTestCase(test.TestCase):
 
@@ -21,6 +21,8 @@ import contextlib
 import functools
 import os
 import re
+import shutil
+import tempfile
 
 from nova.compute import aggregate_states
 from nova.compute import instance_types
@@ -1614,7 +1616,7 @@ class XenAPIDom0IptablesFirewallTestCase(test.TestCase):
                                        'to_port': 299,
                                        'cidr': '192.168.99.0/24'})
         #validate the extra rule
-        self.fw.refresh_security_group_rules(secgroup)
+        self.fw.refresh_security_group_rules(secgroup['id'])
         regex = re.compile('-A .* -j ACCEPT -p udp --dport 200:299'
                            ' -s 192.168.99.0/24')
         self.assertTrue(len(filter(regex.match, self._out_rules)) > 0,
@@ -1733,6 +1735,54 @@ class XenAPISRSelectionTestCase(test.TestCase):
                          expected)
 
 
+class XenAPISparseCopyTestCase(test.TestCase):
+    """Unit tests for sparse_copy."""
+    def setUp(self):
+        super(XenAPISparseCopyTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.src_path = os.path.join(self.tmpdir, 'src')
+        self.dst_path = os.path.join(self.tmpdir, 'dst')
+        # NOTE: sparse_copy takes ownership of an existing destination.
+        open(self.dst_path, 'wb').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(XenAPISparseCopyTestCase, self).tearDown()
+
+    def _make_src(self, size, chunks):
+        with open(self.src_path, 'wb') as src:
+            src.truncate(size)
+            for offset, data in chunks:
+                src.seek(offset)
+                src.write(data)
+
+    def _check_copy(self, size, block_size):
+        vm_utils._sparse_copy(self.src_path, self.dst_path, size,
+                              block_size=block_size)
+        with open(self.src_path, 'rb') as src:
+            with open(self.dst_path, 'rb') as dst:
+                self.assertEqual(src.read(), dst.read())
+
+    def test_sparse_copy_data_and_holes(self):
+        size = 4 * 1024 * 1024
+        self._make_src(size, [(0, 'a' * 100),
+                              (1024 * 1024 - 10, 'b' * 20),
+                              (3 * 1024 * 1024 + 7, 'c' * 200000)])
+        self._check_copy(size, 1024 * 1024)
+
+    def test_sparse_copy_skips_zeros(self):
+        size = 2 * 1024 * 1024
+        self._make_src(size, [(0, '\0' * size), (size - 1, 'd')])
+        self._check_copy(size, 256 * 1024)
+        self.assertTrue(os.stat(self.dst_path).st_blocks * 512 < size / 2)
+
+    def test_sparse_copy_trailing_hole(self):
+        size = 1024 * 1024
+        self._make_src(size, [(10, 'e' * 10)])
+        self._check_copy(size, 4096)
+        self.assertEqual(os.path.getsize(self.dst_path), size)
+
+
 class XenAPIAggregateTestCase(test.TestCase):
     """Unit tests for aggregate operations."""
     def setUp(self):
@@ -161,6 +161,18 @@ class ComputeDriver(object):
         # TODO(Vek): Need to pass context in for access to auth_token
         raise NotImplementedError()
 
+    def get_power_states(self):
+        """Return the power states of all the instances known to the
+        virtualization layer, as a dict of instance name to power state.
+
+        This is used to sync the power states of all instances on a host
+        without calling get_info() for each of them.  This implementation
+        works for all drivers implementing list_instances_detail(), which
+        should get all instances in a single call to the hypervisor.
+        """
+        return dict((info.name, info.state)
+                    for info in self.list_instances_detail())
+
     def spawn(self, context, instance, image_meta,
               network_info=None, block_device_info=None):
         """
@@ -478,6 +490,15 @@ class ComputeDriver(object):
         # TODO(Vek): Need to pass context in for access to auth_token
         raise NotImplementedError()
 
+    def filter_defer_apply_on(self):
+        """Defer application of firewall rules until
+        filter_defer_apply_off() is called."""
+        pass
+
+    def filter_defer_apply_off(self):
+        """Stop deferring firewall rules and apply them now."""
+        pass
+
     def unfilter_instance(self, instance, network_info):
         """Stop filtering instance"""
         # TODO(Vek): Need to pass context in for access to auth_token
@@ -622,6 +643,15 @@ class ComputeDriver(object):
         the cache and remove images which are no longer of interest.
         """
 
+    def prefetch_images(self, context, image_ids):
+        """Fetch images into the driver's local image cache.
+
+        This lets a host have the images instances are about to be spawned
+        from cached beforehand, rather than downloading them on the first
+        spawn.
+        """
+        raise NotImplementedError()
+
     def add_to_aggregate(self, context, aggregate, host, **kwargs):
         """Add a compute host to an aggregate."""
         raise NotImplementedError()
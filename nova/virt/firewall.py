@@ -19,6 +19,7 @@
 
 from nova import context
 from nova import db
+from nova import exception
 from nova import flags
 from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
@@ -97,6 +98,15 @@ class FirewallDriver(object):
         """Check nova-instance-instance-xxx exists"""
         raise NotImplementedError()
 
+    def filter_defer_apply_on(self):
+        """Defer application of rules until filter_defer_apply_off()
+        is called, so that many changes are applied at once."""
+        pass
+
+    def filter_defer_apply_off(self):
+        """Stop deferring rules and apply them now."""
+        pass
+
     def _handle_network_info_model(self, network_info):
         # make sure this is legacy network_info
         try:
@@ -116,6 +126,14 @@ class IptablesFirewallDriver(FirewallDriver):
         self.network_infos = {}
         self.basicly_filtered = False
 
+        # NOTE: the rules of each security group in use on this host are
+        # compiled once into a chain shared by its instances. They are kept
+        # here by security group id and ip version, along with the ids of
+        # the groups they grant access to.
+        self.instance_security_groups = {}
+        self.security_group_rules = {}
+        self.security_group_grantees = {}
+
         self.iptables.ipv4['filter'].add_chain('sg-fallback')
         self.iptables.ipv4['filter'].add_rule('sg-fallback', '-j DROP')
         self.iptables.ipv6['filter'].add_chain('sg-fallback')
@@ -124,6 +142,12 @@ class IptablesFirewallDriver(FirewallDriver):
     def setup_basic_filtering(self, instance, network_info):
         pass
 
+    def filter_defer_apply_on(self):
+        self.iptables.defer_apply_on()
+
+    def filter_defer_apply_off(self):
+        self.iptables.defer_apply_off()
+
     def apply_instance_filter(self, instance, network_info):
         """No-op. Everything is done in prepare_instance_filter."""
         pass
@@ -192,7 +216,20 @@ class IptablesFirewallDriver(FirewallDriver):
         ipv4_rules, ipv6_rules = self._filters_for_instance(chain_name,
                                                             network_info)
         self._add_filters('local', ipv4_rules, ipv6_rules)
-        ipv4_rules, ipv6_rules = self.instance_rules(instance, network_info)
+
+        ctxt = context.get_admin_context()
+        security_groups = db.security_group_get_by_instance(ctxt,
+                                                            instance['id'])
+        security_group_ids = [group['id'] for group in security_groups]
+        member_ips = {}
+        for security_group_id in security_group_ids:
+            if not self._security_group_in_use(security_group_id):
+                self._add_security_group_chain(ctxt, security_group_id,
+                                               member_ips)
+        self.instance_security_groups[instance['id']] = security_group_ids
+
+        ipv4_rules, ipv6_rules = self.instance_rules(instance, network_info,
+                                                     security_groups)
         self._add_filters(chain_name, ipv4_rules, ipv6_rules)
 
     def remove_filters_for_instance(self, instance):
@@ -202,9 +239,59 @@ class IptablesFirewallDriver(FirewallDriver):
         if FLAGS.use_ipv6:
             self.iptables.ipv6['filter'].remove_chain(chain_name)
 
+        security_group_ids = self.instance_security_groups.pop(
+                instance['id'], [])
+        for security_group_id in security_group_ids:
+            if not self._security_group_in_use(security_group_id):
+                self._remove_security_group_chain(security_group_id)
+
+    def _security_group_in_use(self, security_group_id):
+        return any(security_group_id in security_group_ids
+                   for security_group_ids
+                   in self.instance_security_groups.itervalues())
+
+    def _add_security_group_chain(self, ctxt, security_group_id,
+                                  member_ips):
+        chain_name = self._security_group_chain_name(security_group_id)
+        self.iptables.ipv4['filter'].add_chain(chain_name)
+        if FLAGS.use_ipv6:
+            self.iptables.ipv6['filter'].add_chain(chain_name)
+        self._update_security_group_chain(ctxt, security_group_id,
+                                          member_ips)
+
+    def _update_security_group_chain(self, ctxt, security_group_id,
+                                     member_ips):
+        """Compiles the rules of a security group, and rewrites its chain
+        if they changed."""
+        ipv4_rules, ipv6_rules, grantees = self.security_group_rules_for(
+                ctxt, security_group_id, member_ips)
+        self.security_group_grantees[security_group_id] = grantees
+        if (self.security_group_rules.get((security_group_id, 4)) ==
+                ipv4_rules and
+            self.security_group_rules.get((security_group_id, 6)) ==
+                ipv6_rules):
+            return
+
+        chain_name = self._security_group_chain_name(security_group_id)
+        self.iptables.ipv4['filter'].empty_chain(chain_name)
+        if FLAGS.use_ipv6:
+            self.iptables.ipv6['filter'].empty_chain(chain_name)
+        self._add_filters(chain_name, ipv4_rules, ipv6_rules)
+        self.security_group_rules[(security_group_id, 4)] = ipv4_rules
+        self.security_group_rules[(security_group_id, 6)] = ipv6_rules
+
+    def _remove_security_group_chain(self, security_group_id):
+        chain_name = self._security_group_chain_name(security_group_id)
+        self.iptables.ipv4['filter'].remove_chain(chain_name)
+        if FLAGS.use_ipv6:
+            self.iptables.ipv6['filter'].remove_chain(chain_name)
+        self.security_group_rules.pop((security_group_id, 4), None)
+        self.security_group_rules.pop((security_group_id, 6), None)
+        self.security_group_grantees.pop(security_group_id, None)
+
     @staticmethod
     def _security_group_chain_name(security_group_id):
-        return 'nova-sg-%s' % (security_group_id,)
+        return 'sg-%s' % (security_group_id,)
 
     def _instance_chain_name(self, instance):
         return 'inst-%s' % (instance['id'],)
@@ -284,7 +371,7 @@ class IptablesFirewallDriver(FirewallDriver):
                     '--dports', '%s:%s' % (rule.from_port,
                                            rule.to_port)]
 
-    def instance_rules(self, instance, network_info):
+    def instance_rules(self, instance, network_info, security_groups=None):
         # make sure this is legacy nw_info
         network_info = self._handle_network_info_model(network_info)
 
@@ -309,82 +396,114 @@ class IptablesFirewallDriver(FirewallDriver):
             # Allow RA responses
             self._do_ra_rules(ipv6_rules, network_info)
 
-        security_groups = db.security_group_get_by_instance(ctxt,
-                                                            instance['id'])
+        if security_groups is None:
+            security_groups = db.security_group_get_by_instance(
+                    ctxt, instance['id'])
 
-        # then, security group chains and rules
+        # then, jumps to the security group chains
         for security_group in security_groups:
-            rules = db.security_group_rule_get_by_security_group(ctxt,
-                                                          security_group['id'])
+            chain_name = self._security_group_chain_name(
+                    security_group['id'])
+            ipv4_rules += ['-j $%s' % (chain_name,)]
+            ipv6_rules += ['-j $%s' % (chain_name,)]
 
-            for rule in rules:
-                LOG.debug(_('Adding security group rule: %r'), rule,
-                          instance=instance)
+        ipv4_rules += ['-j $sg-fallback']
+        ipv6_rules += ['-j $sg-fallback']
 
-                if not rule.cidr:
-                    version = 4
-                else:
-                    version = netutils.get_ip_version(rule.cidr)
+        return ipv4_rules, ipv6_rules
 
-                if version == 4:
-                    fw_rules = ipv4_rules
-                else:
-                    fw_rules = ipv6_rules
+    def security_group_rules_for(self, ctxt, security_group_id,
+                                 member_ips=None):
+        """Compiles the rules of a security group.
 
-                protocol = rule.protocol
+        :param member_ips: dict used to share the lookups of the ips of
+                           the members of granted groups between calls
+        :returns: ipv4 rules, ipv6 rules and the set of ids of the groups
+                  the rules grant access to
+        """
+        if member_ips is None:
+            member_ips = {}
 
-                if protocol:
-                    protocol = rule.protocol.lower()
+        ipv4_rules = []
+        ipv6_rules = []
+        grantees = set()
 
-                if version == 6 and protocol == 'icmp':
-                    protocol = 'icmpv6'
+        rules = db.security_group_rule_get_by_security_group(ctxt,
+                                                             security_group_id)
+        for rule in rules:
+            LOG.debug(_('Adding security group rule: %r'), rule)
 
-                args = ['-j ACCEPT']
-                if protocol:
-                    args += ['-p', protocol]
+            if not rule.cidr:
+                version = 4
+            else:
+                version = netutils.get_ip_version(rule.cidr)
 
-                if protocol in ['udp', 'tcp']:
-                    args += self._build_tcp_udp_rule(rule, version)
-                elif protocol == 'icmp':
-                    args += self._build_icmp_rule(rule, version)
-                if rule.cidr:
-                    LOG.debug('Using cidr %r', rule.cidr, instance=instance)
-                    args += ['-s', rule.cidr]
-                    fw_rules += [' '.join(args)]
-                else:
-                    if rule['grantee_group']:
-                        # FIXME(jkoelker) This needs to be ported up into
-                        #                 the compute manager which already
-                        #                 has access to a nw_api handle,
-                        #                 and should be the only one making
-                        #                 making rpc calls.
-                        import nova.network
-                        nw_api = nova.network.API()
-                        for instance in rule['grantee_group']['instances']:
-                            nw_info = nw_api.get_instance_nw_info(ctxt,
-                                                                  instance)
-
-                            ips = [ip['address']
-                                for ip in nw_info.fixed_ips()
-                                    if ip['version'] == version]
-
-                            LOG.debug('ips: %r', ips, instance=instance)
-                            for ip in ips:
-                                subrule = args + ['-s %s' % ip]
-                                fw_rules += [' '.join(subrule)]
-
-                LOG.debug('Using fw_rules: %r', fw_rules, instance=instance)
+            if version == 4:
+                fw_rules = ipv4_rules
+            else:
+                fw_rules = ipv6_rules
 
-        ipv4_rules += ['-j $sg-fallback']
-        ipv6_rules += ['-j $sg-fallback']
+            protocol = rule.protocol
 
-        return ipv4_rules, ipv6_rules
+            if protocol:
+                protocol = rule.protocol.lower()
+
+            if version == 6 and protocol == 'icmp':
+                protocol = 'icmpv6'
+
+            args = ['-j ACCEPT']
+            if protocol:
+                args += ['-p', protocol]
+
+            if protocol in ['udp', 'tcp']:
+                args += self._build_tcp_udp_rule(rule, version)
+            elif protocol == 'icmp':
+                args += self._build_icmp_rule(rule, version)
+            if rule.cidr:
+                LOG.debug('Using cidr %r', rule.cidr)
+                args += ['-s', rule.cidr]
+                fw_rules += [' '.join(args)]
+            else:
+                if rule['grantee_group']:
+                    grantees.add(rule['grantee_group']['id'])
+                    ips = self._security_group_member_ips(
+                            ctxt, rule['grantee_group'], member_ips)
+                    ips = ips.get(version, [])
+
+                    LOG.debug('ips: %r', ips)
+                    for ip in ips:
+                        subrule = args + ['-s %s' % ip]
+                        fw_rules += [' '.join(subrule)]
+
+            LOG.debug('Using fw_rules: %r', fw_rules)
+
+        return ipv4_rules, ipv6_rules, grantees
+
+    def _security_group_member_ips(self, ctxt, security_group, member_ips):
+        """Returns the fixed ips of the members of a security group by ip
+        version, looking up each member once per member_ips dict."""
+        # FIXME(jkoelker) This needs to be ported up into
+        #                 the compute manager which already
+        #                 has access to a nw_api handle,
+        #                 and should be the only one making
+        #                 making rpc calls.
+        import nova.network
+        nw_api = nova.network.API()
+        ips = {}
+        for instance in security_group['instances']:
+            if instance['id'] not in member_ips:
+                nw_info = nw_api.get_instance_nw_info(ctxt, instance)
+                member_ips[instance['id']] = [(ip['version'], ip['address'])
+                                              for ip in nw_info.fixed_ips()]
+            for version, address in member_ips[instance['id']]:
+                ips.setdefault(version, []).append(address)
+        return ips
 
     def instance_filter_exists(self, instance, network_info):
         pass
 
     def refresh_security_group_members(self, security_group):
-        self.do_refresh_security_group_rules(security_group)
+        self.do_refresh_security_group_members(security_group)
         self.iptables.apply()
 
     def refresh_security_group_rules(self, security_group):
@@ -392,10 +511,39 @@ class IptablesFirewallDriver(FirewallDriver):
         self.iptables.apply()
 
     @utils.synchronized('iptables', external=True)
-    def do_refresh_security_group_rules(self, security_group):
-        for instance in self.instances.values():
-            self.remove_filters_for_instance(instance)
-            self.add_filters_for_instance(instance)
+    def do_refresh_security_group_rules(self, security_group_id):
+        """Recompiles the chain of a security group, and refilters the
+        instances of this host which joined or left it."""
+        ctxt = context.get_admin_context()
+        if self._security_group_in_use(security_group_id):
+            self._update_security_group_chain(ctxt, security_group_id, {})
+
+        try:
+            security_group = db.security_group_get(ctxt, security_group_id)
+            member_ids = set(instance['id']
+                             for instance in security_group['instances'])
+        except exception.SecurityGroupNotFound:
+            member_ids = set()
+        for instance_id, instance in self.instances.items():
+            was_member = security_group_id in \
+                    self.instance_security_groups.get(instance_id, [])
+            if was_member != (instance_id in member_ids):
+                self.remove_filters_for_instance(instance)
+                self.add_filters_for_instance(instance)
+
+    @utils.synchronized('iptables', external=True)
+    def do_refresh_security_group_members(self, security_group_id):
+        """Recompiles the chains of the security groups which grant access
+        to the members of other groups."""
+        # NOTE: the compute API only names one of the groups whose members
+        # changed, so all the granting groups are recompiled. Only the
+        # chains whose rules changed are rewritten, and the ips of the
+        # members of each granted group are looked up once.
+        ctxt = context.get_admin_context()
+        member_ips = {}
+        for group_id, grantees in self.security_group_grantees.items():
+            if grantees:
+                self._update_security_group_chain(ctxt, group_id, member_ips)
 
     def refresh_provider_fw_rules(self):
         """See :class:`FirewallDriver` docs."""
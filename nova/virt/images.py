@@ -22,6 +22,9 @@ Handling of VM disk images.
 """
 
 import os
+import time
+
+from eventlet import greenthread
 
 from nova import exception
 from nova import flags
@@ -37,12 +40,53 @@ image_opts = [
     cfg.BoolOpt('force_raw_images',
                 default=True,
                 help='Force backing images to raw format'),
+    cfg.IntOpt('image_download_bandwidth',
+               default=0,
+               help='Maximum rate in MB/s at which each image is downloaded '
+                    'from the image service, 0 for no limit'),
 ]
 
 FLAGS = flags.FLAGS
 FLAGS.register_opts(image_opts)
 
 
+class ImageDownloadWriter(object):
+    """Writes the data of an image being downloaded to a file.
+
+    The download is held to image_download_bandwidth and its progress is
+    logged every 100 MB.
+
+    """
+
+    def __init__(self, image_file, image_href):
+        self.image_file = image_file
+        self.image_href = image_href
+        self.written = 0
+        self.reported = 0
+        self.start = time.time()
+
+    def write(self, data):
+        self.image_file.write(data)
+        self.written += len(data)
+
+        if FLAGS.image_download_bandwidth:
+            # Sleep off whatever is left of the time the data written so
+            # far should take at that rate.
+            rate = FLAGS.image_download_bandwidth * 1024 * 1024.0
+            delay = self.start + self.written / rate - time.time()
+            if delay > 0:
+                greenthread.sleep(delay)
+
+        megabytes = self.written / (1024 * 1024) / 100 * 100
+        if megabytes > self.reported:
+            self.reported = megabytes
+            LOG.debug(_("Downloaded %(megabytes)d MB of image "
+                        "%(image_href)s in %(duration).1f secs"),
+                      {'megabytes': megabytes,
+                       'image_href': self.image_href,
+                       'duration': time.time() - self.start})
+
+
 def fetch(context, image_href, path, _user_id, _project_id):
     # TODO(vish): Improve context handling and add owner and auth data
     #             when it is added to glance.  Right now there is no
@@ -52,7 +96,8 @@ def fetch(context, image_href, path, _user_id, _project_id):
                                                                 image_href)
     with utils.remove_path_on_error(path):
         with open(path, "wb") as image_file:
-            image_service.download(context, image_id, image_file)
+            writer = ImageDownloadWriter(image_file, image_href)
+            image_service.download(context, image_id, writer)
 
 
 def fetch_to_raw(context, image_href, path, user_id, project_id):
@@ -46,8 +46,10 @@ import multiprocessing
 import os
 import shutil
 import sys
+import time
 import uuid
 
+from eventlet import greenpool
 from eventlet import greenthread
 from eventlet import tpool
 from lxml import etree
@@ -176,11 +178,16 @@ libvirt_opts = [
                help='Set to a named libvirt CPU model (see names listed '
                     'in /usr/share/libvirt/cpu_map.xml). Only has effect if '
                     'libvirt_cpu_mode="custom" and libvirt_type="kvm|qemu"'),
+    cfg.IntOpt('image_prefetch_concurrency',
+               default=2,
+               help='Number of images fetched at once into the image cache '
+                    'when prefetching images'),
     ]
 
 FLAGS = flags.FLAGS
 FLAGS.register_opts(libvirt_opts)
 
+flags.DECLARE('base_dir_name', 'nova.compute.manager')
 flags.DECLARE('live_migration_retry_count', 'nova.compute.manager')
 flags.DECLARE('vncserver_proxyclient_address', 'nova.vnc')
 
@@ -285,6 +292,15 @@ class LibvirtDriver(driver.ComputeDriver):
 
         self._disk_cachemode = None
         self.image_cache_manager = imagecache.ImageCacheManager()
+
+        # Facts update_available_resource() reports the resources of the
+        # host from, kept until the domain or file they describe changes:
+        # domain id -> (name, vcpus), name -> [(path, disk format)] of its
+        # file disks and path -> (mtime, size, virtual size, backing file)
+        # of the qcow2 disks.
+        self._domain_vcpus = {}
+        self._domain_disks = {}
+        self._disk_file_info = {}
         self.image_backend = imagebackend.Backend(FLAGS.use_cow_images)
 
     @property
@@ -401,6 +417,14 @@ class LibvirtDriver(driver.ComputeDriver):
                 for x in self.list_instance_ids()
                 if x != 0]  # We skip domains with ID 0 (hypervisors).
 
+    def _invalidate_resource_cache(self, instance_name):
+        """Forgets the cached vcpus and disks of a domain, for when it is
+        created, destroyed or has its disks changed."""
+        self._domain_disks.pop(instance_name, None)
+        for dom_id, (name, _vcpus) in self._domain_vcpus.items():
+            if name == instance_name:
+                del self._domain_vcpus[dom_id]
+
     @staticmethod
     def _map_to_instance_info(domain):
         """Gets info from a virsh domain object into an InstanceInfo"""
@@ -427,6 +451,25 @@ class LibvirtDriver(driver.ComputeDriver):
             infos.append(info)
         return infos
 
+    def get_power_states(self):
+        power_states = {}
+        for domain_id in self.list_instance_ids():
+            if domain_id == 0:
+                # We skip domains with ID 0 (hypervisors).
+                continue
+            info = self._map_to_instance_info(self._conn.lookupByID(domain_id))
+            power_states[info.name] = info.state
+        # NOTE: domains that are defined but not running, like stopped
+        # instances, have no ID.
+        for name in self._conn.listDefinedDomains():
+            try:
+                domain = self._lookup_by_name(name)
+            except exception.InstanceNotFound:
+                # Undefined since we listed it
+                continue
+            power_states[name] = self._map_to_instance_info(domain).state
+        return power_states
+
     def plug_vifs(self, instance, network_info):
         """Plug VIFs into networks."""
         for (network, mapping) in network_info:
@@ -488,6 +531,7 @@ class LibvirtDriver(driver.ComputeDriver):
         self._cleanup(instance, network_info, block_device_info)
 
     def _cleanup(self, instance, network_info, block_device_info):
+        self._invalidate_resource_cache(instance['name'])
         try:
             virt_dom = self._lookup_by_name(instance['name'])
         except exception.NotFound:
@@ -628,6 +672,7 @@ class LibvirtDriver(driver.ComputeDriver):
         # attachDevice()
         domxml = virt_dom.XMLDesc(libvirt.VIR_DOMAIN_XML_SECURE)
         self._conn.defineXML(domxml)
+        self._invalidate_resource_cache(instance_name)
 
     @staticmethod
     def _get_disk_xml(xml, device):
@@ -669,6 +714,7 @@ class LibvirtDriver(driver.ComputeDriver):
         # detachDevice()
         domxml = virt_dom.XMLDesc(libvirt.VIR_DOMAIN_XML_SECURE)
         self._conn.defineXML(domxml)
+        self._invalidate_resource_cache(instance_name)
 
     @exception.wrap_exception()
     def _attach_lxc_volume(self, xml, virt_dom, instance_name):
@@ -1814,6 +1860,7 @@ class LibvirtDriver(driver.ComputeDriver):
         if xml:
             domain = self._conn.defineXML(xml)
         domain.createWithFlags(launch_flags)
+        self._invalidate_resource_cache(domain.name())
         return domain
 
     def _create_domain_and_network(self, xml, instance, network_info):
@@ -1945,15 +1992,22 @@ class LibvirtDriver(driver.ComputeDriver):
         """
 
         total = 0
-        for dom_id in self.list_instance_ids():
-            dom = self._conn.lookupByID(dom_id)
-            vcpus = dom.vcpus()
-            if vcpus is None:
-                # dom.vcpus is not implemented for lxc, but returning 0 for
-                # a used count is hardly useful for something measuring usage
-                total += 1
-            else:
-                total += len(vcpus[1])
+        dom_ids = self.list_instance_ids()
+        for dom_id in set(self._domain_vcpus) - set(dom_ids):
+            del self._domain_vcpus[dom_id]
+        for dom_id in dom_ids:
+            if dom_id not in self._domain_vcpus:
+                dom = self._conn.lookupByID(dom_id)
+                vcpus = dom.vcpus()
+                if vcpus is None:
+                    # dom.vcpus is not implemented for lxc, but returning 0
+                    # for a used count is hardly useful for something
+                    # measuring usage
+                    count = 1
+                else:
+                    count = len(vcpus[1])
+                self._domain_vcpus[dom_id] = (dom.name(), count)
+            total += self._domain_vcpus[dom_id][1]
         return total
 
     def get_memory_mb_used(self):
@@ -2129,18 +2183,31 @@ class LibvirtDriver(driver.ComputeDriver):
             raise exception.ComputeServiceUnavailable(host=host)
 
         # Updating host information
-        dic = {'vcpus': self.get_vcpu_total(),
-               'memory_mb': self.get_memory_mb_total(),
-               'local_gb': self.get_local_gb_total(),
-               'vcpus_used': self.get_vcpu_used(),
-               'memory_mb_used': self.get_memory_mb_used(),
-               'local_gb_used': self.get_local_gb_used(),
-               'hypervisor_type': self.get_hypervisor_type(),
-               'hypervisor_version': self.get_hypervisor_version(),
-               'hypervisor_hostname': self.get_hypervisor_hostname(),
-               'cpu_info': self.get_cpu_info(),
-               'service_id': service_ref['id'],
-               'disk_available_least': self.get_disk_available_least()}
+        dic = {'service_id': service_ref['id']}
+        timings = []
+        start = time.time()
+
+        def timed(key, func):
+            func_start = time.time()
+            dic[key] = func()
+            timings.append('%s=%.3f' % (key, time.time() - func_start))
+
+        timed('vcpus', self.get_vcpu_total)
+        timed('memory_mb', self.get_memory_mb_total)
+        timed('local_gb', self.get_local_gb_total)
+        timed('vcpus_used', self.get_vcpu_used)
+        timed('memory_mb_used', self.get_memory_mb_used)
+        timed('local_gb_used', self.get_local_gb_used)
+        timed('hypervisor_type', self.get_hypervisor_type)
+        timed('hypervisor_version', self.get_hypervisor_version)
+        timed('hypervisor_hostname', self.get_hypervisor_hostname)
+        timed('cpu_info', self.get_cpu_info)
+        timed('disk_available_least', self.get_disk_available_least)
+
+        LOG.debug(_("Gathered the resources of %(host)s in %(duration).3f "
+                    "secs (%(timings)s)") %
+                  {'host': host, 'duration': time.time() - start,
+                   'timings': ', '.join(timings)})
 
         compute_node_ref = service_ref['compute_node']
         if not compute_node_ref:
@@ -2237,6 +2304,12 @@ class LibvirtDriver(driver.ComputeDriver):
                 raise exception.NovaException(msg % instance_ref.name)
             time.sleep(1)
 
+    def filter_defer_apply_on(self):
+        self.firewall_driver.filter_defer_apply_on()
+
+    def filter_defer_apply_off(self):
+        self.firewall_driver.filter_defer_apply_off()
+
     def live_migration(self, ctxt, instance_ref, dest,
                        post_method, recover_method, block_migration=False):
         """Spawning live_migration operation for distributing high-load.
@@ -2437,6 +2510,30 @@ class LibvirtDriver(driver.ComputeDriver):
         """
         disk_info = []
 
+        for path, disk_type in self._get_instance_file_disks(instance_name):
+            # get the real disk size or
+            # raise a localized error if image is unavailable
+            dk_size = int(os.path.getsize(path))
+
+            if disk_type == "qcow2":
+                virt_size, backing_file = self._get_qcow2_info(path, dk_size)
+            else:
+                backing_file = ""
+                virt_size = 0
+
+            disk_info.append({'type': disk_type,
+                              'path': path,
+                              'virt_disk_size': virt_size,
+                              'backing_file': backing_file,
+                              'disk_size': dk_size})
+        return jsonutils.dumps(disk_info)
+
+    def _get_instance_file_disks(self, instance_name):
+        """Returns the (path, disk format) of the file disks of a domain."""
+        if instance_name in self._domain_disks:
+            return self._domain_disks[instance_name]
+
+        disks = []
         virt_dom = self._lookup_by_name(instance_name)
         xml = virt_dom.XMLDesc(0)
         doc = etree.fromstring(xml)
@@ -2453,31 +2550,35 @@ class LibvirtDriver(driver.ComputeDriver):
                           locals())
                 continue
 
-            # get the real disk size or
-            # raise a localized error if image is unavailable
-            dk_size = int(os.path.getsize(path))
+            disks.append((path, driver_nodes[cnt].get('type')))
 
-            disk_type = driver_nodes[cnt].get('type')
-            if disk_type == "qcow2":
-                out, err = utils.execute('qemu-img', 'info', path)
+        self._domain_disks[instance_name] = disks
+        return disks
 
-                # virtual size:
-                size = [i.split('(')[1].split()[0] for i in out.split('\n')
-                    if i.strip().find('virtual size') >= 0]
-                virt_size = int(size[0])
+    def _get_qcow2_info(self, path, size):
+        """Returns the virtual size and backing file of a qcow2 disk.
 
-                # backing file:(actual path:)
-                backing_file = libvirt_utils.get_disk_backing_file(path)
-            else:
-                backing_file = ""
-                virt_size = 0
+        qemu-img is only run again once the size or mtime of the disk
+        changed since the last time.
 
-            disk_info.append({'type': disk_type,
-                              'path': path,
-                              'virt_disk_size': virt_size,
-                              'backing_file': backing_file,
-                              'disk_size': dk_size})
-        return jsonutils.dumps(disk_info)
+        """
+        mtime = os.path.getmtime(path)
+        cached = self._disk_file_info.get(path)
+        if cached and cached[:2] == (mtime, size):
+            return cached[2:]
+
+        out, err = utils.execute('qemu-img', 'info', path)
+
+        # virtual size:
+        virt_size = [i.split('(')[1].split()[0] for i in out.split('\n')
+                     if i.strip().find('virtual size') >= 0]
+        virt_size = int(virt_size[0])
+
+        # backing file:(actual path:)
+        backing_file = libvirt_utils.get_disk_backing_file(path)
+
+        self._disk_file_info[path] = (mtime, size, virt_size, backing_file)
+        return virt_size, backing_file
 
     def get_disk_available_least(self):
         """Return disk available least size.
@@ -2494,6 +2595,8 @@ class LibvirtDriver(driver.ComputeDriver):
 
         # Disk size that all instance uses : virtual_size - disk_size
         instances_name = self.list_instances()
+        for i_name in set(self._domain_disks) - set(instances_name):
+            del self._domain_disks[i_name]
         instances_sz = 0
         for i_name in instances_name:
             try:
@@ -2513,6 +2616,12 @@ class LibvirtDriver(driver.ComputeDriver):
                 # Instance was deleted during the check so ignore it
                 pass
 
+        # Forget the disks that aren't used by a domain anymore
+        paths = set(path for disks in self._domain_disks.values()
+                    for path, _disk_type in disks)
+        for path in set(self._disk_file_info) - paths:
+            del self._disk_file_info[path]
+
         # Disk available least size
         available_least_size = dk_sz_gb * (1024 ** 3) - instances_sz
         return (available_least_size / 1024 / 1024 / 1024)
@@ -2553,6 +2662,36 @@ class LibvirtDriver(driver.ComputeDriver):
         """Manage the local cache of images."""
         self.image_cache_manager.verify_base_images(context)
 
+    def prefetch_images(self, context, image_ids):
+        """Fetch images into the image cache ahead of their spawns."""
+        base_dir = os.path.join(FLAGS.instances_path, FLAGS.base_dir_name)
+        libvirt_utils.ensure_tree(base_dir)
+
+        pool = greenpool.GreenPool(FLAGS.image_prefetch_concurrency)
+        for image_id in set(image_ids):
+            pool.spawn_n(self._prefetch_image, context, image_id, base_dir)
+        pool.waitall()
+
+    @staticmethod
+    def _prefetch_image(context, image_id, base_dir):
+        # NOTE: this takes the same lock as Image.cache() does for the base
+        # file of the image, so a spawn needing the image while it is
+        # being prefetched waits for that download instead of starting its
+        # own, and the other way around.
+        fname = hashlib.sha1(str(image_id)).hexdigest()
+
+        @utils.synchronized(fname)
+        def fetch_if_not_exists(target):
+            if not os.path.exists(target):
+                libvirt_utils.fetch_image(context, target, image_id,
+                                          context.user_id, context.project_id)
+
+        LOG.info(_('Prefetching image %s'), image_id)
+        try:
+            fetch_if_not_exists(os.path.join(base_dir, fname))
+        except Exception:
+            LOG.exception(_('Failed to prefetch image %s'), image_id)
+
     @exception.wrap_exception()
     def migrate_disk_and_power_off(self, context, instance, dest,
                                    instance_type, network_info):
@@ -2562,6 +2701,7 @@ class LibvirtDriver(driver.ComputeDriver):
         disk_info = jsonutils.loads(disk_info_text)
 
         self.power_off(instance)
+        self._invalidate_resource_cache(instance['name'])
 
         # copy disks to destination
         # if disk type is qcow2, convert to raw then send to dest.
@@ -55,6 +55,12 @@ imagecache_opts = [
     cfg.BoolOpt('checksum_base_images',
                 default=False,
                 help='Write a checksum for files in _base to disk'),
+    cfg.IntOpt('checksum_base_images_bytes_per_pass',
+               default=(4 * 1024 * 1024 * 1024),
+               help='Number of bytes of base files hashed at most in a pass '
+                    'of the image cache manager to verify their checksums; '
+                    'larger files are verified over several passes. 0 means '
+                    'no limit'),
     ]
 
 flags.DECLARE('instances_path', 'nova.compute.manager')
@@ -84,6 +90,18 @@ def write_stored_checksum(target):
 
 class ImageCacheManager(object):
     def __init__(self):
+        # Kept from pass to pass: the names of the instances of other nodes
+        # found in a shared instances_path and the entries of it known not
+        # to be instances, the backing file of each instance disk by its
+        # mtime and size, and the progress and results of verifying the
+        # checksums of the base files.
+        self.remote_instance_names = set()
+        self.unknown_instance_dirs = set()
+        self.backing_files = {}
+        self.checksum_progress = {}
+        self.checksum_results = {}
+        self.checksum_generation = 0
+
         self._reset_state()
 
     def _reset_state(self):
@@ -99,6 +117,10 @@ class ImageCacheManager(object):
         self.removable_base_files = []
         self.unexplained_images = []
 
+        self.checksum_budget = (FLAGS.checksum_base_images_bytes_per_pass or
+                                None)
+        self.checksum_pending = False
+
     def _store_image(self, base_dir, ent, original=False):
         """Store a base image for later examination."""
         entpath = os.path.join(base_dir, ent)
@@ -129,12 +151,18 @@ class ImageCacheManager(object):
                 self._store_image(base_dir, ent, original=False)
 
     def _list_running_instances(self, context):
-        """List running instances (on all compute nodes)."""
+        """List the instances of this node and the ones being resized.
+
+        The instances of other nodes only matter when instances_path is
+        shared with them, and they are only listed once directories of
+        instances this node doesn't know about show up in it.
+        """
         self.used_images = {}
         self.image_popularity = {}
         self.instance_names = set()
 
-        instances = db.instance_get_all(context)
+        instances = db.instance_get_all_by_host_or_resizing(context,
+                                                            FLAGS.host)
         for instance in instances:
             self.instance_names.add(instance['name'])
 
@@ -159,16 +187,65 @@ class ImageCacheManager(object):
             self.image_popularity.setdefault(image_ref_str, 0)
             self.image_popularity[image_ref_str] += 1
 
+        self._list_remote_instances(context)
+        self.instance_names.update(self.remote_instance_names)
+
+    def _list_remote_instances(self, context):
+        """Find out which directories of instances_path belong to the
+        instances of other nodes.
+
+        The database is only asked again when directories show up that
+        weren't accounted for in an earlier pass.
+        """
+        dirs = set()
+        for ent in os.listdir(FLAGS.instances_path):
+            if (ent != FLAGS.base_dir_name and ent not in self.instance_names
+                and os.path.isdir(os.path.join(FLAGS.instances_path, ent))):
+                dirs.add(ent)
+
+        self.remote_instance_names &= dirs
+        unknown_dirs = dirs - self.remote_instance_names
+        if unknown_dirs - self.unknown_instance_dirs:
+            LOG.debug(_('Looking up the instances of other nodes for '
+                        '%s'), ' '.join(sorted(unknown_dirs)))
+            for instance in db.instance_get_all(context, columns_to_join=[]):
+                if instance['name'] in unknown_dirs:
+                    self.remote_instance_names.add(instance['name'])
+            unknown_dirs -= self.remote_instance_names
+        self.unknown_instance_dirs = unknown_dirs
+
+    def _get_disk_backing_file(self, disk_path):
+        """Return the backing file of an instance disk.
+
+        qemu-img is only run again for a disk once its mtime or size
+        changed since the last pass.
+        """
+        try:
+            stat = os.stat(disk_path)
+        except OSError:
+            return virtutils.get_disk_backing_file(disk_path)
+
+        key = (stat.st_mtime, stat.st_size)
+        cached = self.backing_files.get(disk_path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        backing_file = virtutils.get_disk_backing_file(disk_path)
+        self.backing_files[disk_path] = (key, backing_file)
+        return backing_file
+
     def _list_backing_images(self):
         """List the backing images currently in use."""
         inuse_images = []
+        disk_paths = set()
         for ent in os.listdir(FLAGS.instances_path):
             if ent in self.instance_names:
                 LOG.debug(_('%s is a valid instance name'), ent)
                 disk_path = os.path.join(FLAGS.instances_path, ent, 'disk')
                 if os.path.exists(disk_path):
                     LOG.debug(_('%s has a disk file'), ent)
-                    backing_file = virtutils.get_disk_backing_file(disk_path)
+                    disk_paths.add(disk_path)
+                    backing_file = self._get_disk_backing_file(disk_path)
                     LOG.debug(_('Instance %(instance)s is backed by '
                                 '%(backing)s'),
                               {'instance': ent,
@@ -190,6 +267,9 @@ class ImageCacheManager(object):
                                          'backing': backing_file})
                             self.unexplained_images.remove(backing_path)
 
+        for disk_path in set(self.backing_files) - disk_paths:
+            del self.backing_files[disk_path]
+
         return inuse_images
 
     def _find_base_file(self, base_dir, fingerprint):
@@ -229,11 +309,26 @@ class ImageCacheManager(object):
 
         stored_checksum = read_stored_checksum(base_file)
         if stored_checksum:
-            f = open(base_file, 'r')
-            current_checksum = utils.hash_file(f)
-            f.close()
+            # Files are verified once per generation, a generation ends
+            # with the first pass that had budget left to spare.
+            generation, result = self.checksum_results.get(base_file,
+                                                           (None, None))
+            if generation == self.checksum_generation:
+                return result
+
+            current_checksum = self._hash_base_file(base_file)
+            if current_checksum is None:
+                LOG.debug(_('%(id)s (%(base_file)s): image verification '
+                            'continues in the next pass'),
+                          {'id': img_id,
+                           'base_file': base_file})
+                self.checksum_pending = True
+                return result
 
-            if current_checksum != stored_checksum:
+            result = current_checksum == stored_checksum
+            self.checksum_results[base_file] = (self.checksum_generation,
+                                                result)
+            if not result:
                 LOG.error(_('%(id)s (%(base_file)s): image verification '
                             'failed'),
                           {'id': img_id,
@@ -257,6 +352,41 @@ class ImageCacheManager(object):
 
             return None
 
+    def _hash_base_file(self, base_file):
+        """Hash as much more of a base file as the budget of the pass
+        allows.
+
+        Returns the SHA-1 of the file once all of it was hashed, over as many
+        passes as that takes, and None until then.
+        """
+        # NOTE: base files in use have their mtime touched every pass, but
+        # are never written to after they're created.
+        stat = os.stat(base_file)
+        key = (stat.st_ino, stat.st_size)
+        progress = self.checksum_progress.get(base_file)
+        if progress is None or progress[0] != key:
+            progress = [key, 0, hashlib.sha1()]
+            self.checksum_progress[base_file] = progress
+
+        with open(base_file, 'r') as f:
+            f.seek(progress[1])
+            while progress[1] < stat.st_size:
+                size = 32768
+                if self.checksum_budget is not None:
+                    if self.checksum_budget <= 0:
+                        return None
+                    size = min(size, self.checksum_budget)
+                data = f.read(size)
+                if not data:
+                    break
+                progress[2].update(data)
+                progress[1] += len(data)
+                if self.checksum_budget is not None:
+                    self.checksum_budget -= len(data)
+
+        del self.checksum_progress[base_file]
+        return progress[2].hexdigest()
+
     def _remove_base_file(self, base_file):
         """Remove a single base file if it is old enough.
 
@@ -422,5 +552,15 @@ class ImageCacheManager(object):
                 for base_file in self.removable_base_files:
                     self._remove_base_file(base_file)
 
+        # Start verifying the checksums over once every file was verified,
+        # and forget about the files that are gone
+        if not self.checksum_pending:
+            self.checksum_generation += 1
+        for base_file in (set(self.checksum_results) |
+                          set(self.checksum_progress)):
+            if not os.path.exists(base_file):
+                self.checksum_results.pop(base_file, None)
+                self.checksum_progress.pop(base_file, None)
+
         # That's it
         LOG.debug(_('Verification complete'))
@@ -23,8 +23,11 @@ their attributes like VDIs, VIFs, as well as their lookup functions.
 import contextlib
 import cPickle as pickle
 import decimal
+import errno
+import io
 import os
 import re
+import stat
 import time
 import urllib
 import urlparse
@@ -77,6 +80,10 @@ xenapi_vm_utils_opts = [
                      'resize down (False will use standard dd). This speeds '
                      'up resizes down considerably since large runs of zeros '
                      'won\'t have to be rsynced'),
+    cfg.IntOpt('xenapi_sparse_copy_block_size',
+               default=1024 * 1024,
+               help='Size in bytes of the reads sparse_copy does; runs of '
+                    'zeros are still skipped in 64k pieces'),
     cfg.IntOpt('xenapi_num_vbd_unplug_retries',
                default=10,
                help='Maximum number of retries to unplug VBD'),
@@ -1688,45 +1695,118 @@ def _resize_part_and_fs(dev, start, old_sectors, new_sectors):
     utils.execute('tune2fs', '-j', partition_path, run_as_root=True)
 
 
-def _sparse_copy(src_path, dst_path, virtual_size, block_size=4096):
-    """Copy data, skipping long runs of zeros to create a sparse file."""
+# NOTE: Python 2 doesn't define these, the values are Linux's.
+SEEK_DATA = getattr(os, 'SEEK_DATA', 3)
+SEEK_HOLE = getattr(os, 'SEEK_HOLE', 4)
+
+# Granularity of the runs of zeros sparse_copy skips.
+SPARSE_COPY_HOLE_SIZE = 64 * 1024
+
+
+def _data_extents(fd, length):
+    """Yields the (start, end) offsets of the regions of the first length
+    bytes of fd that may hold data.
+
+    The holes the filesystem knows about are skipped; where it can't tell,
+    as on block devices, everything is reported as data.
+
+    """
+    offset = 0
+    while offset < length:
+        try:
+            start = os.lseek(fd, offset, SEEK_DATA)
+            end = os.lseek(fd, start, SEEK_HOLE)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # Nothing but holes past offset.
+                return
+            yield offset, length
+            return
+        if start >= length:
+            return
+        end = min(end, length)
+        yield start, end
+        offset = end
+
+
+def _write_all(dst, data):
+    """Writes all of data to the unbuffered file dst, which may write less
+    than it is given at a time."""
+    while len(data):
+        data = data[dst.write(data):]
+
+
+def _sparse_copy_extent(src, dst, start, end, view, zeros):
+    """Copies bytes start to end of src to dst through the buffer view,
+    seeking over the runs of zeros instead of writing them.
+
+    Returns the number of bytes written.
+    """
+    written = 0
+    block_size = len(view)
+    src.seek(start)
+    offset = start
+    while offset < end:
+        count = src.readinto(view[:min(block_size, end - offset)])
+        if not count:
+            break
+
+        data_start = None
+        for pos in xrange(0, count, SPARSE_COPY_HOLE_SIZE):
+            piece = view[pos:min(pos + SPARSE_COPY_HOLE_SIZE, count)]
+            if piece == zeros[:len(piece)]:
+                if data_start is not None:
+                    dst.seek(offset + data_start)
+                    _write_all(dst, view[data_start:pos])
+                    written += pos - data_start
+                    data_start = None
+            elif data_start is None:
+                data_start = pos
+        if data_start is not None:
+            dst.seek(offset + data_start)
+            _write_all(dst, view[data_start:count])
+            written += count - data_start
+
+        offset += count
+    return written
+
+
+def _sparse_copy(src_path, dst_path, virtual_size, block_size=None):
+    """Copy data, skipping holes and runs of zeros to create a sparse file."""
+    if block_size is None:
+        block_size = FLAGS.xenapi_sparse_copy_block_size
     start_time = time.time()
-    EMPTY_BLOCK = '\0' * block_size
-    bytes_read = 0
-    skipped_bytes = 0
-    left = virtual_size
+    bytes_written = 0
 
     LOG.debug(_("Starting sparse_copy src=%(src_path)s dst=%(dst_path)s "
                 "virtual_size=%(virtual_size)d block_size=%(block_size)d"),
               locals())
 
+    # NOTE: a single buffer is read into and written from for the whole
+    # copy, and compared against zeros without slicing it into new strings.
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    zeros = '\0' * SPARSE_COPY_HOLE_SIZE
+
     # NOTE(sirp): we need read/write access to the devices; since we don't have
     # the luxury of shelling out to a sudo'd command, we temporarily take
     # ownership of the devices.
     with utils.temporary_chown(src_path):
         with utils.temporary_chown(dst_path):
-            with open(src_path, "r") as src:
-                with open(dst_path, "w") as dst:
-                    data = src.read(min(block_size, left))
-                    while data:
-                        if data == EMPTY_BLOCK:
-                            dst.seek(block_size, os.SEEK_CUR)
-                            left -= block_size
-                            bytes_read += block_size
-                            skipped_bytes += block_size
-                        else:
-                            dst.write(data)
-                            data_len = len(data)
-                            left -= data_len
-                            bytes_read += data_len
-
-                        if left <= 0:
-                            break
-
-                        data = src.read(min(block_size, left))
+            with io.open(src_path, "rb", buffering=0) as src:
+                with io.open(dst_path, "wb", buffering=0) as dst:
+                    for start, end in _data_extents(src.fileno(),
+                                                    virtual_size):
+                        bytes_written += _sparse_copy_extent(src, dst,
+                                                             start, end,
+                                                             view, zeros)
+                    if stat.S_ISREG(os.fstat(dst.fileno()).st_mode):
+                        # Trailing holes don't extend a file.
+                        dst.truncate(virtual_size)
 
     duration = time.time() - start_time
-    compression_pct = float(skipped_bytes) / bytes_read * 100
+    compression_pct = (float(virtual_size - bytes_written) /
+                       max(virtual_size, 1) * 100)
 
     LOG.debug(_("Finished sparse_copy in %(duration).2f secs, "
                 "%(compression_pct).2f%% reduction in size"), locals())
@@ -22,6 +22,9 @@ Drivers for volumes.
 
 import time
 
+from eventlet import greenpool
+from eventlet import greenthread
+
 from nova import exception
 from nova import flags
 from nova.openstack.common import cfg
@@ -64,17 +67,41 @@ volume_opts = [
                default=None,
                help='the libvirt uuid of the secret for the rbd_user'
                     'volumes'),
+    cfg.StrOpt('volume_clear',
+               default='zero',
+               help='Method used to wipe deleted volumes: zero, discard or '
+                    'none. Only use discard if the physical volumes read '
+                    'back zeros after a discard; zero is used when discard '
+                    'fails'),
+    cfg.BoolOpt('volume_clear_lazily',
+                default=True,
+                help='Rename deleted volumes into a queue that is wiped and '
+                     'removed in the background, instead of wiping them '
+                     'before the delete returns'),
+    cfg.IntOpt('volume_clear_bandwidth',
+               default=100,
+               help='Maximum rate in MB/s at which deleted volumes are '
+                    'zeroed, 0 for no limit'),
+    cfg.IntOpt('volume_export_concurrency',
+               default=10,
+               help='Number of volumes re-exported at once when the volume '
+                    'service starts'),
     ]
 
 FLAGS = flags.FLAGS
 FLAGS.register_opts(volume_opts)
 
+# Deleted volumes are renamed with this prefix until they are wiped.
+SCRUB_PREFIX = 'scrub-'
+
 
 class VolumeDriver(object):
     """Executes commands relating to Volumes."""
     def __init__(self, execute=utils.execute, *args, **kwargs):
         # NOTE(vish): db is set by Manager
         self.db = None
+        self._scrubber = None
+        self._scrub_requested = False
         self.set_execute(execute)
 
     def set_execute(self, execute):
@@ -105,6 +132,8 @@ class VolumeDriver(object):
         if not FLAGS.volume_group in volume_groups:
             raise exception.NovaException(_("volume group %s doesn't exist")
                                   % FLAGS.volume_group)
+        # Resume wiping the volumes deleted before a restart.
+        self._start_scrubber()
 
     def _create_volume(self, volume_name, sizestr):
         self._try_execute('lvcreate', '-L', sizestr, '-n',
@@ -124,16 +153,123 @@ class VolumeDriver(object):
             return True
         return False
 
-    def _delete_volume(self, volume, size_in_g):
+    def _delete_volume(self, volume, size_in_g, is_snapshot=False):
         """Deletes a logical volume."""
         # zero out old volumes to prevent data leaking between users
-        # TODO(ja): reclaiming space should be done lazy and low priority
-        self._copy_volume('/dev/zero', self.local_path(volume), size_in_g)
+        lv_name = self._escape_snapshot(volume['name'])
+
+        # NOTE: snapshots are always wiped right away, as their origin
+        # can't be deleted while they exist.
+        if FLAGS.volume_clear_lazily and not is_snapshot:
+            self._try_execute('lvrename', FLAGS.volume_group, lv_name,
+                              SCRUB_PREFIX + lv_name, run_as_root=True)
+            self._start_scrubber()
+            return
+
+        self._clear_volume(lv_name, size_in_g * 1024, is_snapshot)
         self._try_execute('lvremove', '-f', "%s/%s" %
-                          (FLAGS.volume_group,
-                           self._escape_snapshot(volume['name'])),
+                          (FLAGS.volume_group, lv_name),
                           run_as_root=True)
 
+    def _clear_volume(self, lv_name, size_in_m, is_snapshot=False):
+        """Wipes the data of a logical volume.
+
+        Of a snapshot only its copy-on-write store is wiped; writing to the
+        snapshot itself would first copy the origin's blocks into it.
+        """
+        if FLAGS.volume_clear == 'none':
+            return
+
+        path = self.local_path({'name': lv_name})
+        if is_snapshot:
+            path += '-cow'
+
+        if FLAGS.volume_clear == 'discard':
+            try:
+                self._execute('blkdiscard', path, run_as_root=True)
+                return
+            except exception.ProcessExecutionError:
+                LOG.warn(_("Discarding %s failed, zeroing it instead"),
+                         lv_name)
+
+        # NOTE: dd runs in chunks of one second's worth of
+        # volume_clear_bandwidth, sleeping off whatever is left of that
+        # second after each chunk.
+        chunk_m = FLAGS.volume_clear_bandwidth or size_in_m
+        for offset in xrange(0, size_in_m, chunk_m):
+            start = time.time()
+            self._execute('dd', 'if=/dev/zero', 'of=%s' % path,
+                          'bs=1M', 'seek=%d' % offset,
+                          'count=%d' % min(chunk_m, size_in_m - offset),
+                          'oflag=direct', 'conv=notrunc',
+                          run_as_root=True)
+            if FLAGS.volume_clear_bandwidth:
+                greenthread.sleep(max(0, 1 - (time.time() - start)))
+
+    def _scrub_queue(self):
+        """Returns the (lv name, size in MB) of the deleted volumes waiting
+        to be wiped."""
+        out, err = self._execute('lvs', '--noheadings', '--nosuffix',
+                                 '--units', 'm', '-o', 'lv_name,lv_size',
+                                 FLAGS.volume_group, run_as_root=True)
+        queue = []
+        # fake_execute returns None resulting unit test error
+        for line in (out or '').splitlines():
+            fields = line.split()
+            if len(fields) == 2 and fields[0].startswith(SCRUB_PREFIX):
+                queue.append((fields[0], int(float(fields[1]))))
+        return queue
+
+    def _get_lvm_stats(self):
+        """Returns the capacity of the volume group and of the deleted
+        volumes in it that are waiting to be wiped."""
+        out, err = self._execute('vgs', '--noheadings', '--nosuffix',
+                                 '--units', 'g', '-o', 'vg_size,vg_free',
+                                 FLAGS.volume_group, run_as_root=True)
+        # fake_execute returns None resulting unit test error
+        if not out:
+            return None
+        total_gb, free_gb = [float(field) for field in out.split()]
+        queue = self._scrub_queue()
+        return {'total_capacity_gb': total_gb,
+                'free_capacity_gb': free_gb,
+                'scrubbing_capacity_gb': sum(size_in_m for _name, size_in_m
+                                             in queue) / 1024.0,
+                'scrubbing_volumes': len(queue)}
+
+    def _start_scrubber(self):
+        self._scrub_requested = True
+        if self._scrubber is None:
+            self._scrubber = greenthread.spawn(self._scrub_deleted_volumes)
+
+    def _scrub_deleted_volumes(self):
+        """Wipes and removes deleted volumes until the queue is empty."""
+        failed = set()
+        try:
+            # NOTE: a volume renamed while the queue was being listed
+            # requests another pass, so it isn't left behind.
+            while self._scrub_requested:
+                self._scrub_requested = False
+                queue = [(lv_name, size_in_m)
+                         for lv_name, size_in_m in self._scrub_queue()
+                         if lv_name not in failed]
+                if queue:
+                    self._scrub_requested = True
+                for lv_name, size_in_m in queue:
+                    LOG.info(_("Wiping deleted volume %s"), lv_name)
+                    try:
+                        self._clear_volume(lv_name, size_in_m)
+                        self._try_execute('lvremove', '-f', "%s/%s" %
+                                          (FLAGS.volume_group, lv_name),
+                                          run_as_root=True)
+                    except exception.ProcessExecutionError:
+                        LOG.exception(_("Wiping deleted volume %s failed, "
+                                        "it is retried after the next "
+                                        "delete"), lv_name)
+                        failed.add(lv_name)
+        finally:
+            self._scrubber = None
+
     def _sizestr(self, size_in_g):
         if int(size_in_g) == 0:
             return '100M'
@@ -192,9 +328,8 @@ class VolumeDriver(object):
             # If the snapshot isn't present, then don't attempt to delete
             return True
 
-        # TODO(yamahata): zeroing out the whole snapshot triggers COW.
-        # it's quite slow.
-        self._delete_volume(snapshot, snapshot['volume_size'])
+        self._delete_volume(snapshot, snapshot['volume_size'],
+                            is_snapshot=True)
 
     def local_path(self, volume):
         # NOTE(vish): stops deprecation warning
@@ -206,6 +341,22 @@ class VolumeDriver(object):
         """Synchronously recreates an export for a logical volume."""
         raise NotImplementedError()
 
+    def ensure_exports(self, context, volumes):
+        """Synchronously recreates the exports of logical volumes, calling
+        ensure_export() for up to volume_export_concurrency of them at once.
+        """
+        pool = greenpool.GreenPool(FLAGS.volume_export_concurrency)
+        for volume in volumes:
+            pool.spawn_n(self._ensure_export_logged, context, volume)
+        pool.waitall()
+
+    def _ensure_export_logged(self, context, volume):
+        try:
+            self.ensure_export(context, volume)
+        except Exception:
+            LOG.exception(_("volume %s: failed to re-export"),
+                          volume['name'])
+
     def create_export(self, context, volume):
         """Exports the volume. Can optionally return a Dictionary of changes
         to the volume object to be persisted."""
@@ -255,6 +406,7 @@ class ISCSIDriver(VolumeDriver):
 
     def __init__(self, *args, **kwargs):
         self.tgtadm = iscsi.get_target_admin()
+        self._stats = None
         super(ISCSIDriver, self).__init__(*args, **kwargs)
 
     def set_execute(self, execute):
@@ -278,6 +430,40 @@ class ISCSIDriver(VolumeDriver):
         self.tgtadm.new_logicalunit(iscsi_target, 0, volume_path,
                                     check_exit_code=False)
 
+    def ensure_exports(self, context, volumes):
+        """Recreates the exports that are missing from the target daemon,
+        whose targets are listed once for all volumes."""
+        if not volumes:
+            return
+
+        try:
+            targets = self.tgtadm.show_targets()
+        except (NotImplementedError, IOError,
+                exception.ProcessExecutionError):
+            LOG.exception(_("Listing iscsi targets failed, re-exporting "
+                            "all volumes"))
+            targets = {}
+        target_nums = self.db.iscsi_target_get_nums_by_host(
+                context, volumes[0]['host'])
+
+        missing = []
+        for volume in volumes:
+            iscsi_target = target_nums.get(volume['id'])
+            if iscsi_target is None:
+                LOG.info(_("Skipping ensure_export. No iscsi_target "
+                           "provisioned for volume: %s"), volume['id'])
+                continue
+
+            iscsi_name = "%s%s" % (FLAGS.iscsi_target_prefix, volume['name'])
+            volume_path = "/dev/%s/%s" % (FLAGS.volume_group, volume['name'])
+            name, paths = targets.get(iscsi_target, (None, []))
+            if name != iscsi_name or volume_path not in paths:
+                missing.append(volume)
+
+        LOG.info(_("Re-exporting %(missing)d of %(total)d volumes"),
+                 {'missing': len(missing), 'total': len(volumes)})
+        super(ISCSIDriver, self).ensure_exports(context, missing)
+
     def _ensure_iscsi_targets(self, context, host):
         """Ensure that target ids have been created in datastore."""
         host_iscsi_targets = self.db.iscsi_target_count_by_host(context, host)
@@ -467,6 +653,15 @@ class ISCSIDriver(VolumeDriver):
                         "id:%(volume_id)s.") % locals())
             raise
 
+    def get_volume_stats(self, refresh=False):
+        """Return the capacity of the volume group. If 'refresh' is
+           True, run the update first."""
+        if refresh or not self._stats:
+            self._stats = self._get_lvm_stats()
+            if self._stats:
+                self._stats['storage_protocol'] = 'iSCSI'
+        return self._stats
+
 
 class FakeISCSIDriver(ISCSIDriver):
     """Logs calls instead of executing."""
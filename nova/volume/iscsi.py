@@ -48,7 +48,7 @@ class TargetAdmin(object):
         self._execute = execute
 
     def _run(self, *args, **kwargs):
-        self._execute(self._cmd, *args, run_as_root=True, **kwargs)
+        return self._execute(self._cmd, *args, run_as_root=True, **kwargs)
 
     def new_target(self, name, tid, **kwargs):
         """Create a new iSCSI target."""
@@ -62,6 +62,10 @@ class TargetAdmin(object):
         """Query the given target ID."""
         raise NotImplementedError()
 
+    def show_targets(self):
+        """Return {tid: (name, [backing store paths])} of all targets."""
+        raise NotImplementedError()
+
     def new_logicalunit(self, tid, lun, path, **kwargs):
         """Create a new LUN on a target using the supplied path."""
         raise NotImplementedError()
@@ -101,6 +105,26 @@ class TgtAdm(TargetAdmin):
                   '--tid=%s' % tid,
                   **kwargs)
 
+    def show_targets(self):
+        out, _err = self._run('--op', 'show',
+                              '--lld=iscsi', '--mode=target')
+        targets = {}
+        paths = None
+        for line in (out or '').splitlines():
+            line = line.strip()
+            # Target 1: iqn.2010-10.org.openstack:volume-00000001
+            if line.startswith('Target ') and ': ' in line:
+                tid, name = line[len('Target '):].split(': ', 1)
+                paths = []
+                targets[int(tid)] = (name, paths)
+            # Backing store path: /dev/nova-volumes/volume-00000001
+            elif (line.startswith('Backing store path: ') and
+                  paths is not None):
+                path = line[len('Backing store path: '):]
+                if path != 'None':
+                    paths.append(path)
+        return targets
+
     def new_logicalunit(self, tid, lun, path, **kwargs):
         self._run('--op', 'new',
                   '--lld=iscsi', '--mode=logicalunit',
@@ -139,6 +163,22 @@ class IetAdm(TargetAdmin):
                   '--tid=%s' % tid,
                   **kwargs)
 
+    def show_targets(self):
+        targets = {}
+        paths = None
+        with open('/proc/net/iet/volume') as f:
+            for line in f:
+                fields = dict(field.split(':', 1)
+                              for field in line.split() if ':' in field)
+                # tid:1 name:iqn.2010-10.org.openstack:volume-00000001
+                if 'tid' in fields:
+                    paths = []
+                    targets[int(fields['tid'])] = (fields.get('name'), paths)
+                # lun:0 state:0 iotype:fileio iomode:wt path:/dev/...
+                elif 'path' in fields and paths is not None:
+                    paths.append(fields['path'])
+        return targets
+
     def new_logicalunit(self, tid, lun, path, **kwargs):
         self._run('--op', 'new',
                   '--tid=%s' % tid,
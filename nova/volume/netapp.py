@@ -676,3 +676,13 @@ class NetAppISCSIDriver(driver.ISCSIDriver):
 
     def check_for_export(self, context, volume_id):
         raise NotImplementedError()
+
+    def ensure_exports(self, context, volumes):
+        """Synchronously recreates the exports of volumes, one at a time as
+        they share one API client."""
+        for volume in volumes:
+            self.ensure_export(context, volume)
+
+    def get_volume_stats(self, refresh=False):
+        """The capacity of the storage system isn't reported."""
+        return None
@@ -280,3 +280,13 @@ class NexentaDriver(driver.ISCSIDriver):  # pylint: disable=R0921
             LOG.warn(_('Got error trying to delete target %(target)s,'
                 ' assuming it is already gone: %(exc)s'),
                 {'target': target_name, 'exc': exc})
+
+    def ensure_exports(self, context, volumes):
+        """Synchronously recreates the exports of volumes, one at a time as
+        they share one API client."""
+        for volume in volumes:
+            self.ensure_export(context, volume)
+
+    def get_volume_stats(self, refresh=False):
+        """The capacity of the appliance isn't reported."""
+        return None
@@ -138,6 +138,12 @@ class SanISCSIDriver(nova.volume.driver.ISCSIDriver):
         """Synchronously recreates an export for a logical volume."""
         pass
 
+    def ensure_exports(self, context, volumes):
+        """Synchronously recreates the exports of logical volumes, one at
+        a time as each command opens its own ssh connection."""
+        for volume in volumes:
+            self.ensure_export(context, volume)
+
     def create_export(self, context, volume):
         """Exports the volume."""
         pass
@@ -157,6 +163,10 @@ class SanISCSIDriver(nova.volume.driver.ISCSIDriver):
         if not (FLAGS.san_ip):
             raise exception.NovaException(_("san_ip must be set"))
 
+    def get_volume_stats(self, refresh=False):
+        """The capacity of the SAN isn't reported."""
+        return None
+
 
 def _collect_lines(data):
     """Split lines from data into an array, trimming them """
@@ -292,10 +302,8 @@ class SolarisISCSIDriver(SanISCSIDriver):
         cmd.append(zfs_poolname)
         self._execute(*cmd)
 
-    def _get_luid(self, volume):
-        zfs_poolname = self._build_zfs_poolname(volume)
-        zvol_name = '/dev/zvol/rdsk/%s' % zfs_poolname
-
+    def _get_luids(self):
+        """Returns {zvol name: luid} of all LUs."""
         (out, _err) = self._execute('/usr/sbin/sbdadm', 'list-lu')
 
         lines = _collect_lines(out)
@@ -313,15 +321,23 @@ class SolarisISCSIDriver(SanISCSIDriver):
 
             lines = lines[4:]
 
+        luids = {}
         for line in lines:
             items = line.split()
             assert len(items) == 3
-            if items[2] == zvol_name:
-                luid = items[0].strip()
-                return luid
+            luids[items[2]] = items[0].strip()
+        return luids
+
+    def _get_luid(self, volume):
+        zfs_poolname = self._build_zfs_poolname(volume)
+        zvol_name = '/dev/zvol/rdsk/%s' % zfs_poolname
+
+        luids = self._get_luids()
+        if zvol_name in luids:
+            return luids[zvol_name]
 
         raise Exception(_('LUID not found for %(zfs_poolname)s. '
-                          'Output=%(out)s') % locals())
+                          'LUs=%(luids)s') % locals())
 
     def _is_lu_created(self, volume):
         luid = self._get_luid(volume)
@@ -346,6 +362,26 @@ class SolarisISCSIDriver(SanISCSIDriver):
         # This makes initial start stupid-slow
         return self._do_export(volume, force_create=False)
 
+    def ensure_exports(self, context, volumes):
+        """Recreates the exports of the volumes that are missing any part,
+        listing the LUs, target groups and targets once for all volumes."""
+        luids = self._get_luids()
+        target_groups = self._get_target_groups()
+        iscsi_targets = self._get_iscsi_targets()
+
+        for volume in volumes:
+            zvol_name = '/dev/zvol/rdsk/%s' % self._build_zfs_poolname(volume)
+            iscsi_name = self._build_iscsi_target_name(volume)
+            target_group_name = 'tg-%s' % volume['name']
+            if (zvol_name in luids and
+                target_group_name in target_groups and
+                iscsi_name in iscsi_targets and
+                self._is_target_group_member(target_group_name,
+                                             iscsi_name) and
+                self._view_exists(luids[zvol_name])):
+                continue
+            self._do_export(volume, force_create=False)
+
     def create_export(self, context, volume):
         return self._do_export(volume, force_create=True)
 
@@ -884,6 +920,15 @@ class SolidFireSanISCSIDriver(SanISCSIDriver):
         LOG.debug(_("Executing SolidFire ensure_export..."))
         return self._do_export(volume)
 
+    def ensure_exports(self, context, volumes):
+        LOG.debug(_("Executing SolidFire ensure_exports..."))
+        # NOTE: an export only depends on the account of its project.
+        projects = set()
+        for volume in volumes:
+            if volume['project_id'] not in projects:
+                self._do_export(volume)
+                projects.add(volume['project_id'])
+
     def create_export(self, context, volume):
         LOG.debug(_("Executing SolidFire create_export..."))
         return self._do_export(volume)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark for the EC2 DescribeInstances call.
+
+Fills a database with instances spread over compute hosts, each with an
+image, kernel and ramdisk, cached network info and a block device mapping,
+then runs CloudController.describe_instances() as an admin and prints the
+number of SQL statements it issued and its latency for each instance count.
+
+By default it runs against an in-memory sqlite database; pass --sql to
+use another database, which is emptied and migrated first.
+
+Run like:
+
+    ./tools/benchmarks/ec2_describe_instances.py --instances 10,100,1000
+"""
+
+import gettext
+import optparse
+import os
+import sys
+import time
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+import sqlalchemy.event
+
+from nova.api.ec2 import cloud
+from nova import context
+from nova import db
+from nova.db import migration
+from nova.db.sqlalchemy import session
+from nova import flags
+from nova.openstack.common import jsonutils
+
+
+FLAGS = flags.FLAGS
+
+IMAGE_UUID = 'cedef40a-ed67-4d10-800e-17455edce175'
+KERNEL_UUID = '76fa36fc-c930-4bf3-8c8a-ea2a2420deb6'
+RAMDISK_UUID = 'e5fe5518-0288-4fa3-b0c4-c79764101b85'
+
+
+def fake_network_info(index):
+    return [{'id': 'vif-%d' % index,
+             'address': '02:16:3e:%02x:%02x:%02x' % (index >> 16,
+                                                     (index >> 8) & 255,
+                                                     index & 255),
+             'network': {'id': 'net-1',
+                         'bridge': 'br100',
+                         'label': 'private',
+                         'meta': {},
+                         'subnets': [{'cidr': '10.0.0.0/8',
+                                      'gateway': None,
+                                      'dns': [],
+                                      'ips': [{'address': '10.%d.%d.%d' % (
+                                                   index >> 16,
+                                                   (index >> 8) & 255,
+                                                   index & 255),
+                                               'type': 'fixed',
+                                               'version': 4,
+                                               'meta': {},
+                                               'floating_ips': []}],
+                                      'routes': [],
+                                      'version': 4,
+                                      'meta': {}}]},
+             'meta': {}}]
+
+
+def add_instances(ctxt, start, count, hosts):
+    for index in xrange(start, start + count):
+        instance = db.instance_create(ctxt,
+                {'reservation_id': 'r-%d' % (index / 10),
+                 'project_id': 'project-%d' % (index % 10),
+                 'image_ref': IMAGE_UUID,
+                 'kernel_id': KERNEL_UUID,
+                 'ramdisk_id': RAMDISK_UUID,
+                 'instance_type_id': 1,
+                 'host': 'host-%d' % (index % hosts),
+                 'hostname': 'server-%d' % index,
+                 'vm_state': 'active'})
+        db.instance_info_cache_update(ctxt, instance['uuid'],
+                {'network_info': jsonutils.dumps(fake_network_info(index))})
+        db.block_device_mapping_create(ctxt,
+                {'instance_uuid': instance['uuid'],
+                 'device_name': '/dev/vdb',
+                 'virtual_name': 'ephemeral0'})
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--instances', default='10,100,1000',
+                      help='comma separated instance counts to describe')
+    parser.add_option('--hosts', type='int', default=20,
+                      help='number of compute hosts the instances are on')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='number of calls timed for each instance count')
+    parser.add_option('--sql', default='sqlite://',
+                      help='sql connection of the database to use')
+    options, _args = parser.parse_args()
+
+    flags.parse_args([sys.argv[0]])
+    FLAGS.set_override('sql_connection', options.sql)
+    FLAGS.set_override('policy_file', os.path.join(POSSIBLE_TOPDIR, 'etc',
+                                                   'nova', 'policy.json'))
+
+    engine = session.get_engine()
+    if options.sql != 'sqlite://':
+        metadata = sqlalchemy.MetaData(bind=engine)
+        metadata.reflect()
+        metadata.drop_all()
+    migration.db_sync()
+
+    statements = [0]
+
+    def count_statement(*args):
+        statements[0] += 1
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', count_statement)
+
+    ctxt = context.get_admin_context()
+    for host in xrange(options.hosts):
+        db.service_create(ctxt, {'host': 'host-%d' % host,
+                                 'topic': 'compute',
+                                 'availability_zone': 'zone-%d' % (host % 3)})
+    controller = cloud.CloudController()
+
+    print '%10s %12s %14s %12s' % ('instances', 'statements',
+                                   'per instance', 'time (ms)')
+    created = 0
+    for count in sorted(int(count) for count in options.instances.split(',')):
+        add_instances(ctxt, created, count - created, options.hosts)
+        created = count
+
+        # NOTE: the first call creates the ec2 id mappings of the new
+        # instances and images, which later calls only read.
+        controller.describe_instances(ctxt)
+
+        statements[0] = 0
+        start = time.time()
+        for x in xrange(options.repeat):
+            controller.describe_instances(ctxt)
+        elapsed = (time.time() - start) / options.repeat
+        per_call = statements[0] / options.repeat
+        print '%10d %12d %14.2f %12.1f' % (count, per_call,
+                                           float(per_call) / count,
+                                           elapsed * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark for the in process memcache client.
+
+Fills a cache with --entries metadata-sized entries, like the metadata
+service does for every instance, then times set(), get() hits and misses
+and incr() with:
+
+  * legacy: the former memorycache.Client, whose get() expires every
+    entry of the cache on every call.
+  * memorycache: nova.common.memorycache.Client.
+
+The legacy gets are only timed --legacy_gets times, as each of them walks
+the whole cache.
+
+Run like:
+
+    ./tools/benchmarks/memorycache.py --entries 100000
+"""
+
+import gettext
+import optparse
+import os
+import random
+import sys
+import time
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova.common import memorycache
+from nova import flags
+from nova.openstack.common import timeutils
+
+
+FLAGS = flags.FLAGS
+
+
+class LegacyClient(object):
+    def __init__(self, *args, **kwargs):
+        self.cache = {}
+
+    def get(self, key):
+        for k in self.cache.keys():
+            (timeout, _value) = self.cache[k]
+            if timeout and timeutils.utcnow_ts() >= timeout:
+                del self.cache[k]
+
+        return self.cache.get(key, (0, None))[1]
+
+    def set(self, key, value, time=0, min_compress_len=0):
+        timeout = 0
+        if time != 0:
+            timeout = timeutils.utcnow_ts() + time
+        self.cache[key] = (timeout, value)
+        return True
+
+    def incr(self, key, delta=1):
+        value = self.get(key)
+        if value is None:
+            return None
+        new_value = int(value) + delta
+        self.cache[key] = (self.cache[key][0], str(new_value))
+        return new_value
+
+
+def timed(func, keys, *args):
+    start = time.time()
+    for key in keys:
+        func(key, *args)
+    return (time.time() - start) / len(keys) * 1000000
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--entries', type='int', default=100000,
+                      help='number of entries cached')
+    parser.add_option('--size', type='int', default=4096,
+                      help='size of each cached value in bytes')
+    parser.add_option('--gets', type='int', default=100000,
+                      help='number of gets timed')
+    parser.add_option('--legacy_gets', type='int', default=100,
+                      help='number of gets timed for the legacy client')
+    options, _args = parser.parse_args()
+
+    flags.parse_args([sys.argv[0]])
+    FLAGS.set_override('memorycache_max_entries', options.entries)
+
+    value = 'x' * options.size
+    keys = ['metadata-10.%d.%d.%d' % (i >> 16, (i >> 8) & 255, i & 255)
+            for i in xrange(options.entries)]
+    missing = ['authfailures-%d' % i for i in xrange(options.entries)]
+
+    print '%-12s %10s %10s %10s %10s' % ('client', 'set (us)', 'hit (us)',
+                                         'miss (us)', 'incr (us)')
+    for name, client, gets in (
+            ('legacy', LegacyClient(), options.legacy_gets),
+            ('memorycache', memorycache.Client(), options.gets)):
+        hits = [random.choice(keys) for x in xrange(gets)]
+        misses = [random.choice(missing) for x in xrange(gets)]
+        set_us = timed(client.set, keys, value, 15)
+        hit_us = timed(client.get, hits)
+        miss_us = timed(client.get, misses)
+        client.set('counter', '0', 15)
+        incr_us = timed(client.incr, ['counter'] * gets)
+        print '%-12s %10.2f %10.2f %10.2f %10.2f' % (name, set_us, hit_us,
+                                                     miss_us, incr_us)
+
+    print
+    print 'memorycache stats: %s' % client.get_stats()[0][1]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark for rpc.call() over the AMQP drivers.
+
+Serves an echo method on a topic and has parallel green threads call it,
+once with a reply queue per call and once with the single reply queue of
+amqp_rpc_single_reply_queue, and prints the calls per second of each.
+
+By default it runs against the in-memory transport of kombu (fake_rabbit),
+so no broker is needed; pass --rabbit_host to run against RabbitMQ.
+
+Run like:
+
+    ./tools/benchmarks/rpc_calls.py --threads 10 --calls 200
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import gettext
+import optparse
+import os
+import sys
+import time
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova import context
+from nova import flags
+from nova.openstack.common import rpc
+from nova.openstack.common.rpc import dispatcher
+
+
+FLAGS = flags.FLAGS
+
+
+class EchoManager(object):
+    RPC_API_VERSION = '1.0'
+
+    def echo(self, context, value):
+        return value
+
+
+def run_calls(ctxt, topic, thread_count, call_count):
+    def caller():
+        for x in xrange(call_count):
+            rpc.call(ctxt, topic, {'method': 'echo',
+                                   'args': {'value': x}})
+
+    pool = eventlet.GreenPool(thread_count)
+    start = time.time()
+    for x in xrange(thread_count):
+        pool.spawn_n(caller)
+    pool.waitall()
+    return time.time() - start
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--threads', type='int', default=10,
+                      help='number of parallel green threads')
+    parser.add_option('--calls', type='int', default=200,
+                      help='number of calls per thread')
+    parser.add_option('--rabbit_host', default=None,
+                      help='RabbitMQ host to use instead of the in-memory '
+                           'transport')
+    options, _args = parser.parse_args()
+
+    flags.parse_args([sys.argv[0]])
+    FLAGS.set_override('rpc_backend',
+                       'nova.openstack.common.rpc.impl_kombu')
+    if options.rabbit_host:
+        FLAGS.set_override('rabbit_host', options.rabbit_host)
+    else:
+        FLAGS.set_override('fake_rabbit', True)
+
+    topic = 'bench_rpc_calls'
+    conn = rpc.create_connection(new=True)
+    conn.create_consumer(topic, dispatcher.RpcDispatcher([EchoManager()]))
+    conn.consume_in_thread()
+
+    ctxt = context.get_admin_context()
+    total = options.threads * options.calls
+    print '%-20s %12s %12s' % ('reply queues', 'time (ms)', 'calls/s')
+    for name, single_reply_queue in (('one per call', False),
+                                     ('one per process', True)):
+        FLAGS.set_override('amqp_rpc_single_reply_queue', single_reply_queue)
+        elapsed = run_calls(ctxt, topic, options.threads, options.calls)
+        print '%-20s %12.1f %12.1f' % (name, elapsed * 1000, total / elapsed)
+
+    conn.close()
+    rpc.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark for the wire formats of rpc messages.
+
+Builds run_instance and get_instance_nw_info reply payloads shaped like the
+ones compute sends, then times encoding and decoding them and prints their
+size for each rpc_serializer, with and without compression:
+
+  * zmq: rpc.common.serialize_msg() / deserialize_msg(), as used by
+    impl_zmq.
+  * kombu: kombu's own serializers and compression, as used by
+    impl_kombu.  Skipped if kombu isn't installed.
+
+impl_qpid sends its messages as native AMQP maps and isn't covered.
+
+Run like:
+
+    ./tools/benchmarks/rpc_serialization.py --repeat 1000
+"""
+
+import gettext
+import optparse
+import os
+import sys
+import time
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova.openstack.common.rpc import common as rpc_common
+
+try:
+    import kombu.compression
+    import kombu.serialization
+except ImportError:
+    kombu = None
+
+
+def fake_network_info(vif_count):
+    network_info = []
+    for i in xrange(vif_count):
+        network_info.append({
+            'id': 'vif-uuid-%d' % i,
+            'address': '02:16:3e:00:00:%02x' % i,
+            'network': {
+                'id': 'net-uuid-%d' % i,
+                'bridge': 'br100',
+                'label': 'private-%d' % i,
+                'meta': {'tenant_id': 'project-id', 'multi_host': True},
+                'subnets': [{
+                    'cidr': '10.%d.0.0/24' % i,
+                    'gateway': {'address': '10.%d.0.1' % i, 'type': 'gateway',
+                                'version': 4, 'meta': {}},
+                    'dns': [{'address': '8.8.8.8', 'type': 'dns',
+                             'version': 4, 'meta': {}}],
+                    'ips': [{'address': '10.%d.0.%d' % (i, j),
+                             'type': 'fixed', 'version': 4, 'meta': {},
+                             'floating_ips': []}
+                            for j in xrange(2, 4)],
+                    'routes': [],
+                    'version': 4,
+                    'meta': {'dhcp_server': '10.%d.0.1' % i},
+                }],
+            },
+            'meta': {},
+        })
+    return network_info
+
+
+def fake_context():
+    return {'_context_user_id': 'user-id',
+            '_context_project_id': 'project-id',
+            '_context_is_admin': False,
+            '_context_read_deleted': 'no',
+            '_context_roles': ['member'],
+            '_context_remote_address': '10.0.0.1',
+            '_context_timestamp': '2012-10-16T12:00:00.000000',
+            '_context_request_id': 'req-' + 'a' * 36,
+            '_context_auth_token': 'b' * 32,
+            '_context_quota_class': None,
+            '_msg_id': 'c' * 32}
+
+
+def fake_instance(metadata_count, vif_count):
+    instance = {
+        'id': 42,
+        'uuid': 'd' * 36,
+        'name': 'instance-0000002a',
+        'display_name': 'web-42',
+        'display_description': 'a web server',
+        'host': 'compute-17',
+        'project_id': 'project-id',
+        'user_id': 'user-id',
+        'image_ref': 'e' * 36,
+        'kernel_id': '',
+        'ramdisk_id': '',
+        'vm_state': 'building',
+        'task_state': 'scheduling',
+        'power_state': 0,
+        'memory_mb': 2048,
+        'vcpus': 2,
+        'root_gb': 20,
+        'ephemeral_gb': 0,
+        'launch_index': 0,
+        'key_name': 'mykey',
+        'key_data': 'ssh-rsa ' + 'A' * 372 + ' user@host',
+        'user_data': 'I2Nsb3VkLWNvbmZpZw==' * 20,
+        'availability_zone': 'nova',
+        'created_at': '2012-10-16T12:00:00.000000',
+        'updated_at': None,
+        'launched_at': None,
+        'terminated_at': None,
+        'deleted': False,
+        'metadata': [{'key': 'key-%d' % i, 'value': 'value-%d' % i,
+                      'id': i, 'deleted': False}
+                     for i in xrange(metadata_count)],
+        'instance_type': {'id': 5, 'name': 'm1.small', 'memory_mb': 2048,
+                          'vcpus': 2, 'root_gb': 20, 'ephemeral_gb': 0,
+                          'flavorid': '2', 'swap': 0, 'rxtx_factor': 1.0,
+                          'vcpu_weight': None, 'disabled': False,
+                          'is_public': True, 'extra_specs': {}},
+        'security_groups': [{'id': 1, 'name': 'default',
+                             'description': 'default', 'rules': []}],
+        'info_cache': {'network_info': fake_network_info(vif_count)},
+    }
+    return instance
+
+
+def fake_payloads(metadata_count, vif_count):
+    run_instance = {'method': 'run_instance',
+                    'version': '2.0',
+                    'args': {'instance': fake_instance(metadata_count,
+                                                       vif_count),
+                             'request_spec': {'num_instances': 1},
+                             'filter_properties': {'retry': {'num_attempts':
+                                                             1}},
+                             'requested_networks': None,
+                             'injected_files': [],
+                             'admin_password': 'secret',
+                             'is_first_time': True}}
+    run_instance.update(fake_context())
+    nw_info_reply = {'result': fake_network_info(vif_count),
+                     'failure': None}
+    return [('run_instance', run_instance),
+            ('nw_info reply', nw_info_reply)]
+
+
+def zmq_codec(serializer, threshold):
+    def encode(data):
+        return rpc_common.serialize_msg(data, serializer, threshold)
+    return encode, rpc_common.deserialize_msg
+
+
+def kombu_codec(serializer, threshold):
+    def encode(data):
+        content_type, content_encoding, body = kombu.serialization.encode(
+                data, serializer=serializer)
+        compression = None
+        if threshold and len(body) > threshold:
+            body, compression = kombu.compression.compress(body, 'zlib')
+        return content_type, content_encoding, compression, body
+
+    def decode(message):
+        content_type, content_encoding, compression, body = message
+        if compression:
+            body = kombu.compression.decompress(body, compression)
+        return kombu.serialization.decode(body, content_type,
+                                          content_encoding)
+
+    return encode, decode
+
+
+def timed(repeat, func, *args):
+    start = time.time()
+    for x in xrange(repeat):
+        result = func(*args)
+    return (time.time() - start) / repeat * 1000000, result
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--repeat', type='int', default=1000,
+                      help='number of times each payload is encoded')
+    parser.add_option('--metadata', type='int', default=20,
+                      help='number of metadata items of the instance')
+    parser.add_option('--vifs', type='int', default=2,
+                      help='number of vifs of the instance')
+    parser.add_option('--threshold', type='int', default=1024,
+                      help='compression threshold in bytes')
+    options, _args = parser.parse_args()
+
+    serializers = ['json']
+    if rpc_common.msgpack is not None:
+        serializers.append('msgpack')
+    drivers = [('zmq', zmq_codec)]
+    if kombu is not None:
+        drivers.append(('kombu', kombu_codec))
+
+    print '%-6s %-14s %-8s %-6s %12s %12s %10s' % ('driver', 'payload',
+            'format', 'zlib', 'encode (us)', 'decode (us)', 'bytes')
+    for payload_name, payload in fake_payloads(options.metadata,
+                                               options.vifs):
+        for driver, codec in drivers:
+            for serializer in serializers:
+                for threshold in (0, options.threshold):
+                    encode, decode = codec(serializer, threshold)
+                    encode_us, message = timed(options.repeat, encode,
+                                               payload)
+                    decode_us, _result = timed(options.repeat, decode,
+                                               message)
+                    if driver == 'kombu':
+                        size = len(message[-1])
+                    else:
+                        size = len(message)
+                    print '%-6s %-14s %-8s %-6s %12.1f %12.1f %10d' % (
+                            driver, payload_name, serializer,
+                            threshold and 'yes' or 'no', encode_us,
+                            decode_us, size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark for the security group rules of IptablesFirewallDriver.
+
+Populates a database with instances spread over security groups, each group
+holding cidr rules and a rule granting access to the members of another
+group, then times:
+
+  * boot: prepare_instance_filter() for every instance of the host.
+  * rules refresh: refresh_security_group_rules() after a rule was added
+    to one of the groups.
+  * members refresh: refresh_security_group_members() for one group.
+  * apply: a single IptablesManager.apply() of the resulting tables.
+
+iptables itself is not run, and the network API is replaced by a fake that
+counts the network info lookups.
+
+Run like:
+
+    ./tools/benchmarks/security_groups.py --instances 500 --groups 20
+"""
+
+import gettext
+import optparse
+import os
+import sys
+import time
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova import context
+from nova import db
+from nova.db import migration
+from nova import flags
+from nova import network
+from nova.network import linux_net
+from nova.network import model as network_model
+from nova.virt import firewall
+
+
+FLAGS = flags.FLAGS
+
+
+def fake_ip(index):
+    return '10.%d.%d.%d' % (index / 65536, index / 256 % 256, index % 256)
+
+
+def legacy_network_info(index):
+    network_ref = {'bridge': 'br100',
+                   'cidr': '10.0.0.0/8',
+                   'cidr_v6': None,
+                   'id': 1,
+                   'injected': False,
+                   'multi_host': False,
+                   'vlan': None}
+    mapping = {'broadcast': '10.255.255.255',
+               'dhcp_server': '10.0.0.1',
+               'dns': [],
+               'gateway': '10.0.0.1',
+               'gateway_v6': None,
+               'ip6s': [],
+               'ips': [{'enabled': '1',
+                        'ip': fake_ip(index),
+                        'netmask': '255.0.0.0'}],
+               'label': 'fake',
+               'mac': '02:16:3e:%02x:%02x:%02x' % (index / 65536,
+                                                   index / 256 % 256,
+                                                   index % 256),
+               'rxtx_cap': 0,
+               'should_create_bridge': False,
+               'should_create_vlan': False,
+               'vif_uuid': 'vif-%d' % index}
+    return [(network_ref, mapping)]
+
+
+def populate(ctxt, instance_count, group_count, rules_per_group):
+    groups = []
+    for i in xrange(group_count):
+        groups.append(db.security_group_create(ctxt,
+                {'user_id': ctxt.user_id,
+                 'project_id': ctxt.project_id,
+                 'name': 'group-%d' % i,
+                 'description': 'group %d' % i}))
+
+    for i, group in enumerate(groups):
+        for j in xrange(rules_per_group):
+            db.security_group_rule_create(ctxt,
+                    {'parent_group_id': group['id'],
+                     'protocol': 'tcp',
+                     'from_port': 1000 + j,
+                     'to_port': 1000 + j,
+                     'cidr': '192.168.%d.0/24' % j})
+        # Let the members of the next group in
+        db.security_group_rule_create(ctxt,
+                {'parent_group_id': group['id'],
+                 'protocol': 'tcp',
+                 'from_port': 22,
+                 'to_port': 22,
+                 'group_id': groups[(i + 1) % group_count]['id']})
+
+    instances = []
+    for i in xrange(instance_count):
+        instance = db.instance_create(ctxt, {'host': FLAGS.host,
+                                             'project_id': ctxt.project_id,
+                                             'user_id': ctxt.user_id})
+        for group in (groups[i % group_count],
+                      groups[(i * 7 + 3) % group_count]):
+            db.instance_add_security_group(ctxt, instance['uuid'],
+                                           group['id'])
+        instances.append(db.instance_get(ctxt, instance['id']))
+    return groups, instances
+
+
+def stub_out_network(lookups):
+    def get_instance_nw_info(self, context, instance):
+        lookups.append(instance['id'])
+        subnet = network_model.Subnet(cidr='10.0.0.0/8',
+                ips=[network_model.FixedIP(address=fake_ip(instance['id']))])
+        vif = network_model.VIF(network=network_model.Network(
+                subnets=[subnet]))
+        return network_model.NetworkInfo([vif])
+
+    network.API.get_instance_nw_info = get_instance_nw_info
+
+
+def stub_out_iptables():
+    def execute(*cmd, **kwargs):
+        if cmd[0].endswith('-save'):
+            return '*%s\nCOMMIT\n' % cmd[2], ''
+        return '', ''
+
+    linux_net.iptables_manager.execute = execute
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--instances', type='int', default=500,
+                      help='number of instances on the host')
+    parser.add_option('--groups', type='int', default=20,
+                      help='number of security groups they share')
+    parser.add_option('--rules', type='int', default=5,
+                      help='number of cidr rules per security group')
+    parser.add_option('--sql_connection', default='sqlite://',
+                      help='database to run against; it must be empty')
+    options, _args = parser.parse_args()
+
+    flags.parse_args([sys.argv[0]])
+    FLAGS.set_override('sql_connection', options.sql_connection)
+    FLAGS.set_override('use_ipv6', False)
+    migration.db_sync()
+
+    ctxt = context.get_admin_context()
+    ctxt.user_id = 'bench-user'
+    ctxt.project_id = 'bench-project'
+    groups, instances = populate(ctxt, options.instances, options.groups,
+                                 options.rules)
+
+    lookups = []
+    stub_out_network(lookups)
+    stub_out_iptables()
+    driver = firewall.IptablesFirewallDriver()
+
+    def boot():
+        for instance in instances:
+            driver.prepare_instance_filter(
+                    instance, legacy_network_info(instance['id']))
+
+    def add_rule_and_refresh():
+        db.security_group_rule_create(ctxt,
+                {'parent_group_id': groups[0]['id'],
+                 'protocol': 'udp',
+                 'from_port': 53,
+                 'to_port': 53,
+                 'cidr': '192.168.100.0/24'})
+        driver.refresh_security_group_rules(groups[0]['id'])
+
+    cases = [
+        ('boot', boot),
+        ('rules refresh', add_rule_and_refresh),
+        ('members refresh',
+         lambda: driver.refresh_security_group_members(groups[1]['id'])),
+        ('apply', linux_net.iptables_manager.apply),
+    ]
+
+    print '%-16s %12s %14s %12s' % ('case', 'time (ms)', 'nw lookups',
+                                    'rules')
+    for name, func in cases:
+        del lookups[:]
+        elapsed = timed(func)
+        rules = len(linux_net.iptables_manager.ipv4['filter'].rules)
+        print '%-16s %12.1f %14d %12d' % (name, elapsed * 1000,
+                                         len(lookups), rules)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Throughput benchmark for the sparse_copy of the XenAPI driver.
+
+Creates a sparse file with random data scattered through it and a run of
+written zeros, like a partition copied on a resize down, then copies it with:
+
+  * 4k loop: the former sparse_copy, which reads 4k strings and compares
+    each of them to a string of zeros.
+  * vm_utils._sparse_copy() for each of --block_sizes.
+
+and prints the time, throughput and bytes allocated for each copy.
+
+Run like:
+
+    ./tools/benchmarks/sparse_copy.py --size 1024 --data 10
+"""
+
+import gettext
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova import flags
+from nova.virt.xenapi import vm_utils
+
+
+FLAGS = flags.FLAGS
+
+MB = 1024 * 1024
+
+
+def make_source(path, size, data_pct, zeros_pct):
+    """Writes data_pct percent of size as random 64k..1M extents and
+    zeros_pct percent as one run of written zeros."""
+    with open(path, 'wb') as src:
+        src.truncate(size)
+        data_left = size * data_pct / 100
+        while data_left > 0:
+            length = min(random.randint(64 * 1024, MB), data_left)
+            src.seek(random.randrange(0, size - length))
+            src.write(os.urandom(length))
+            data_left -= length
+        zeros = size * zeros_pct / 100
+        src.seek(random.randrange(0, size - zeros + 1))
+        for x in xrange(zeros / MB):
+            src.write('\0' * MB)
+
+
+def legacy_copy(src_path, dst_path, virtual_size, block_size=4096):
+    empty_block = '\0' * block_size
+    left = virtual_size
+    with open(src_path, 'r') as src:
+        with open(dst_path, 'w') as dst:
+            data = src.read(min(block_size, left))
+            while data:
+                if data == empty_block:
+                    dst.seek(block_size, os.SEEK_CUR)
+                else:
+                    dst.write(data)
+                left -= len(data)
+                if left <= 0:
+                    break
+                data = src.read(min(block_size, left))
+            dst.truncate(virtual_size)
+
+
+def same_contents(path1, path2):
+    with open(path1, 'rb') as file1:
+        with open(path2, 'rb') as file2:
+            while True:
+                data1 = file1.read(MB)
+                if data1 != file2.read(MB):
+                    return False
+                if not data1:
+                    return True
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--size', type='int', default=1024,
+                      help='size of the file copied in MB')
+    parser.add_option('--data', type='int', default=10,
+                      help='percentage of the file holding random data')
+    parser.add_option('--zeros', type='int', default=10,
+                      help='percentage of the file holding written zeros')
+    parser.add_option('--block_sizes', default='65536,1048576,4194304',
+                      help='comma separated read sizes for sparse_copy')
+    parser.add_option('--dir', default=None,
+                      help='directory to create the files in')
+    options, _args = parser.parse_args()
+
+    flags.parse_args([sys.argv[0]])
+
+    tmpdir = tempfile.mkdtemp(dir=options.dir)
+    try:
+        src_path = os.path.join(tmpdir, 'src')
+        dst_path = os.path.join(tmpdir, 'dst')
+        size = options.size * MB
+        make_source(src_path, size, options.data, options.zeros)
+
+        cases = [('4k loop', legacy_copy, {})]
+        for block_size in options.block_sizes.split(','):
+            cases.append(('sparse_copy %sk' % (int(block_size) / 1024),
+                          vm_utils._sparse_copy,
+                          {'block_size': int(block_size)}))
+
+        print '%-20s %12s %10s %14s' % ('copy', 'time (ms)', 'MB/s',
+                                        'allocated MB')
+        for name, copy, kwargs in cases:
+            start = time.time()
+            copy(src_path, dst_path, size, **kwargs)
+            elapsed = time.time() - start
+            if not same_contents(src_path, dst_path):
+                print >> sys.stderr, '%s: copy differs from source' % name
+            allocated = os.stat(dst_path).st_blocks * 512
+            print '%-20s %12.1f %10.1f %14.1f' % (name, elapsed * 1000,
+                                                  options.size / elapsed,
+                                                  float(allocated) / MB)
+            os.unlink(dst_path)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark for rpc.call() over the ZeroMQ driver.
+
+Runs the receiver of nova-rpc-zmq-receiver, a consumer serving an echo
+method and parallel green threads calling it, all in one process with
+their ipc:// sockets in a temporary directory.  It prints the calls per
+second:
+
+  * per call: a subscriber socket per call and a new socket per cast, the
+    defaults.
+  * shared: one subscriber socket for all replies and pooled sockets for
+    casts, as with rpc_zmq_single_reply_subscriber on and
+    rpc_zmq_socket_pool_size set to 30.
+
+Requires pyzmq.  Run like:
+
+    ./tools/benchmarks/zmq_calls.py --threads 10 --calls 200
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import gettext
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from eventlet.green import zmq
+
+from nova import context
+from nova import flags
+from nova.openstack.common import rpc
+from nova.openstack.common.rpc import dispatcher
+from nova.openstack.common.rpc import impl_zmq
+
+
+FLAGS = flags.FLAGS
+
+
+class EchoManager(object):
+    RPC_API_VERSION = '1.0'
+
+    def echo(self, context, value):
+        return value
+
+
+def start_receiver():
+    receiver = impl_zmq.ZmqProxy(FLAGS)
+    receiver.register(impl_zmq.InternalContext(None),
+                      'tcp://127.0.0.1:%d' % FLAGS.rpc_zmq_port, zmq.PULL,
+                      out_bind=True)
+    receiver.consume_in_thread()
+    return receiver
+
+
+def run_calls(ctxt, topic, thread_count, call_count):
+    def caller():
+        for x in xrange(call_count):
+            rpc.call(ctxt, topic, {'method': 'echo',
+                                   'args': {'value': x}})
+
+    pool = eventlet.GreenPool(thread_count)
+    start = time.time()
+    for x in xrange(thread_count):
+        pool.spawn_n(caller)
+    pool.waitall()
+    return time.time() - start
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--threads', type='int', default=10,
+                      help='number of parallel green threads')
+    parser.add_option('--calls', type='int', default=200,
+                      help='number of calls per thread')
+    parser.add_option('--port', type='int', default=19501,
+                      help='tcp port of the receiver')
+    options, _args = parser.parse_args()
+
+    ipc_dir = tempfile.mkdtemp()
+    flags.parse_args([sys.argv[0]])
+    FLAGS.set_override('rpc_backend', 'nova.openstack.common.rpc.impl_zmq')
+    FLAGS.set_override('host', '127.0.0.1')
+    impl_zmq.register_opts(FLAGS)
+    FLAGS.set_override('rpc_zmq_ipc_dir', ipc_dir)
+    FLAGS.set_override('rpc_zmq_port', options.port)
+
+    try:
+        receiver = start_receiver()
+        topic = 'bench_zmq_calls'
+        conn = rpc.create_connection(new=True)
+        conn.create_consumer(topic,
+                             dispatcher.RpcDispatcher([EchoManager()]))
+        conn.consume_in_thread()
+
+        ctxt = context.get_admin_context()
+        # Let the receiver bind the ipc:// sockets of the topics.
+        rpc.call(ctxt, topic, {'method': 'echo', 'args': {'value': 0}})
+
+        total = options.threads * options.calls
+        print '%-12s %12s %12s' % ('sockets', 'time (ms)', 'calls/s')
+        for name, shared, pool_size in (('per call', False, 0),
+                                        ('shared', True, 30)):
+            FLAGS.set_override('rpc_zmq_single_reply_subscriber', shared)
+            FLAGS.set_override('rpc_zmq_socket_pool_size', pool_size)
+            elapsed = run_calls(ctxt, topic, options.threads, options.calls)
+            print '%-12s %12.1f %12.1f' % (name, elapsed * 1000,
+                                           total / elapsed)
+
+        conn.close()
+        receiver.close()
+        rpc.cleanup()
+    finally:
+        shutil.rmtree(ipc_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()